@@ -0,0 +1,181 @@
+"""Admission control for the chat endpoints
+
+Every chat turn costs an LLM call, so the endpoints shed load early rather
+than letting requests pile up behind a slow upstream:
+
+* `RateLimiter` is a token bucket per key. The app keeps one keyed by
+  session and one keyed by client IP.
+* `AdmissionController` caps the number of chat turns in flight. A bounded
+  number of requests may wait for a slot for a short time; the rest are
+  turned away at once.
+
+Both raise `Rejected`, which the app turns into a 429 with Retry-After.
+Setting a rate or a limit to 0 disables that check, and keys listed in a
+limiter's `exempt` set are never limited. The per-IP limiter exempts
+RATE_LIMIT_EXEMPT_IPS, for example a load generator or a monitoring host.
+
+Given a shared state backend, `RateLimiter` keeps its buckets there so that
+the limits hold across workers. The in-flight cap is always per worker.
+"""
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from observability import Counter, Gauge
+from state_backend import StateError
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_SESSION_PER_MINUTE = float(os.getenv("RATE_LIMIT_SESSION_PER_MINUTE", 20))
+RATE_LIMIT_SESSION_BURST = int(os.getenv("RATE_LIMIT_SESSION_BURST", 5))
+RATE_LIMIT_IP_PER_MINUTE = float(os.getenv("RATE_LIMIT_IP_PER_MINUTE", 120))
+RATE_LIMIT_IP_BURST = int(os.getenv("RATE_LIMIT_IP_BURST", 30))
+CHAT_MAX_IN_FLIGHT = int(os.getenv("CHAT_MAX_IN_FLIGHT", 100))
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", 200))
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", 5.0))
+# Comma-separated client addresses the per-IP limit does not apply to. Loopback
+# is not exempt by default: behind a local proxy without TRUST_PROXY_HEADERS
+# every client looks like 127.0.0.1
+RATE_LIMIT_EXEMPT_IPS = frozenset(ip.strip() for ip in os.getenv("RATE_LIMIT_EXEMPT_IPS", "").split(",") if ip.strip())
+# Honour X-Forwarded-For only behind a proxy that sets it
+TRUST_PROXY_HEADERS = os.getenv("TRUST_PROXY_HEADERS", "false").lower() in ("1", "true", "yes")
+# Proxies in front of the app that each append the address they saw to X-Forwarded-For
+TRUSTED_PROXY_HOPS = max(1, int(os.getenv("TRUSTED_PROXY_HOPS", 1)))
+
+REJECTIONS = Counter("chat_rejections_total", "Chat requests turned away by admission control", ["reason"])
+IN_FLIGHT = Gauge("chat_in_flight", "Chat turns being handled")
+QUEUED = Gauge("chat_queued", "Chat requests waiting for a slot")
+
+
+class Rejected(Exception):
+    """A request was turned away; retry_after is in whole seconds"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def client_ip(request):
+    """Address of the client, taken from X-Forwarded-For when trusted
+
+    Only the entries appended by our own proxies can be trusted; anything to
+    their left was sent by the client, so the address is read TRUSTED_PROXY_HOPS
+    entries from the right.
+    """
+    if TRUST_PROXY_HEADERS:
+        forwarded = [ip.strip() for ip in request.headers.get("x-forwarded-for", "").split(",") if ip.strip()]
+        if forwarded:
+            return forwarded[-min(TRUSTED_PROXY_HOPS, len(forwarded))]
+    return request.client.host if request.client else "unknown"
+
+
+class RateLimiter:
+    """Token bucket per key, holding at most `max_keys` buckets in process or any number in `state`"""
+
+    def __init__(self, name, per_minute, burst, max_keys=100000, state=None, exempt=()):
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.burst = max(1, burst)
+        self.max_keys = max_keys
+        self.state = state
+        self.exempt = frozenset(exempt)
+        self._lock = threading.Lock()
+        # key -> (tokens, time of last update); least recently used first
+        self._buckets = OrderedDict()
+
+    def check(self, key):
+        """Take a token for key or raise Rejected"""
+        if self.rate <= 0 or not key or key in self.exempt:
+            return
+        if self.state is not None:
+            self._check_shared(key)
+            return
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            # Buckets that fell out would have refilled to full anyway
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        if not allowed:
+            REJECTIONS.inc(reason=self.name)
+            raise Rejected(self.name, (1 - tokens) / self.rate)
+
+    def _check_shared(self, key):
+        try:
+            wait = self.state.take_token(f"rate:{self.name}:{key}", self.rate, self.burst)
+        except StateError as e:
+            # Better to serve without a limit than to fail every chat turn
+            logger.warning("Rate limit %s unavailable: %s", self.name, e)
+            return
+        if wait > 0:
+            REJECTIONS.inc(reason=self.name)
+            raise Rejected(self.name, wait)
+
+
+class Slot:
+    """A held in-flight slot; release() may be called more than once"""
+
+    def __init__(self, controller):
+        self._controller = controller
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release()
+
+
+class AdmissionController:
+    """Global cap on chat turns in flight with a bounded wait queue"""
+
+    def __init__(self, max_in_flight=CHAT_MAX_IN_FLIGHT, max_queue=CHAT_MAX_QUEUE, queue_timeout=CHAT_QUEUE_TIMEOUT):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters = 0
+        self._semaphore = asyncio.Semaphore(max_in_flight) if max_in_flight > 0 else None
+
+    async def acquire(self):
+        """Wait for an in-flight slot or raise Rejected"""
+        if self._semaphore is None:
+            return Slot(self)
+
+        if self._semaphore.locked():
+            if self._waiters >= self.max_queue:
+                REJECTIONS.inc(reason="queue_full")
+                raise Rejected("queue_full", self.queue_timeout)
+            self._waiters += 1
+            QUEUED.inc()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                REJECTIONS.inc(reason="queue_timeout")
+                raise Rejected("queue_timeout", self.queue_timeout)
+            finally:
+                self._waiters -= 1
+                QUEUED.dec()
+        else:
+            await self._semaphore.acquire()
+
+        self.in_flight += 1
+        IN_FLIGHT.inc()
+        return Slot(self)
+
+    def _release(self):
+        if self._semaphore is None:
+            return
+        self.in_flight -= 1
+        IN_FLIGHT.dec()
+        self._semaphore.release()
@@ -1,43 +1,250 @@
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, APIRouter, Request, HTTPException
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, Response, PlainTextResponse
+from starlette.background import BackgroundTask
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
+import asyncio
 import os
-import openai
+import logging
+import time
 from dotenv import load_dotenv
-import re
-import json
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from datetime import datetime
-import uuid
-import uvicorn
 
-# Load environment variables
+# Load environment variables before the modules below read their settings
 load_dotenv()
 
-# Initialize FastAPI app
-app = FastAPI(title="Alligator.tour Travel Assistant")
-
-# Configure CORS to allow embedding in existing website
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, specify your main website domain
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
-
-# Initialize templates
-templates = Jinja2Templates(directory="templates")
-
-# Initialize OpenAI API
-openai.api_key = os.getenv("OPENAI_API_KEY")
+import json
+from datetime import datetime
+import uuid
+import llm_client
+from conversation_store import create_conversation_store
+from context_window import ContextManager
+from response_cache import ResponseCache, make_cache_key, normalize_message
+from concurrency import SessionLocks, SharedSessionLocks, SingleFlight
+from state_backend import STATE_BACKEND_URL, create_state_backend
+from lead_queue import LeadQueue
+from retention import RetentionJob
+from content_registry import ContentRegistry
+from destination_matcher import DestinationIndex
+from knowledge_index import KnowledgeIndex
+from intent_router import IntentRouter, record_turn, record_llm_usage
+from prompt_registry import PromptRegistry
+from contact_extractor import extract_contact
+from session_profile import client_delta, extract_profile_delta, merge_profile, public_profile, render_profile
+from static_assets import AssetManifest, PrecompressedStaticFiles
+from page_cache import PageCache, page_response
+from profiler import Profiler, ProfilerMiddleware, PROFILER_HEADER, to_collapsed, to_speedscope
+from admission import AdmissionController, RateLimiter, Rejected, client_ip, RATE_LIMIT_SESSION_PER_MINUTE, RATE_LIMIT_SESSION_BURST, RATE_LIMIT_IP_PER_MINUTE, RATE_LIMIT_IP_BURST, RATE_LIMIT_EXEMPT_IPS
+from observability import setup_logging, shutdown_logging, render_metrics, span, Counter, SharedMetrics, HTTP_REQUEST_DURATION, HTTP_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+CHAT_TURNS = Counter("chat_turns_total", "Chat turns handled", ["endpoint", "lang", "cache"])
+LEADS_CAPTURED = Counter("leads_captured_total", "Contacts captured from chat messages", ["kind"])
+KNOWLEDGE_LOOKUPS = Counter("knowledge_lookups_total", "Catalog lookups for chat messages", ["lang", "outcome"])
+CHAT_FALLBACKS = Counter("chat_fallback_replies_total", "Chat turns answered with the canned reply after an error", ["lang"])
+CHAT_COALESCED = Counter("chat_coalesced_total", "Chat requests answered with the reply to an identical request in flight", ["endpoint"])
+
+# Worker processes started by `python app.py` and gunicorn.conf.py; more
+# than one needs STATE_BACKEND_URL so that the workers share sessions. All
+# the workers sharing a state backend must run on one host
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 1) if STATE_BACKEND_URL else 1))
+
+# Routes that answer while the app is still warming up
+WARM_UP_EXEMPT_PATHS = ("/health/live", "/health/ready", "/metrics")
+
+# Content, indexes, prompts and stores are built by warm_up() once the server
+# has started, so that importing this module does no I/O
+templates = None
+asset_manifest = None
+content_registry = None
+page_cache = None
+destination_index = None
+knowledge_index = None
+intent_router = None
+prompt_registry = None
+conversation_store = None
+retention_job = None
+context_manager = None
+response_cache = None
+lead_queue = None
+
+# Set when warm_up() has finished, or with the error it failed with
+warm_up_seconds = None
+warm_up_error = None
+
+# Sessions, locks, limits, caches and metrics shared between workers when
+# STATE_BACKEND_URL is set; nothing connects until first use
+state = create_state_backend()
+shared_state = state if state.shared else None
+shared_metrics = SharedMetrics(state) if state.shared else None
+
+# Rate limits per session and per client IP, and a cap on chat turns in flight per worker
+session_limiter = RateLimiter("session", RATE_LIMIT_SESSION_PER_MINUTE, RATE_LIMIT_SESSION_BURST, state=shared_state)
+ip_limiter = RateLimiter("ip", RATE_LIMIT_IP_PER_MINUTE, RATE_LIMIT_IP_BURST, state=shared_state, exempt=RATE_LIMIT_EXEMPT_IPS)
+admission_controller = AdmissionController()
+
+# Turns of a session run one at a time; identical messages in flight share a reply
+session_locks = SharedSessionLocks(state) if state.shared else SessionLocks()
+chat_flights = SingleFlight(shared_state)
+
+# Samples requests that ask for it with the profiler secret, or a share of all requests
+profiler = Profiler()
+
+router = APIRouter()
+
+def warm_up():
+    """Load everything the routes need and start the background workers"""
+    global templates, asset_manifest, content_registry, page_cache, destination_index, knowledge_index
+    global intent_router, prompt_registry, conversation_store, retention_job, context_manager, response_cache, lead_queue
+    
+    # Fail readiness rather than serve with state the other workers cannot see
+    if state.shared:
+        state.ping()
+        # History and leads are kept in SQLite files on this host, which workers elsewhere cannot see
+        other_hosts = shared_metrics.other_hosts()
+        if other_hosts:
+            raise RuntimeError(f"STATE_BACKEND_URL is already used by workers on {', '.join(other_hosts)}; "
+                               "all workers sharing it must run on one host")
+    elif WEB_CONCURRENCY > 1:
+        logger.warning("Running %d workers without STATE_BACKEND_URL: sessions, limits and caches are not shared", WEB_CONCURRENCY)
+    
+    # Initialize templates
+    templates = Jinja2Templates(directory="templates")
+    
+    # Fingerprinted asset URLs and responsive image variants from build_assets.py
+    asset_manifest = AssetManifest()
+    templates.env.globals.update(
+        asset_url=asset_manifest.url,
+        image_src=asset_manifest.image_src,
+        image_srcset=asset_manifest.image_srcset
+    )
+    
+    # Translations and destinations, loaded once and reloaded when the files change
+    content_registry = ContentRegistry()
+    
+    # Rendered chat pages with their ETags and compressed copies
+    page_cache = PageCache()
+    
+    # Multilingual destination names, indexed once for fast matching
+    destination_index = DestinationIndex.from_files()
+    
+    # Catalog facts, to answer simple questions directly and ground the others
+    knowledge_index = KnowledgeIndex.from_file(destination_index)
+    
+    # Picks the model and token budget for each turn, or a templated reply
+    intent_router = IntentRouter(destination_index)
+    
+    # Import the OpenAI client now rather than on the first chat turn
+    llm_client.load()
+    
+    # System prompts per language, loaded once from prompts/system/<version>/
+    prompt_registry = PromptRegistry()
+    
+    # Conversation history storage
+    conversation_store = create_conversation_store(shared_state)
+    retention_job = RetentionJob(conversation_store, state=shared_state)
+    
+    # Keeps prompts within the token budget by summarizing older turns
+    context_manager = ContextManager(state=shared_state)
+    
+    # Cache of replies to repeated questions
+    response_cache = ResponseCache(state=shared_state)
+    
+    # Leads are saved to Google Sheets in the background
+    lead_queue = LeadQueue()
+    
+    lead_queue.start()
+    retention_job.start()
+    if shared_metrics:
+        shared_metrics.start()
+
+async def run_warm_up():
+    """Warm up off the event loop, so that the health checks answer meanwhile"""
+    global warm_up_seconds, warm_up_error
+    start = time.perf_counter()
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, warm_up)
+    except Exception as e:
+        warm_up_error = f"{type(e).__name__}: {e}"
+        logger.error("Warm-up failed: %s", warm_up_error)
+        return
+    warm_up_seconds = time.perf_counter() - start
+    logger.info("Warm-up finished in %.2fs", warm_up_seconds)
+
+@asynccontextmanager
+async def lifespan(app):
+    """Warm up in the background once the server is up; flush everything on shutdown"""
+    # Structured logging through a background queue
+    setup_logging()
+    warm_up_task = asyncio.create_task(run_warm_up())
+    try:
+        yield
+    finally:
+        # Shut down whatever the warm-up got as far as starting
+        await warm_up_task
+        await llm_client.close()
+        if retention_job:
+            retention_job.stop()
+        if conversation_store:
+            conversation_store.close()
+        if lead_queue:
+            lead_queue.stop()
+        if shared_metrics and shared_metrics.worker:
+            shared_metrics.stop()
+        state.close()
+        shutdown_logging()
+
+def create_app():
+    """Create the FastAPI application; nothing is loaded until it starts"""
+    app = FastAPI(title="Alligator.tour Travel Assistant", lifespan=lifespan)
+    
+    # Added first so that it is innermost and the route runs in the profiled task
+    if profiler.enabled:
+        app.add_middleware(ProfilerMiddleware, profiler=profiler)
+    
+    # Configure CORS to allow embedding in existing website
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # In production, specify your main website domain
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.middleware("http")(require_warm_up)
+    app.middleware("http")(record_request_metrics)
+    app.exception_handler(Rejected)(rejected_handler)
+    
+    # Mount static files, serving precompressed copies when the client accepts them
+    app.mount("/static", PrecompressedStaticFiles(directory="static"), name="static")
+    app.include_router(router)
+    return app
+
+# Record latency and status of every request
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Use the route template so that path parameters don't explode the label set
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", "unmatched")
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, method=request.method, route=route_path, status=status)
+        HTTP_REQUESTS.inc(method=request.method, route=route_path, status=status)
+
+# Answer 503 until warm-up has finished, except for the health checks
+async def require_warm_up(request: Request, call_next):
+    if warm_up_seconds is None and request.url.path not in WARM_UP_EXEMPT_PATHS:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Starting up"},
+            headers={"Retry-After": "1"}
+        )
+    return await call_next(request)
 
 # Language support
 SUPPORTED_LANGUAGES = {
@@ -77,95 +284,6 @@ Sunt aici pentru a te ajuta să planifici o experiență de vacanță uimitoare.
 ✨ Unde te gândești să călătorești? Sau dacă nu ești încă sigur, aș fi bucuros să îți sugerez câteva destinații fantastice bazate pe interesele tale!"""
 }
 
-# Destination information in different languages
-DESTINATIONS = {
-    "en": [
-        {
-            "name": "Bali, Indonesia",
-            "description": "Tropical paradise with beaches, temples, and rice terraces",
-            "best_time": "April to October"
-        },
-        {
-            "name": "Barcelona, Spain",
-            "description": "Stunning architecture, Mediterranean beaches, and vibrant culture",
-            "best_time": "May to June, September to October"
-        },
-        {
-            "name": "Tokyo, Japan",
-            "description": "Blend of ultramodern and traditional with amazing food",
-            "best_time": "March to May, September to November"
-        }
-    ],
-    "de": [
-        {
-            "name": "Bali, Indonesien",
-            "description": "Tropisches Paradies mit Stränden, Tempeln und Reisterrassen",
-            "best_time": "April bis Oktober"
-        },
-        {
-            "name": "Barcelona, Spanien",
-            "description": "Atemberaubende Architektur, Mittelmeerstrände und lebendige Kultur",
-            "best_time": "Mai bis Juni, September bis Oktober"
-        },
-        {
-            "name": "Tokio, Japan",
-            "description": "Mischung aus ultramodern und traditionell mit erstaunlichem Essen",
-            "best_time": "März bis Mai, September bis November"
-        }
-    ],
-    "uk": [
-        {
-            "name": "Балі, Індонезія",
-            "description": "Тропічний рай з пляжами, храмами та рисовими терасами",
-            "best_time": "Квітень - Жовтень"
-        },
-        {
-            "name": "Барселона, Іспанія",
-            "description": "Вражаюча архітектура, середземноморські пляжі та яскрава культура",
-            "best_time": "Травень - Червень, Вересень - Жовтень"
-        },
-        {
-            "name": "Токіо, Японія",
-            "description": "Поєднання ультрасучасного і традиційного з дивовижною їжею",
-            "best_time": "Березень - Травень, Вересень - Листопад"
-        }
-    ],
-    "ru": [
-        {
-            "name": "Бали, Индонезия",
-            "description": "Тропический рай с пляжами, храмами и рисовыми террасами",
-            "best_time": "Апрель - Октябрь"
-        },
-        {
-            "name": "Барселона, Испания",
-            "description": "Потрясающая архитектура, средиземноморские пляжи и яркая культура",
-            "best_time": "Май - Июнь, Сентябрь - Октябрь"
-        },
-        {
-            "name": "Токио, Япония",
-            "description": "Сочетание ультрасовременного и традиционного с удивительной едой",
-            "best_time": "Март - Май, Сентябрь - Ноябрь"
-        }
-    ],
-    "ro": [
-        {
-            "name": "Bali, Indonezia",
-            "description": "Paradis tropical cu plaje, temple și terase de orez",
-            "best_time": "Aprilie - Octombrie"
-        },
-        {
-            "name": "Barcelona, Spania",
-            "description": "Arhitectură uimitoare, plaje mediteraneene și cultură vibrantă",
-            "best_time": "Mai - Iunie, Septembrie - Octombrie"
-        },
-        {
-            "name": "Tokyo, Japonia", 
-            "description": "Amestec de ultramodern și tradițional cu mâncare uimitoare",
-            "best_time": "Martie - Mai, Septembrie - Noiembrie"
-        }
-    ]
-}
-
 # Pydantic models for request/response validation
 class ChatRequest(BaseModel):
     message: str
@@ -177,7 +295,7 @@ class LanguageRequest(BaseModel):
     lang: str
 
 # Routes
-@app.get("/", response_class=HTMLResponse)
+@router.get("/", response_class=HTMLResponse)
 async def get_chat_interface(request: Request, lang: str = "uk"):
     """Serve the chat interface page"""
     if lang not in SUPPORTED_LANGUAGES:
@@ -186,69 +304,151 @@ async def get_chat_interface(request: Request, lang: str = "uk"):
     # Get the current year for the copyright notice
     current_year = datetime.now().year
     
-    # Load translations
-    try:
-        with open('static/translations.json', 'r', encoding='utf-8') as f:
-            translations = json.load(f)
-    except Exception as e:
-        print(f"Error loading translations: {e}")
-        translations = {}
-    
-    return templates.TemplateResponse(
-        "assistant.html",
-        {
-            "request": request,
-            "lang": lang,
-            "lang_name": SUPPORTED_LANGUAGES[lang],
-            "supported_languages": SUPPORTED_LANGUAGES,
-            "welcome_message": WELCOME_MESSAGES[lang],
-            "destinations": DESTINATIONS.get(lang, DESTINATIONS["en"]),
-            "current_year": current_year,
-            "translations": translations
-        }
+    # The page is only rendered again when the year or the content changes
+    content = content_registry.get(lang)
+    page = page_cache.get(
+        lang,
+        (current_year, content_registry.version),
+        lambda: render_chat_interface(lang, current_year, content)
     )
-
-@app.post("/api/chat")
-async def chat(chat_request: ChatRequest):
-    """API endpoint for chat interactions"""
-    # Generate a session ID if none provided
-    session_id = chat_request.session_id or str(uuid.uuid4())
+    return page_response(page, request)
+
+@router.get("/api/translations/{lang}")
+async def get_translations(request: Request, lang: str):
+    """Serve the translations for one language with caching headers"""
+    # No fallback here: the client caches the response under the language it asked for
+    content = content_registry.get(lang, fallback=False) if lang in SUPPORTED_LANGUAGES else None
+    if content is None:
+        raise HTTPException(status_code=404, detail="Translations not available")
     
-    # Extract travel info from message
-    travel_info = extract_travel_info(chat_request.message)
+    headers = {
+        "ETag": content.etag,
+        "Cache-Control": "public, max-age=300",
+        "Vary": "Accept-Encoding"
+    }
+    if request.headers.get("if-none-match") == content.etag:
+        return Response(status_code=304, headers=headers)
     
-    # Extract contact info from message
-    contact_info = extract_email(chat_request.message) or extract_phone(chat_request.message)
-    if contact_info:
-        # Create a contact record
-        contact_data = {
-            "name": chat_request.user_info.get("name", "Not provided") if chat_request.user_info else "Not provided",
-            "contact": contact_info,
-            "destination": travel_info.get("destination", "Not specified"),
-            "interests": chat_request.user_info.get("interests", []) if chat_request.user_info else [],
-            "budget": chat_request.user_info.get("budget") if chat_request.user_info else None,
-            "language": chat_request.lang
-        }
-        
-        # Save contact to sheet
-        save_contact_to_sheet(contact_data)
-    
-    # Get AI response
-    response = get_ai_response(
-        message=chat_request.message,
-        lang=chat_request.lang,
-        session_id=session_id,
-        user_info=chat_request.user_info
+    return Response(content=content.json, media_type="application/json", headers=headers)
+
+async def rejected_handler(request: Request, exc: Rejected):
+    """Turn requests away quickly when rate limited or overloaded"""
+    logger.warning("Rejected chat request: %s", exc.reason)
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many requests", "reason": exc.reason, "retry_after": exc.retry_after},
+        headers={"Retry-After": str(exc.retry_after)}
     )
+
+@router.post("/api/chat")
+async def chat(chat_request: ChatRequest, request: Request):
+    """API endpoint for chat interactions"""
+    await state.run(check_rate_limits, request, chat_request.session_id)
+    slot = await admission_controller.acquire()
+    try:
+        # Generate a session ID if none provided
+        session_id = chat_request.session_id or str(uuid.uuid4())
+        
+        # Update the session's profile and get the AI response; messages with
+        # contact details are never cached
+        response, cache_hit, detected_info, contact_info = await get_ai_response(chat_request, session_id)
+    finally:
+        slot.release()
+    
+    CHAT_TURNS.inc(endpoint="chat", lang=chat_request.lang, cache="hit" if cache_hit else "miss")
     
     return {
         "response": response,
         "session_id": session_id,
         "contact_saved": bool(contact_info),
-        "detected_info": travel_info
+        "detected_info": detected_info,
+        "cache": "hit" if cache_hit else "miss"
     }
 
-@app.post("/api/language")
+@router.post("/api/chat/stream")
+async def chat_stream(chat_request: ChatRequest, request: Request):
+    """API endpoint for chat interactions that streams the reply as server-sent events"""
+    # Admission happens before the stream starts so that it can still answer 429
+    await state.run(check_rate_limits, request, chat_request.session_id)
+    slot = await admission_controller.acquire()
+    session_id = chat_request.session_id or str(uuid.uuid4())
+    
+    async def event_stream():
+        try:
+            turn = {}
+            async for token in stream_ai_response(chat_request, session_id, turn):
+                if token is None:
+                    # Send the metadata first so the client can update its state right away
+                    yield format_sse("meta", {
+                        "session_id": session_id,
+                        "contact_saved": bool(turn["contact"]),
+                        "detected_info": turn["profile"]
+                    })
+                    continue
+                yield format_sse("token", {"text": token})
+            
+            cache_status = "hit" if turn.get("cache_hit") else "miss"
+            CHAT_TURNS.inc(endpoint="chat_stream", lang=chat_request.lang, cache=cache_status)
+            yield format_sse("done", {"cache": cache_status})
+        finally:
+            slot.release()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Stop nginx from buffering the stream
+        },
+        # Also frees the slot if the stream never starts
+        background=BackgroundTask(slot.release)
+    )
+
+@router.get("/health/live")
+async def liveness():
+    """Liveness check: fails only if warm-up failed and a restart is needed"""
+    if warm_up_error:
+        return JSONResponse(status_code=500, content={"status": "failed", "error": warm_up_error})
+    return {"status": "alive"}
+
+@router.get("/health/ready")
+async def readiness():
+    """Readiness check: succeeds once warm-up has finished"""
+    if warm_up_seconds is None:
+        return JSONResponse(status_code=503, content={"status": "failed" if warm_up_error else "warming_up"})
+    return {"status": "ready", "warm_up_seconds": round(warm_up_seconds, 3)}
+
+@router.get("/admin/profiles")
+async def list_profiles(request: Request):
+    """List the request profiles kept in memory, newest first"""
+    check_profiler_token(request)
+    return {"profiles": [profile.summary() for profile in reversed(profiler.profiles)]}
+
+@router.get("/admin/profiles/aggregate")
+async def aggregate_profiles(request: Request, path: str = None, format: str = "speedscope"):
+    """All kept profiles merged, optionally for one path only"""
+    check_profiler_token(request)
+    return profile_response(profiler.aggregate(path), f"aggregate {path or 'all'}", format)
+
+@router.get("/admin/profiles/{profile_id}")
+async def get_profile(request: Request, profile_id: str, format: str = "speedscope"):
+    """One request profile as speedscope JSON or collapsed stacks"""
+    check_profiler_token(request)
+    profile = profiler.find(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile_response(profile.samples, f"{profile.method} {profile.path} {profile.id}", format)
+
+@router.get("/metrics")
+async def metrics():
+    """Expose metrics in the Prometheus text format, summed over all workers when they share state"""
+    if shared_metrics and shared_metrics.worker:
+        text = await state.run(shared_metrics.render)
+    else:
+        text = render_metrics()
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+@router.post("/api/language")
 async def change_language(language_request: LanguageRequest):
     """API endpoint for changing language"""
     lang = language_request.lang
@@ -262,30 +462,86 @@ async def change_language(language_request: LanguageRequest):
     }
 
 # Helper functions
-def extract_email(message):
-    """Extract email address from message"""
-    email_pattern = r'[^\s@]+@[^\s@]+\.[^\s@]+'
-    email_match = re.search(email_pattern, message)
-    if email_match:
-        email = email_match.group(0).strip(',.!?;:()')
-        print(f"Found email: {email}")
-        return email
-    return None
-
-def extract_phone(message):
-    """Extract phone number from message"""
-    # First try to find formatted phone numbers
-    phone_pattern = r'(?:\+?\d{1,3}[-.\s]?)?(?:\(?\d{3}\)?[-.\s]?)?\d{3}[-.\s]?\d{4}'
-    phone_match = re.search(phone_pattern, message)
-    if phone_match:
-        return phone_match.group(0)
-    
-    # Look for any sequence of digits
-    digits_only = ''.join(c for c in message if c.isdigit())
-    if len(digits_only) >= 6:  # More permissive - any 6+ digit sequence
-        return digits_only
-    
-    return None
+def check_profiler_token(request):
+    """Hide the profiler endpoints from anyone without the profiler secret"""
+    if not profiler.authorized(request.headers.get(PROFILER_HEADER)):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+def profile_response(samples, name, format):
+    """Profile samples as collapsed stacks or as a speedscope file"""
+    if format == "collapsed":
+        return PlainTextResponse(to_collapsed(samples))
+    return Response(
+        content=to_speedscope(samples, name, profiler.interval),
+        media_type="application/json",
+        headers={"Content-Disposition": 'attachment; filename="profile.speedscope.json"'}
+    )
+
+def render_chat_interface(lang, current_year, content):
+    """Render the chat interface page for a language"""
+    # Only the current language's translations are needed to render the page
+    translations = {lang: content.translations} if content else {}
+    destinations = content.destinations if content else ()
+    
+    with span("page_render"):
+        return templates.get_template("assistant.html").render(
+            lang=lang,
+            lang_name=SUPPORTED_LANGUAGES[lang],
+            supported_languages=SUPPORTED_LANGUAGES,
+            welcome_message=WELCOME_MESSAGES[lang],
+            destinations=destinations,
+            current_year=current_year,
+            translations=translations
+        )
+
+def check_rate_limits(request, session_id):
+    """Apply the per-IP and per-session rate limits to a chat request"""
+    ip_limiter.check(client_ip(request))
+    session_limiter.check(session_id)
+
+def format_sse(event, data):
+    """Format a server-sent event frame"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def update_profile(chat_request, session_id):
+    """Merge what a message adds into the session's profile and save new contacts as leads
+
+    Returns the updated profile and the contact found in the message, if any.
+    It runs under the session's lock, so two requests of a session cannot
+    interleave here, even on different workers.
+    """
+    message = chat_request.message
+    travel_info = extract_travel_info(message)
+    with span("contact_extraction"):
+        contact = extract_contact(message, chat_request.lang)
+    contact_info = contact.value if contact else None
+    
+    with span("profile_update"):
+        profile = load_profile(session_id)
+        # The client's user_info only seeds a new session: once the server
+        # keeps a profile it is the newer one, and what the message says wins
+        updated = merge_profile(profile, {} if profile else client_delta(chat_request.user_info))
+        delta = extract_profile_delta(message, travel_info["destination"], contact)
+        updated = merge_profile(updated, delta)
+    
+    # A contact is saved once per session, however often it is repeated, and
+    # tried again on its next mention if it could not be queued
+    if contact_info and contact_info not in updated.get("leads_saved", []):
+        LEADS_CAPTURED.inc(kind=contact.kind)
+        saved = save_contact_to_sheet({
+            "name": updated.get("name", "Not provided"),
+            "contact": contact_info,
+            "destination": updated.get("destination", "Not specified"),
+            "interests": updated.get("interests", []),
+            "budget": updated.get("budget"),
+            "language": chat_request.lang
+        })
+        if saved:
+            updated["leads_saved"] = updated.get("leads_saved", []) + [contact_info]
+    
+    if updated != profile:
+        save_profile(session_id, updated)
+    return updated, contact_info
 
 def extract_travel_info(message):
     """Extract travel information from message"""
@@ -294,346 +550,315 @@ def extract_travel_info(message):
     }
     
     # Extract destination
-    countries = extract_countries(message)
+    with span("destination_extraction"):
+        countries = extract_countries(message)
     if countries:
-        info["destination"] = countries[0].capitalize()
-        print(f"Set destination to: {countries[0].capitalize()}")
+        info["destination"] = destination_index.display_name(countries[0])
+        logger.debug("Detected destination", extra={"destination": info["destination"]})
     
     return info
 
 def extract_countries(message):
-    """Extract country names from message"""
-    message_lower = message.lower()
-    
-    # Add more destinations
-    common_destinations = [
-        "france", "frankreich", "франція", "франция", "franța",
-        "italy", "italien", "італія", "италия", "italia",
-        "spain", "spanien", "іспанія", "испания", "spania",
-        "greece", "griechenland", "греція", "греция", "grecia",
-        "japan", "japan", "японія", "япония", "japonia",
-        "thailand", "thailand", "таїланд", "таиланд", "tailanda",
-        "australia", "australien", "австралія", "австралия", "australia",
-        "canada", "kanada", "канада", "канада", "canada",
-        "mexico", "mexiko", "мексика", "мексика", "mexic",
-        "brazil", "brasilien", "бразилія", "бразилия", "brazilia",
-        "egypt", "ägypten", "єгипет", "египет", "egipt",
-        "turkey", "türkei", "туреччина", "турция", "turcia",
-        "germany", "deutschland", "німеччина", "германия", "germania",
-        "uk", "großbritannien", "великобританія", "великобритания", "marea britanie",
-        "ireland", "irland", "ірландія", "ирландия", "irlanda",
-        "bali", "bali", "балі", "бали", "bali",
-        "kyiv", "kiew", "київ", "киев", "kiev",
-        "barcelona", "barcelona", "барселона", "барселона", "barcelona",
-        "tokyo", "tokio", "токіо", "токио", "tokyo",
-        "santorini", "santorini", "санторіні", "санторини", "santorini",
-    ]
-    
-    found_destinations = []
-    for destination in common_destinations:
-        if destination in message_lower:
-            found_destinations.append(destination)
-            print(f"Matched destination: {destination}")
-    
-    # If not found directly, check if the user's message looks like just a destination
-    if not found_destinations and len(message.split()) <= 2:
-        # Check if it's a proper noun (capitalized word)
-        words = message.split()
-        for word in words:
-            cleaned_word = word.strip(',.:;!?')
-            if cleaned_word and cleaned_word[0].isupper() and len(cleaned_word) > 3:
-                found_destinations.append(cleaned_word.lower())
-                print(f"Found potential destination from capitalized word: {cleaned_word}")
-                break
-            
-    return found_destinations
+    """Extract destination IDs from message
+
+    Only destinations in the index count: the destination is saved in the
+    session's profile, and a guess such as any capitalized word ("Thanks!")
+    would overwrite a real one.
+    """
+    return destination_index.match(message)
 
 def save_contact_to_sheet(contact_data):
-    """Save contact information to Google Sheets"""
+    """Queue contact information to be saved to Google Sheets in the background
+
+    Returns whether the contact is in the queue, now or from before.
+    """
     try:
-        # Ensure we have a contact to save
-        if not contact_data.get("contact"):
-            print("No contact to save")
-            return False
-        
-        print(f"Data to save: {contact_data}")
-        
-        # Try to use Google Sheets
-        creds_file = "google_credentials.json"
-        google_creds = os.getenv("GOOGLE_CREDENTIALS")
-        
-        # Create credentials file from environment if it doesn't exist
-        if not os.path.exists(creds_file) and google_creds:
-            with open(creds_file, "w") as f:
-                f.write(google_creds)
-        
-        # Set up Google Sheets credentials
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        credentials = ServiceAccountCredentials.from_json_keyfile_name(creds_file, scope)
-        client = gspread.authorize(credentials)
-        
-        # Get spreadsheet ID from URL
-        sheet_url = "https://docs.google.com/spreadsheets/d/1u0oWbOWXJaPwKfBXBrebc67s0PAz1tgCh7Og_Neaofk/edit?gid=0#gid=0"
-        sheet_id = sheet_url.split("/d/")[1].split("/")[0]
-        
-        # Open sheet and add row
-        sheet = client.open_by_key(sheet_id).sheet1
-        
-        # Add the row with all data
-        row_data = [
-            contact_data.get("name", "Not provided"),
-            contact_data.get("contact"),
-            contact_data.get("destination", "Not specified"),
-            ", ".join(contact_data.get("interests", [])) if isinstance(contact_data.get("interests"), list) else "Not specified",
-            contact_data.get("budget") or "Not specified",
-            contact_data.get("language") or "en",
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        ]
-        
-        print(f"Row data: {row_data}")
-        sheet.append_row(row_data)
-        print(f"Successfully saved contact data to Google Sheet")
-        
+        with span("lead_save"):
+            lead_queue.put(contact_data)
         return True
-        
     except Exception as e:
-        print(f"Error saving to Google Sheet: {e}")
-        # More detailed error trace
-        import traceback
-        print(traceback.format_exc())
-        
-        # Try CSV fallback
-        try:
-            fallback_file = "contact_leads.csv"
-            import csv
-            file_exists = os.path.exists(fallback_file)
-            with open(fallback_file, 'a', newline='') as f:
-                writer = csv.writer(f)
-                if not file_exists:
-                    writer.writerow(["Name", "Contact", "Destination", "Interests", "Budget", "Language", "Timestamp"])
-                writer.writerow([
-                    contact_data.get("name", "Not provided"),
-                    contact_data.get("contact"),
-                    contact_data.get("destination", "Not specified"),
-                    ", ".join(contact_data.get("interests", [])) if isinstance(contact_data.get("interests"), list) else "Not specified",
-                    contact_data.get("budget") or "Not specified",
-                    contact_data.get("language") or "en",
-                    datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                ])
-            print(f"Saved to local CSV file: {fallback_file}")
-            return True
-        except Exception as csv_err:
-            print(f"Error saving to CSV: {str(csv_err)}")
-            return False
+        # Never log the contact itself
+        logger.error("Error queueing contact: %s", e)
+        return False
 
 def get_conversation_history(session_id):
     """Get conversation history for a session or create new one"""
-    history_dir = "conversations"
-    os.makedirs(history_dir, exist_ok=True)
-    
-    history_file = f"{history_dir}/{session_id}.json"
-    
-    if os.path.exists(history_file):
-        try:
-            with open(history_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception:
-            # If file is corrupted, start fresh
-            return []
-    else:
+    try:
+        with span("history_load"):
+            return conversation_store.load(session_id)
+    except Exception as e:
+        logger.error("Error loading conversation history: %s", e)
         return []
 
-def save_conversation_history(session_id, history):
-    """Save conversation history for a session"""
-    history_dir = "conversations"
-    os.makedirs(history_dir, exist_ok=True)
-    
-    history_file = f"{history_dir}/{session_id}.json"
-    
-    with open(history_file, 'w', encoding='utf-8') as f:
-        json.dump(history, f, ensure_ascii=False, indent=2)
+def append_conversation_history(session_id, messages):
+    """Append new messages to the conversation history for a session"""
+    with span("history_save"):
+        conversation_store.append(session_id, messages)
+
+def load_profile(session_id):
+    """Get the traveller profile for a session"""
+    try:
+        return conversation_store.load_profile(session_id)
+    except Exception as e:
+        logger.error("Error loading session profile: %s", e)
+        return {}
+
+def save_profile(session_id, profile):
+    """Save the traveller profile for a session"""
+    try:
+        conversation_store.save_profile(session_id, profile)
+    except Exception as e:
+        logger.error("Error saving session profile: %s", e)
 
 def get_system_message(lang='en'):
-    """Create system message based on language"""
-    base_messages = {
-        "en": """You are a friendly and knowledgeable travel agent for Alligator.tour travel agency. 
-        Your goal is to help users plan their perfect international trip.
-        
-        IMPORTANT GUIDELINES:
-        
-        1. ALWAYS ask targeted questions to understand their needs. For example: "Are you looking for relaxation, adventure, culture, or family fun?"
-        
-        2. After they mention a destination or show interest, OFFER HELP OPTIONS using this format:
-           
-           "I'd be happy to help you with your [DESTINATION] trip! What would you like to know about? 
-           
-           🗺️ Recommended itinerary
-           🧳 Packing tips and important documents
-           🏨 Accommodation suggestions
-           🍽️ Local cuisine recommendations
-           🚶 Must-see attractions and activities
-           💡 Local customs and travel tips
-           💰 Budget advice and money-saving tips"
-        
-        3. Use plenty of relevant emojis throughout your responses
-        
-        4. Break up your text into small, digestible paragraphs (2-3 sentences maximum)
-        
-        5. When providing information, use subheadings and bullet points to organize it
-        
-        6. Be enthusiastic and conversational
-        
-        7. ALWAYS ask follow-up questions to better understand their needs at the end of your responses
-        
-        8. When appropriate, subtly encourage booking through Alligator.tour
-        
-        9. VERY IMPORTANT: At the end of your responses (especially after providing substantive travel information), ask for the user's contact information like this:
-        
-           "Would you like a travel specialist to contact you with personalized recommendations for [DESTINATION]? If so, please share your email or phone number."
-           
-        IMPORTANT: The user is speaking in English. You must respond in English.
-        """,
-        "de": """Du bist ein freundlicher und kenntnisreicher Reiseberater für die Alligator.tour Reiseagentur.
-        Dein Ziel ist es, Benutzern bei der Planung ihrer perfekten internationalen Reise zu helfen.
-        
-        WICHTIGE RICHTLINIEN:
-        
-        1. Stelle IMMER gezielte Fragen, um ihre Bedürfnisse zu verstehen. Zum Beispiel: "Suchst du nach Entspannung, Abenteuer, Kultur oder Familienspaß?"
-        
-        2. Nachdem sie ein Reiseziel erwähnt haben oder Interesse zeigen, BIETE HILFEOPTIONEN in diesem Format an:
-           
-           "Ich helfe dir gerne bei deiner Reise nach [REISEZIEL]! Was möchtest du wissen über?
-           
-           🗺️ Empfohlene Reiseroute
-           🧳 Packtipps und wichtige Dokumente
-           🏨 Unterkunftsvorschläge
-           🍽️ Empfehlungen für lokale Küche
-           🚶 Sehenswürdigkeiten und Aktivitäten
-           💡 Lokale Bräuche und Reisetipps
-           💰 Budgetberatung und Geldsparen"
-        
-        3. Verwende viele relevante Emojis in deinen Antworten
-        
-        4. Teile deinen Text in kleine, verdauliche Absätze auf (maximal 2-3 Sätze)
-        
-        5. Bei der Bereitstellung von Informationen, verwende Unterüberschriften und Aufzählungspunkte
-        
-        6. Sei begeistert und gesprächig
-        
-        7. Stelle IMMER Folgefragen, um ihre Bedürfnisse am Ende deiner Antworten besser zu verstehen
-        
-        8. Wenn es angebracht ist, ermuntere sie subtil, über Alligator.tour zu buchen
-        
-        9. SEHR WICHTIG: Am Ende deiner Antworten (besonders nach substantiellen Reiseinformationen), frage nach den Kontaktinformationen des Benutzers wie folgt:
-        
-           "Möchtest du, dass ein Reisespezialist dich mit personalisierten Empfehlungen für [REISEZIEL] kontaktiert? Wenn ja, teile bitte deine E-Mail-Adresse oder Telefonnummer mit."
-           
-        WICHTIG: Der Benutzer spricht Deutsch. Du musst auf Deutsch antworten.
-        """,
-        "uk": """Ви дружелюбний та компетентний туристичний агент агентства Alligator.tour.
-        Ваша мета - допомогти користувачам спланувати їхню ідеальну міжнародну подорож.
-        
-        ВАЖЛИВІ ВКАЗІВКИ:
-        
-        1. ЗАВЖДИ задавайте цільові питання, щоб зрозуміти їхні потреби. Наприклад: "Ви шукаєте відпочинок, пригоди, культуру чи сімейні розваги?"
-        
-        2. Після того, як вони згадають пункт призначення або проявлять інтерес, ЗАПРОПОНУЙТЕ ВАРІАНТИ ДОПОМОГИ у такому форматі:
-           
-           "Я з радістю допоможу вам із поїздкою до [ПУНКТ ПРИЗНАЧЕННЯ]! Що б ви хотіли дізнатися про?
-           
-           🗺️ Рекомендований маршрут
-           🧳 Поради щодо пакування та важливі документи
-           🏨 Пропозиції житла
-           🍽️ Рекомендації місцевої кухні
-           🚶 Обов'язкові пам'ятки та розваги
-           💡 Місцеві звичаї та поради для подорожей
-           💰 Поради щодо бюджету та економії грошей"
-        
-        3. Використовуйте багато відповідних емодзі у своїх відповідях
-        
-        4. Розбивайте текст на невеликі, легкозасвоювані абзаци (максимум 2-3 речення)
-        
-        5. При наданні інформації використовуйте підзаголовки та маркери
-        
-        6. Будьте ентузіазними та комунікабельними
-        
-        7. ЗАВЖДИ ставте уточнюючі запитання, щоб краще зрозуміти їхні потреби в кінці ваших відповідей
-        
-        8. Коли доречно, тонко заохочуйте бронювання через Alligator.tour
-        
-        9. ДУЖЕ ВАЖЛИВО: В кінці ваших відповідей (особливо після надання змістовної інформації про подорож), запитайте контактну інформацію користувача таким чином:
-        
-           "Бажаєте, щоб фахівець з подорожей зв'язався з вами з персоналізованими рекомендаціями для [ПУНКТ ПРИЗНАЧЕННЯ]? Якщо так, будь ласка, поділіться своєю електронною поштою або номером телефону."
-           
-        ВАЖЛИВО: Користувач говорить українською. Ви повинні відповідати українською.
-        """,
-        # Include other languages here
+    """Get the system prompt for a language"""
+    return prompt_registry.get(lang)
+
+def build_messages(conversation_history, message, lang='en', profile=None, summary=None, facts=None):
+    """Build the message list for the OpenAI API call"""
+    # Create system message based on language
+    system_message = get_system_message(lang)
+    
+    # Parts that change less often come first, so that consecutive turns
+    # share the longest possible prompt prefix with the provider's cache
+    messages = [{"role": "system", "content": system_message}]
+    
+    # Add summary of turns that no longer fit in the context window
+    if summary:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+    
+    # Add conversation history
+    for msg in conversation_history:
+        messages.append({"role": msg["role"], "content": msg["content"]})
+    
+    # Add what is known about the traveller so far
+    known = render_profile(profile or {})
+    if known:
+        messages.append({"role": "system", "content": known})
+    
+    # Add catalog facts that match the message
+    if facts:
+        messages.append({"role": "system", "content": "Facts from the Alligator.tour catalog:\n" + "\n".join(f"- {fact}" for fact in facts)})
+    
+    # Add user message
+    messages.append({"role": "user", "content": message})
+    
+    return messages
+
+def lookup_knowledge(message, lang):
+    """Look a message up in the destination catalog"""
+    with span("knowledge_lookup"):
+        result = knowledge_index.lookup(message, lang)
+    outcome = "answer" if result.answer else "snippets" if result.snippets else "none"
+    KNOWLEDGE_LOOKUPS.inc(lang=lang, outcome=outcome)
+    return result
+
+def get_fallback_message(lang):
+    """Get the localized answer given when the assistant cannot reply"""
+    fallback_messages = {
+        "en": "I'm having trouble answering right now. Please try again in a moment, or leave your phone number or email and a travel specialist will get back to you.",
+        "de": "Ich kann gerade leider nicht antworten. Bitte versuchen Sie es gleich noch einmal oder hinterlassen Sie Ihre Telefonnummer oder E-Mail, dann meldet sich ein Reiseberater bei Ihnen.",
+        "uk": "Зараз я не можу відповісти. Будь ласка, спробуйте ще раз за хвилину або залиште свій номер телефону чи email, і наш турагент зв'яжеться з вами.",
+        "ru": "Сейчас я не могу ответить. Пожалуйста, попробуйте ещё раз через минуту или оставьте свой номер телефона или email, и наш турагент свяжется с вами.",
+        "ro": "Momentan nu pot răspunde. Vă rugăm să încercați din nou peste un minut sau lăsați numărul de telefon sau emailul și un specialist în turism vă va contacta."
     }
+    return fallback_messages.get(lang, fallback_messages["en"])
+
+async def get_ai_response(chat_request, session_id):
+    """Update the session's profile and get a response from OpenAI API
+
+    Returns the reply, whether it came from the cache, the public profile and
+    the contact found in the message.
+    """
+    turn = {}
+    async for _ in run_turn(chat_request, session_id, turn, "chat", answer_turn):
+        pass
+    return turn["response"], turn["cache_hit"], turn["profile"], turn["contact"]
+
+def stream_ai_response(chat_request, session_id, turn):
+    """Update the session's profile, stream the response from OpenAI API and save the finished turn
+
+    `turn` is filled in as the stream goes: the public `profile` and the
+    `contact` found in the message first, announced by yielding None before
+    any text, then `cache_hit` and the full `response` once the stream has
+    finished.
+    """
+    return run_turn(chat_request, session_id, turn, "chat_stream", stream_turn)
+
+async def run_turn(chat_request, session_id, turn, endpoint, answer):
+    """Run one chat turn: update the profile, then let `answer` produce the reply
+
+    Turns of one session are answered one at a time, and a message that is
+    already being answered for the session shares that result, so a double
+    submit saves its lead only once. Yields None once the profile and contact
+    are in `turn`, then the text of the reply.
+    """
+    message, lang = chat_request.message, chat_request.lang
+    arrived = time.time()
+    flight_key = (session_id, lang, normalize_message(message))
+    while True:
+        leader, flight = chat_flights.join(flight_key)
+        if leader:
+            break
+        shared = await chat_flights.wait(flight)
+        if shared is not None:
+            share_turn(turn, endpoint, shared)
+            yield None
+            yield turn["response"]
+            return
     
-    # Use English as default if language not supported
-    return base_messages.get(lang, base_messages["en"])
-
-def get_ai_response(message, lang='en', session_id='default', user_info=None):
-    """Get response from OpenAI API"""
+    result = None
     try:
-        # Load conversation history from session or initialize new one
-        conversation_history = get_conversation_history(session_id)
-        
-        # Create system message based on language
-        system_message = get_system_message(lang)
-        
-        # Prepare messages for API call
-        messages = [{"role": "system", "content": system_message}]
-        
-        # Add conversation history
-        for msg in conversation_history:
-            messages.append({"role": msg["role"], "content": msg["content"]})
-        
-        # Add user message
-        messages.append({"role": "user", "content": message})
-        
-        # Add user info context if available
-        if user_info:
-            context = f"\nCurrent user information: {json.dumps(user_info)}"
-            messages[-1]["content"] += context
-        
-        # Call OpenAI API
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=800
-        )
-        
-        response_content = response.choices[0].message["content"]
+        async with session_locks.hold(session_id):
+            # Another worker may have answered the same message while we waited for the lock
+            shared = await chat_flights.finished_since(flight_key, arrived)
+            if shared is not None:
+                share_turn(turn, endpoint, shared)
+                yield None
+                yield turn["response"]
+                return
+            
+            # Merge what the message tells about the trip into the session's
+            # profile and save new contact details as a lead
+            profile, contact = await state.run(update_profile, chat_request, session_id)
+            turn["profile"], turn["contact"] = public_profile(profile), contact
+            yield None
+            async for text in answer(message, lang, session_id, profile, contact, turn):
+                yield text
+            result = (turn["response"], turn["cache_hit"], turn["profile"], turn["contact"])
+            await chat_flights.publish(flight_key, result)
+    finally:
+        # Nothing is shared if the client went away before the reply was complete
+        chat_flights.finish(flight_key, result)
+
+def share_turn(turn, endpoint, result):
+    """Fill in a turn from the result of an identical request"""
+    CHAT_COALESCED.inc(endpoint=endpoint)
+    turn["response"], turn["cache_hit"], turn["profile"], turn["contact"] = result
+
+async def answer_turn(message, lang, session_id, profile, contact, turn):
+    """Answer one turn in one piece and save it to the session's history"""
+    start = time.perf_counter()
+    try:
+        plan = await prepare_turn(message, lang, session_id, profile, contact)
+        response_content = plan["reply"]
         
-        # Save conversation
-        conversation_history.append({"role": "user", "content": message})
-        conversation_history.append({"role": "assistant", "content": response_content})
-        save_conversation_history(session_id, conversation_history)
+        if response_content is None:
+            messages = await build_llm_messages(plan, message, lang, session_id, profile)
+            
+            # Call OpenAI API without blocking the event loop
+            with span("llm_call"):
+                response_content = await llm_client.create_chat_completion(
+                    messages=messages,
+                    model=plan["route"].model,
+                    temperature=0.7,
+                    max_tokens=plan["route"].max_tokens
+                )
+            record_llm_usage(plan["route"], messages, response_content)
+        
+        await finish_turn(plan, message, session_id, response_content, start)
+        turn["response"], turn["cache_hit"] = response_content, plan["answer"] == "cache"
+    except Exception as e:
+        # Details go to the log only; the user gets a canned answer in their language
+        logger.error("Error getting AI response: %s: %s", type(e).__name__, e)
+        CHAT_FALLBACKS.inc(lang=lang)
+        turn["response"], turn["cache_hit"] = get_fallback_message(lang), False
+    yield turn["response"]
+
+async def stream_turn(message, lang, session_id, profile, contact, turn):
+    """Stream the answer to one turn and save it to the session's history"""
+    start = time.perf_counter()
+    turn["cache_hit"] = False
+    chunks = []
+    try:
+        plan = await prepare_turn(message, lang, session_id, profile, contact)
+        response_content = plan["reply"]
         
-        return response_content
+        if response_content is not None:
+            yield response_content
+        else:
+            messages = await build_llm_messages(plan, message, lang, session_id, profile)
+            
+            with span("llm_call"):
+                async for token in llm_client.stream_chat_completion(
+                    messages=messages,
+                    model=plan["route"].model,
+                    temperature=0.7,
+                    max_tokens=plan["route"].max_tokens
+                ):
+                    chunks.append(token)
+                    yield token
+            response_content = "".join(chunks)
+            record_llm_usage(plan["route"], messages, response_content)
+        
+        # Save conversation once the whole reply has been streamed
+        await finish_turn(plan, message, session_id, response_content, start)
+        turn["response"], turn["cache_hit"] = response_content, plan["answer"] == "cache"
     except Exception as e:
-        # Provide error message in appropriate language
-        error_messages = {
-            "en": f"I'm having trouble connecting. Please try again later. Error: {str(e)}",
-            "de": f"Ich habe Verbindungsprobleme. Bitte versuchen Sie es später noch einmal. Fehler: {str(e)}",
-            "uk": f"У мене виникли проблеми з підключенням. Будь ласка, спробуйте пізніше. Помилка: {str(e)}",
-            "ru": f"У меня возникли проблемы с подключением. Пожалуйста, повторите попытку позже. Ошибка: {str(e)}",
-            "ro": f"Am probleme cu conectarea. Vă rugăm să încercați din nou mai târziu. Eroare: {str(e)}"
-        }
-        return error_messages.get(lang, error_messages["en"])
-
-# Ensure required directories exist
-os.makedirs("static", exist_ok=True)
-os.makedirs("static/css", exist_ok=True)
-os.makedirs("static/js", exist_ok=True)
-os.makedirs("static/images", exist_ok=True)
-os.makedirs("templates", exist_ok=True)
-os.makedirs("conversations", exist_ok=True)
-
-# Main entry point
+        logger.error("Error streaming AI response: %s: %s", type(e).__name__, e)
+        CHAT_FALLBACKS.inc(lang=lang)
+        turn["response"] = get_fallback_message(lang)
+        # Keep the canned answer apart from any text that was already streamed
+        yield ("\n\n" if chunks else "") + turn["response"]
+
+async def prepare_turn(message, lang, session_id, profile, contact):
+    """Load the history and find a reply that needs no LLM call, if there is one
+
+    Returns a dict with the `history`, the `route`, the `reply` and how it was
+    found (`answer`: template, knowledge or cache; None when the LLM has to
+    answer), the catalog `snippets` and the `cache_key` to save the reply under.
+    """
+    # Load conversation history from session or initialize new one
+    history = await state.run(get_conversation_history, session_id)
+    plan = {"history": history, "snippets": (), "cache_key": None}
+    
+    # Greetings and bare contact shares get a templated reply
+    plan["route"] = route = intent_router.route(message, lang, history, contact)
+    plan["reply"], plan["answer"] = route.reply, "template"
+    if route.reply is not None:
+        return plan
+    
+    # Simple questions about the catalog are answered without the LLM
+    knowledge = lookup_knowledge(message, lang)
+    plan["reply"], plan["answer"], plan["snippets"] = knowledge.answer, "knowledge", knowledge.snippets
+    if knowledge.answer is not None:
+        return plan
+    
+    # Answer repeated questions from the cache; messages with contact details are never cached
+    if not contact:
+        plan["cache_key"] = make_cache_key(lang, message, history, public_profile(profile or {}))
+        plan["reply"] = await state.run(response_cache.get, plan["cache_key"])
+    plan["answer"] = "cache" if plan["reply"] is not None else None
+    return plan
+
+async def build_llm_messages(plan, message, lang, session_id, profile):
+    """Build the prompt for a turn the LLM has to answer"""
+    # Keep only the newest turns, with a summary of the older ones
+    summary, recent_history = await context_manager.prepare(session_id, plan["history"])
+    return build_messages(recent_history, message, lang, profile, summary, plan["snippets"])
+
+async def finish_turn(plan, message, session_id, response_content, start):
+    """Cache a fresh LLM reply, save the turn to the history and record how it was answered"""
+    if plan["answer"] is None and plan["cache_key"]:
+        await state.run(response_cache.set, plan["cache_key"], response_content)
+    
+    # Save conversation
+    await state.run(append_conversation_history, session_id, [
+        {"role": "user", "content": message},
+        {"role": "assistant", "content": response_content}
+    ])
+    record_turn(plan["route"], plan["answer"] or "llm", time.perf_counter() - start)
+
+app = create_app()
+
+# Main entry point: WEB_CONCURRENCY worker processes under uvicorn's supervisor.
+# In production run the same app under gunicorn, which also restarts workers
+# that die or hang:
+#
+#     STATE_BACKEND_URL=redis://127.0.0.1:6379/0 gunicorn -c gunicorn.conf.py app:app
 if __name__ == "__main__":
+    import uvicorn
+    
     port = int(os.getenv("PORT", 8000))
     host = os.getenv("HOST", "0.0.0.0")
-    uvicorn.run("app:app", host=host, port=port)
+    uvicorn.run("app:app", host=host, port=port, workers=WEB_CONCURRENCY)
@@ -0,0 +1,98 @@
+"""Benchmark contact extraction over a labelled corpus of chat messages
+
+Usage:
+    python benchmarks/bench_contact_extractor.py [--corpus benchmarks/contact_corpus.jsonl] [--repeat 2000]
+
+Reports precision, recall and false leads for the current extractor next
+to the old extract_email/extract_phone pair, plus throughput for both.
+Each corpus line is {"message": ..., "lang": ..., "expected": contact or null}.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from contact_extractor import extract_contact  # noqa: E402
+
+
+def legacy_extract(message, lang=None):
+    """The previous extract_email(...) or extract_phone(...) logic"""
+    email_match = re.search(r'[^\s@]+@[^\s@]+\.[^\s@]+', message)
+    if email_match:
+        return email_match.group(0).strip(',.!?;:()')
+    phone_match = re.search(r'(?:\+?\d{1,3}[-.\s]?)?(?:\(?\d{3}\)?[-.\s]?)?\d{3}[-.\s]?\d{4}', message)
+    if phone_match:
+        return phone_match.group(0)
+    digits_only = ''.join(c for c in message if c.isdigit())
+    if len(digits_only) >= 6:
+        return digits_only
+    return None
+
+
+def current_extract(message, lang=None):
+    match = extract_contact(message, lang)
+    return match.value if match else None
+
+
+def load_corpus(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def score(extract, corpus):
+    """Count correct, wrong and missed contacts and false leads"""
+    counts = {"correct": 0, "wrong": 0, "missed": 0, "false_leads": 0}
+    for item in corpus:
+        found = extract(item["message"], item["lang"])
+        expected = item["expected"]
+        if expected is None:
+            if found:
+                counts["false_leads"] += 1
+        elif found is None:
+            counts["missed"] += 1
+        elif found == expected:
+            counts["correct"] += 1
+        else:
+            counts["wrong"] += 1
+    predicted = counts["correct"] + counts["wrong"] + counts["false_leads"]
+    actual = sum(1 for item in corpus if item["expected"])
+    counts["precision"] = counts["correct"] / predicted if predicted else 1.0
+    counts["recall"] = counts["correct"] / actual if actual else 1.0
+    return counts
+
+
+def throughput(extract, corpus, repeat):
+    """Messages processed per second"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in corpus:
+            extract(item["message"], item["lang"])
+    elapsed = time.perf_counter() - start
+    return repeat * len(corpus) / elapsed
+
+
+def main():
+    default_corpus = os.path.join(os.path.dirname(os.path.abspath(__file__)), "contact_corpus.jsonl")
+    parser = argparse.ArgumentParser(description="Benchmark contact extraction")
+    parser.add_argument("--corpus", default=default_corpus)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    print(f"Corpus: {len(corpus)} messages, {sum(1 for i in corpus if i['expected'])} with contacts")
+    for name, extract in (("legacy", legacy_extract), ("current", current_extract)):
+        counts = score(extract, corpus)
+        rate = throughput(extract, corpus, args.repeat)
+        print(
+            f"{name:8} precision={counts['precision']:.2f} recall={counts['recall']:.2f} "
+            f"false_leads={counts['false_leads']} wrong={counts['wrong']} missed={counts['missed']} "
+            f"{rate:,.0f} msg/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""Local stand-in for a Redis server, for the shared state backend
+
+Usage:
+    python benchmarks/fake_redis.py [--port 6390]
+
+Point the app at it with
+    STATE_BACKEND_URL=redis://127.0.0.1:6390/0
+
+It speaks RESP and implements the commands `RedisStateBackend` sends:
+strings with expiry, lists, hashes, PEXPIRE/PTTL, and EVAL/EVALSHA of the
+scripts in state_backend.py, which it runs as Python instead of Lua. Data is
+kept in memory, in one keyspace, and lost when it stops. It is meant for
+testing several workers on one machine, not for production.
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from state_backend import RELEASE_SCRIPT, SEED_LIST_SCRIPT, TOKEN_BUCKET_SCRIPT  # noqa: E402
+
+
+def encode_reply(value):
+    """Encode a reply: None, int, str, bytes, list or an exception"""
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, Exception):
+        return b"-%s\r\n" % str(value).encode("utf-8")
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(encode_reply(item) for item in value)
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+class FakeRedis:
+    """In-memory keyspace with the commands the state backend uses"""
+
+    def __init__(self):
+        # key -> value (bytes, list of bytes or dict of bytes); expiry in a separate dict
+        self.data = {}
+        self.expires = {}
+        self.commands = 0
+        self.scripts = {
+            hashlib.sha1(TOKEN_BUCKET_SCRIPT.encode("utf-8")).hexdigest(): self._token_bucket,
+            hashlib.sha1(RELEASE_SCRIPT.encode("utf-8")).hexdigest(): self._release,
+            hashlib.sha1(SEED_LIST_SCRIPT.encode("utf-8")).hexdigest(): self._seed_list
+        }
+
+    def _get(self, key, kind):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        value = self.data.get(key)
+        if value is not None and not isinstance(value, kind):
+            raise TypeError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def execute(self, args):
+        self.commands += 1
+        name = args[0].decode().upper()
+        handler = getattr(self, "cmd_" + name.lower(), None)
+        if handler is None:
+            return ValueError(f"ERR unknown command '{name}'")
+        try:
+            return handler(*args[1:])
+        except (TypeError, ValueError) as e:
+            message = str(e)
+            return ValueError(message if message.startswith(("ERR", "WRONGTYPE", "NOSCRIPT")) else f"ERR {message}")
+
+    def cmd_ping(self, *args):
+        return "PONG"
+
+    def cmd_auth(self, *args):
+        return "OK"
+
+    def cmd_select(self, db):
+        return "OK"
+
+    def cmd_flushall(self, *args):
+        self.data.clear()
+        self.expires.clear()
+        return "OK"
+
+    def cmd_time(self):
+        now = time.time()
+        return [str(int(now)), str(int(now % 1 * 1000000))]
+
+    def cmd_get(self, key):
+        return self._get(key, bytes)
+
+    def cmd_set(self, key, value, *options):
+        options = [option.upper() for option in options]
+        ttl = None
+        if b"PX" in options:
+            ttl = int(options[options.index(b"PX") + 1]) / 1000
+        elif b"EX" in options:
+            ttl = int(options[options.index(b"EX") + 1])
+        if b"NX" in options and self._get(key, object) is not None:
+            return None
+        self.data[key] = value
+        self.expires.pop(key, None)
+        if ttl:
+            self.expires[key] = time.time() + ttl
+        return "OK"
+
+    def cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._get(key, object) is not None:
+                del self.data[key]
+                removed += 1
+            self.expires.pop(key, None)
+        return removed
+
+    def cmd_pexpire(self, key, milliseconds):
+        if self._get(key, object) is None:
+            return 0
+        self.expires[key] = time.time() + int(milliseconds) / 1000
+        return 1
+
+    def cmd_pttl(self, key):
+        if self._get(key, object) is None:
+            return -2
+        expires_at = self.expires.get(key)
+        if expires_at is None:
+            return -1
+        return int((expires_at - time.time()) * 1000)
+
+    def cmd_exists(self, *keys):
+        return sum(1 for key in keys if self._get(key, object) is not None)
+
+    def cmd_rpush(self, key, *values):
+        items = self._get(key, list)
+        if items is None:
+            items = self.data[key] = []
+        items.extend(values)
+        return len(items)
+
+    def cmd_rpushx(self, key, *values):
+        if self._get(key, list) is None:
+            return 0
+        return self.cmd_rpush(key, *values)
+
+    def cmd_lrange(self, key, start, stop):
+        items = self._get(key, list) or []
+        start, stop = int(start), int(stop)
+        stop = len(items) if stop == -1 else stop + 1
+        return items[start:stop]
+
+    def cmd_hset(self, key, *pairs):
+        fields = self._get(key, dict)
+        if fields is None:
+            fields = self.data[key] = {}
+        added = sum(1 for field in pairs[::2] if field not in fields)
+        fields.update(zip(pairs[::2], pairs[1::2]))
+        return added
+
+    def cmd_hgetall(self, key):
+        fields = self._get(key, dict) or {}
+        return [item for pair in fields.items() for item in pair]
+
+    def cmd_hmget(self, key, *names):
+        fields = self._get(key, dict) or {}
+        return [fields.get(name) for name in names]
+
+    def cmd_hdel(self, key, *names):
+        fields = self._get(key, dict) or {}
+        return sum(1 for name in names if fields.pop(name, None) is not None)
+
+    def cmd_script(self, subcommand, *args):
+        if subcommand.upper() == b"LOAD":
+            return hashlib.sha1(args[0]).hexdigest()
+        return ValueError("ERR unsupported SCRIPT subcommand")
+
+    def cmd_eval(self, source, numkeys, *args):
+        return self.cmd_evalsha(hashlib.sha1(source).hexdigest().encode(), numkeys, *args)
+
+    def cmd_evalsha(self, sha, numkeys, *args):
+        script = self.scripts.get(sha.decode())
+        if script is None:
+            return ValueError("NOSCRIPT No matching script")
+        numkeys = int(numkeys)
+        return script(list(args[:numkeys]), list(args[numkeys:]))
+
+    def _token_bucket(self, keys, args):
+        now = time.time()
+        rate, burst = float(args[0]), float(args[1])
+        bucket = self._get(keys[0], dict) or {}
+        tokens = float(bucket.get(b"tokens", burst))
+        updated = float(bucket.get(b"updated", now))
+        tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self.cmd_hset(keys[0], b"tokens", repr(tokens).encode(), b"updated", repr(now).encode())
+        self.cmd_pexpire(keys[0], int(burst / rate * 1000) + 1)
+        return repr(wait)
+
+    def _seed_list(self, keys, args):
+        if self.cmd_exists(keys[0]):
+            return 0
+        self.cmd_rpush(keys[0], *args[1:])
+        if int(args[0]) > 0:
+            self.cmd_pexpire(keys[0], args[0])
+        return len(args) - 1
+
+    def _release(self, keys, args):
+        if self._get(keys[0], bytes) == args[0]:
+            return self.cmd_del(keys[0])
+        return 0
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.startswith(b"*"):
+                    # Inline command, as typed into telnet
+                    args = line.split()
+                else:
+                    args = []
+                    for _ in range(int(line[1:-2])):
+                        length = int((await reader.readline())[1:-2])
+                        args.append((await reader.readexactly(length + 2))[:-2])
+                if args:
+                    writer.write(encode_reply(self.execute(args)))
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def start_fake_redis(host="127.0.0.1", port=0):
+    """Start a FakeRedis server and return (fake, server, port)"""
+    fake = FakeRedis()
+    server = await asyncio.start_server(fake.handle, host, port)
+    port = server.sockets[0].getsockname()[1]
+    return fake, server, port
+
+
+async def serve(args):
+    _, server, port = await start_fake_redis(args.host, args.port)
+    print(f"Fake Redis: redis://{args.host}:{port}/0")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an in-memory Redis stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""Local stand-ins for the OpenAI chat-completions API and the Google Sheets API
+
+Usage:
+    python benchmarks/fakes.py [--openai-port 9001] [--sheets-port 9002]
+                               [--latency 0.5] [--token-rate 50] [--error-rate 0]
+
+Point the app at them with
+    OPENAI_API_BASE=http://127.0.0.1:9001/v1 OPENAI_API_KEY=test
+    LEAD_SHEETS_BACKEND=http LEAD_SHEETS_URL=http://127.0.0.1:9002
+
+The OpenAI stand-in waits `latency` seconds before the first token and then
+produces `token_rate` tokens per second, for both plain and streamed
+completions. A share of requests given by `error_rate` fails with a 500.
+Both servers report what they received on GET /stats.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from aiohttp import web
+
+REPLY_WORDS = (
+    "🌴 Great choice! Here are a few ideas for your trip: visit the old town, "
+    "try the local food market, book a sunset tour and keep a free day for the beach. "
+    "The best time to travel is late spring or early autumn. "
+    "Would you like a travel specialist to contact you with personalized recommendations? "
+).split(" ")
+
+
+class FakeOpenAI:
+    """Chat-completions endpoint with configurable latency, token rate and error rate"""
+
+    def __init__(self, latency=0.5, token_rate=50.0, error_rate=0.0, reply_tokens=120):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.error_rate = error_rate
+        self.reply_tokens = reply_tokens
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+    def _reply_tokens(self, max_tokens):
+        count = min(self.reply_tokens, max_tokens or self.reply_tokens)
+        return [REPLY_WORDS[i % len(REPLY_WORDS)] + " " for i in range(count)]
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            if random.random() < self.error_rate:
+                self.errors += 1
+                return web.json_response(
+                    {"error": {"message": "Simulated upstream failure", "type": "server_error"}},
+                    status=500
+                )
+
+            tokens = self._reply_tokens(body.get("max_tokens"))
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+            created = int(time.time())
+            model = body.get("model", "gpt-3.5-turbo")
+
+            if body.get("stream"):
+                return await self._stream(request, tokens, completion_id, created, model)
+
+            await asyncio.sleep(len(tokens) / self.token_rate)
+            prompt_tokens = sum(len(msg.get("content", "")) // 4 for msg in body.get("messages", []))
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop"
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(tokens),
+                    "total_tokens": prompt_tokens + len(tokens)
+                }
+            })
+        finally:
+            self.in_flight -= 1
+
+    async def _stream(self, request, tokens, completion_id, created, model):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        def chunk(delta, finish_reason=None):
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            return f"data: {json.dumps(data)}\n\n".encode("utf-8")
+
+        await response.write(chunk({"role": "assistant"}))
+        for token in tokens:
+            await asyncio.sleep(1 / self.token_rate)
+            await response.write(chunk({"content": token}))
+        await response.write(chunk({}, "stop"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def stats(self, request):
+        return web.json_response({
+            "requests": self.requests,
+            "errors": self.errors,
+            "max_in_flight": self.max_in_flight
+        })
+
+
+class FakeSheets:
+    """Sheets v4 values:append endpoint that counts the rows it receives"""
+
+    def __init__(self, latency=0.2, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.rows = 0
+        self.errors = 0
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post("/v4/spreadsheets/{sheet_id}/values/{range}", self.append)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+    async def append(self, request):
+        body = await request.json()
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({"error": {"code": 503, "message": "Simulated outage"}}, status=503)
+        values = body.get("values", [])
+        self.rows += len(values)
+        return web.json_response({
+            "spreadsheetId": request.match_info["sheet_id"],
+            "updates": {"updatedRows": len(values)}
+        })
+
+    async def stats(self, request):
+        return web.json_response({"requests": self.requests, "rows": self.rows, "errors": self.errors})
+
+
+async def start_server(app, host="127.0.0.1", port=0):
+    """Start an aiohttp app and return (runner, port)"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    # Port 0 picks a free port; read back the one we got
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, port
+
+
+async def serve(args):
+    fake_openai = FakeOpenAI(args.latency, args.token_rate, args.error_rate, args.reply_tokens)
+    fake_sheets = FakeSheets(args.sheets_latency, args.sheets_error_rate)
+    _, openai_port = await start_server(fake_openai.create_app(), args.host, args.openai_port)
+    _, sheets_port = await start_server(fake_sheets.create_app(), args.host, args.sheets_port)
+    print(f"Fake OpenAI: http://{args.host}:{openai_port}/v1")
+    print(f"Fake Sheets: http://{args.host}:{sheets_port}")
+    await asyncio.Event().wait()
+
+
+def add_fake_arguments(parser):
+    """Options shared by this script and the load test"""
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="Tokens per second")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of completions that fail")
+    parser.add_argument("--reply-tokens", type=int, default=120, help="Tokens per reply")
+    parser.add_argument("--sheets-latency", type=float, default=0.2, help="Seconds per Sheets append")
+    parser.add_argument("--sheets-error-rate", type=float, default=0.0, help="Share of Sheets appends that fail")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run fake OpenAI and Google Sheets servers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--openai-port", type=int, default=9001)
+    parser.add_argument("--sheets-port", type=int, default=9002)
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Measure how long `import app` takes and guard it against regressions
+
+Usage:
+    python benchmarks/import_time.py [--module app] [--repeat 5] [--max-ms 400]
+                                     [--forbid openai,aiohttp,gspread,oauth2client,tiktoken]
+
+Imports the module in a fresh interpreter with `python -X importtime`,
+several times, and reports the median cumulative import time with the
+slowest modules of the last run. Exits with status 1 if the median is over
+--max-ms or any --forbid module was imported, since those are meant to load
+only during warm-up or on first use.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module):
+    """Import a module in a fresh interpreter and return {module: (self_us, cumulative_us)}"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark module import time")
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Slowest modules to list")
+    parser.add_argument("--max-ms", type=float, default=None, help="Fail if the median import takes longer")
+    parser.add_argument("--forbid", default="openai,aiohttp,gspread,oauth2client,tiktoken",
+                        help="Comma-separated modules that must not be imported")
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.repeat)]
+    totals = [run[args.module][1] / 1000 for run in runs]
+    median = statistics.median(totals)
+    print(f"import {args.module}: median {median:.1f} ms, min {min(totals):.1f} ms, max {max(totals):.1f} ms")
+
+    print("\nSlowest modules (self time, last run):")
+    slowest = sorted(runs[-1].items(), key=lambda item: item[1][0], reverse=True)[:args.top]
+    for name, (self_us, cumulative_us) in slowest:
+        print(f"  {self_us / 1000:8.1f} ms  {cumulative_us / 1000:8.1f} ms cumulative  {name}")
+
+    failures = []
+    forbidden = [name for name in args.forbid.split(",") if name]
+    imported = sorted(name for name in forbidden if name in runs[-1])
+    if imported:
+        failures.append(f"imported at module load: {', '.join(imported)}")
+    if args.max_ms is not None and median > args.max_ms:
+        failures.append(f"median {median:.1f} ms is over the {args.max_ms:.0f} ms budget")
+
+    if failures:
+        print("\nFAIL: " + "; ".join(failures))
+        sys.exit(1)
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    main()
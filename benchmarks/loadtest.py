@@ -0,0 +1,359 @@
+"""End-to-end load test of the chat endpoints against local fakes
+
+Usage:
+    python benchmarks/loadtest.py [--sessions 50] [--concurrency 20] [--stream]
+                                  [--latency 0.5] [--token-rate 50] [--error-rate 0]
+                                  [--max-p95 5.0] [--min-rps 5] [--max-error-rate 0.01]
+                                  [--workers 1] [--json results.json]
+
+Starts the fake OpenAI and Sheets servers from benchmarks/fakes.py, launches
+the app under uvicorn pointed at them with throwaway databases, and replays
+the multilingual conversations in benchmarks/conversation_corpus.jsonl as
+concurrent sessions. Reports latency percentiles (time to first token as well
+with --stream), throughput, error rate and a per-stage breakdown taken from
+the app's /metrics. Use --app-url to test an app that is already running.
+The per-IP rate limit is turned off in the launched app, as all the
+simulated clients share one address; --app-env can set it back.
+
+The corpus is replayed over and over against deterministic fake replies, so
+the response cache of the launched app is off unless --response-cache is
+given; otherwise most turns after the first pass would be cache hits. The
+report gives the hit rate either way. Turns the app answered with its
+canned fallback reply (the LLM failed) count as errors, like non-200s.
+
+With --workers N the app runs N uvicorn workers sharing state through the
+Redis stand-in in benchmarks/fake_redis.py, so comparing runs with 1 and N
+workers (and enough --concurrency to keep them busy) shows how throughput
+scales with cores.
+
+The --max-p95, --min-rps and --max-error-rate gates make the script exit
+with status 1 when a threshold is missed, for use in CI.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import aiohttp
+
+from fake_redis import start_fake_redis
+from fakes import FakeOpenAI, FakeSheets, add_fake_arguments, start_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversation_corpus.jsonl")
+
+STAGE_METRIC = re.compile(r'^chat_stage_duration_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$')
+SAMPLE = re.compile(r'^(\w+)(?:\{([^}]*)\})? (\S+)$')
+
+
+def load_corpus(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(values):
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None
+    }
+
+
+def parse_stage_metrics(text):
+    """Read {stage: {"sum": seconds, "count": n}} from the /metrics output"""
+    stages = {}
+    for line in text.splitlines():
+        match = STAGE_METRIC.match(line)
+        if match:
+            field, stage, value = match.groups()
+            stages.setdefault(stage, {"sum": 0.0, "count": 0.0})[field] = float(value)
+    return stages
+
+
+def counter_total(text, name, **labels):
+    """Sum of the samples of a counter in the /metrics output, optionally for some label values"""
+    wanted = [f'{key}="{value}"' for key, value in labels.items()]
+    total = 0.0
+    for line in text.splitlines():
+        match = SAMPLE.match(line)
+        if match and match.group(1) == name and all(label in (match.group(2) or "") for label in wanted):
+            total += float(match.group(3))
+    return total
+
+
+def stage_breakdown(before, after):
+    """Mean seconds and call count per stage during the run"""
+    breakdown = {}
+    for stage, totals in after.items():
+        previous = before.get(stage, {"sum": 0.0, "count": 0.0})
+        count = totals["count"] - previous["count"]
+        if count > 0:
+            breakdown[stage] = {
+                "count": int(count),
+                "mean": (totals["sum"] - previous["sum"]) / count
+            }
+    return breakdown
+
+
+async def fetch_metrics(http, app_url):
+    """The /metrics output as text, or an empty string if it is unavailable"""
+    try:
+        async with http.get(f"{app_url}/metrics") as response:
+            return await response.text()
+    except aiohttp.ClientError:
+        return ""
+
+
+async def send_turn(http, app_url, session_id, lang, message, stream, results):
+    payload = {"message": message, "lang": lang, "session_id": session_id}
+    path = "/api/chat/stream" if stream else "/api/chat"
+    start = time.perf_counter()
+    cache = None
+    try:
+        async with http.post(f"{app_url}{path}", json=payload) as response:
+            if response.status != 200:
+                await response.read()
+                results["errors"].append(f"HTTP {response.status}")
+                return
+            if stream:
+                first_token = None
+                event = None
+                async for line in response.content:
+                    if line.startswith(b"event: "):
+                        event = line[len(b"event: "):].strip()
+                        if first_token is None and event == b"token":
+                            first_token = time.perf_counter() - start
+                    elif event == b"done" and line.startswith(b"data: "):
+                        cache = json.loads(line[len(b"data: "):])["cache"]
+                if first_token is not None:
+                    results["ttfb"].append(first_token)
+            else:
+                cache = (await response.json())["cache"]
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        results["errors"].append(type(e).__name__)
+        return
+    results["latency"].append(time.perf_counter() - start)
+    results["cache_hits"] += cache == "hit"
+
+
+async def run_session(http, app_url, conversation, stream, semaphore, results):
+    # Turns of one session go in order; sessions run side by side
+    async with semaphore:
+        session_id = f"loadtest-{uuid.uuid4().hex}"
+        for message in conversation["turns"]:
+            await send_turn(http, app_url, session_id, conversation["lang"], message, stream, results)
+
+
+async def wait_for_app(http, app_url, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"App exited with status {process.returncode}")
+        try:
+            async with http.get(f"{app_url}/health/ready") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"App did not start within {timeout:.0f}s")
+
+
+def launch_app(args, openai_port, sheets_port, workdir, state_url=None):
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_BASE": f"http://127.0.0.1:{openai_port}/v1",
+        "OPENAI_API_KEY": "loadtest",
+        "LEAD_SHEETS_BACKEND": "http",
+        "LEAD_SHEETS_URL": f"http://127.0.0.1:{sheets_port}",
+        "CONVERSATION_DB": os.path.join(workdir, "conversations.db"),
+        "LEAD_QUEUE_DB": os.path.join(workdir, "lead_queue.db"),
+        "LEAD_FALLBACK_CSV": os.path.join(workdir, "contact_leads.csv"),
+        "LOG_LEVEL": "WARNING",
+        # Every simulated client comes from 127.0.0.1; measure the app, not the per-IP limit
+        "RATE_LIMIT_IP_PER_MINUTE": "0",
+    })
+    if not args.response_cache:
+        # The replayed corpus would otherwise be answered from the cache after the first pass
+        env["RESPONSE_CACHE_SIZE"] = "0"
+    if state_url:
+        env["STATE_BACKEND_URL"] = state_url
+    for item in args.app_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    command = [
+        sys.executable, "-m", "uvicorn", "app:app",
+        "--host", "127.0.0.1", "--port", str(args.app_port), "--log-level", "warning",
+        "--workers", str(args.workers)
+    ]
+    return subprocess.Popen(command, cwd=ROOT, env=env)
+
+
+async def run(args):
+    corpus = load_corpus(args.corpus)
+    fake_openai = FakeOpenAI(args.latency, args.token_rate, args.error_rate, args.reply_tokens)
+    fake_sheets = FakeSheets(args.sheets_latency, args.sheets_error_rate)
+    openai_runner, openai_port = await start_server(fake_openai.create_app())
+    sheets_runner, sheets_port = await start_server(fake_sheets.create_app())
+
+    process = None
+    redis_server = None
+    workdir = tempfile.TemporaryDirectory(prefix="loadtest-")
+    app_url = args.app_url
+    if app_url is None:
+        state_url = None
+        if args.workers > 1:
+            _, redis_server, redis_port = await start_fake_redis()
+            state_url = f"redis://127.0.0.1:{redis_port}/0"
+        process = launch_app(args, openai_port, sheets_port, workdir.name, state_url)
+        app_url = f"http://127.0.0.1:{args.app_port}"
+
+    timeout = aiohttp.ClientTimeout(total=args.request_timeout)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    results = {"latency": [], "ttfb": [], "errors": [], "cache_hits": 0}
+    try:
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as http:
+            await wait_for_app(http, app_url, process, args.startup_timeout)
+            metrics_before = await fetch_metrics(http, app_url)
+
+            semaphore = asyncio.Semaphore(args.concurrency)
+            conversations = itertools.islice(itertools.cycle(corpus), args.sessions)
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                run_session(http, app_url, conversation, args.stream, semaphore, results)
+                for conversation in conversations
+            ))
+            elapsed = time.perf_counter() - started
+
+            metrics_after = await fetch_metrics(http, app_url)
+    finally:
+        if process is not None:
+            process.terminate()
+            # Waited for off the loop, which still serves the fakes the app is flushing to
+            try:
+                await asyncio.to_thread(process.wait, 10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                await asyncio.to_thread(process.wait)
+        await openai_runner.cleanup()
+        await sheets_runner.cleanup()
+        if redis_server is not None:
+            redis_server.close()
+        workdir.cleanup()
+
+    total = len(results["latency"]) + len(results["errors"])
+    # Answered with 200, but with the canned reply given when the LLM failed
+    fallbacks = int(counter_total(metrics_after, "chat_fallback_replies_total")
+                    - counter_total(metrics_before, "chat_fallback_replies_total"))
+    errors = len(results["errors"]) + fallbacks
+    report = {
+        "requests": total,
+        "errors": errors,
+        "fallback_replies": fallbacks,
+        "error_rate": errors / total if total else 0.0,
+        "cache_hit_rate": results["cache_hits"] / len(results["latency"]) if results["latency"] else 0.0,
+        "rps": total / elapsed if elapsed else 0.0,
+        "elapsed": elapsed,
+        "latency": summarize(results["latency"]),
+        "stages": stage_breakdown(parse_stage_metrics(metrics_before), parse_stage_metrics(metrics_after)),
+        "upstream": {
+            "llm_requests": fake_openai.requests,
+            "llm_attempt_errors": int(counter_total(metrics_after, "llm_attempts_total", outcome="error")
+                                      - counter_total(metrics_before, "llm_attempts_total", outcome="error")),
+            "llm_max_in_flight": fake_openai.max_in_flight,
+            "sheet_rows": fake_sheets.rows
+        }
+    }
+    if args.stream:
+        report["ttfb"] = summarize(results["ttfb"])
+    return report
+
+
+def format_seconds(value):
+    return "-" if value is None else f"{value * 1000:.0f} ms"
+
+
+def print_report(report):
+    print(f"Requests:   {report['requests']} in {report['elapsed']:.1f}s ({report['rps']:.1f} req/s)")
+    print(f"Errors:     {report['errors']} ({report['error_rate']:.1%}), {report['fallback_replies']} of them fallback replies")
+    print(f"Cache hits: {report['cache_hit_rate']:.1%}")
+    for name in ("latency", "ttfb"):
+        if name in report:
+            stats = report[name]
+            print(f"{name.capitalize():<11} p50 {format_seconds(stats['p50'])}, p95 {format_seconds(stats['p95'])}, "
+                  f"p99 {format_seconds(stats['p99'])}, max {format_seconds(stats['max'])}")
+    if report["stages"]:
+        print("Stages (mean per call):")
+        for stage, stats in sorted(report["stages"].items(), key=lambda item: -item[1]["mean"]):
+            print(f"  {stage:<24} {format_seconds(stats['mean']):>10}  x{stats['count']}")
+    upstream = report["upstream"]
+    print(f"Upstream:   {upstream['llm_requests']} LLM calls (max {upstream['llm_max_in_flight']} in flight, "
+          f"{upstream['llm_attempt_errors']} failed), {upstream['sheet_rows']} sheet rows")
+
+
+def check_gates(report, args):
+    """Return the list of thresholds the run missed"""
+    failures = []
+    p95 = report["latency"]["p95"]
+    if args.max_p95 is not None and (p95 is None or p95 > args.max_p95):
+        failures.append(f"p95 latency {format_seconds(p95)} > {args.max_p95 * 1000:.0f} ms")
+    if args.min_rps is not None and report["rps"] < args.min_rps:
+        failures.append(f"throughput {report['rps']:.1f} req/s < {args.min_rps}")
+    if args.max_error_rate is not None and report["error_rate"] > args.max_error_rate:
+        failures.append(f"error rate {report['error_rate']:.1%} > {args.max_error_rate:.1%}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the chat endpoints against local fakes")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--sessions", type=int, default=50, help="Conversations to replay")
+    parser.add_argument("--concurrency", type=int, default=20, help="Sessions running at once")
+    parser.add_argument("--stream", action="store_true", help="Use /api/chat/stream and measure time to first token")
+    parser.add_argument("--app-url", help="Test an already running app instead of launching one")
+    parser.add_argument("--app-port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for the launched app")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra environment for the launched app")
+    parser.add_argument("--response-cache", action="store_true",
+                        help="Keep the launched app's response cache on")
+    parser.add_argument("--request-timeout", type=float, default=60.0)
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    add_fake_arguments(parser)
+    parser.add_argument("--max-p95", type=float, help="Fail if p95 latency exceeds this many seconds")
+    parser.add_argument("--min-rps", type=float, help="Fail if throughput is below this many requests per second")
+    parser.add_argument("--max-error-rate", type=float, help="Fail if the error rate exceeds this share")
+    parser.add_argument("--json", help="Write the report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    failures = check_gates(report, args)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
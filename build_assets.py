@@ -0,0 +1,176 @@
+"""Build optimized static assets into static/dist/
+
+Usage:
+    python build_assets.py [--static static] [--widths 320,640,960,1280]
+
+For every CSS, JS and JSON file this writes a fingerprinted copy
+(name.<hash>.ext) plus gzip and, if the `brotli` package is installed,
+brotli-compressed versions next to it. Every image is resized to the
+configured widths and saved as WebP and, when Pillow has AVIF support, AVIF,
+with one resized JPEG/PNG fallback. The results are listed in
+static/dist/manifest.json, which the app reads through static_assets.py.
+
+Image processing needs Pillow (pip install Pillow brotli).
+"""
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMAGE_WIDTHS = (320, 640, 960, 1280)
+# Width of the fallback <img src> for browsers without srcset support
+FALLBACK_WIDTH = 640
+TEXT_EXTENSIONS = (".css", ".js", ".json")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+WEBP_QUALITY = 80
+AVIF_QUALITY = 55
+JPEG_QUALITY = 82
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def fingerprinted_name(relative_path, data, suffix=""):
+    """Insert a content hash into a file name: css/main.css -> css/main.<hash>.css"""
+    base, ext = os.path.splitext(relative_path)
+    return f"{base}{suffix}.{content_hash(data)}{ext}"
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def write_compressed(path, data):
+    """Write .gz and .br copies of a file when compression pays off"""
+    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(compressed) < len(data):
+        write_file(path + ".gz", compressed)
+    if brotli is not None:
+        compressed = brotli.compress(data, quality=11)
+        if len(compressed) < len(data):
+            write_file(path + ".br", compressed)
+
+
+def iter_static_files(static_dir, extensions):
+    """Yield paths relative to the static directory, skipping the build output"""
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if d != "dist")
+        for name in sorted(files):
+            if name.lower().endswith(extensions):
+                yield os.path.relpath(os.path.join(root, name), static_dir).replace(os.sep, "/")
+
+
+def build_text_assets(static_dir, dist_dir):
+    """Fingerprint and precompress CSS, JS and JSON files"""
+    files = {}
+    for relative_path in iter_static_files(static_dir, TEXT_EXTENSIONS):
+        with open(os.path.join(static_dir, relative_path), "rb") as f:
+            data = f.read()
+        built = fingerprinted_name(relative_path, data)
+        write_file(os.path.join(dist_dir, built), data)
+        write_compressed(os.path.join(dist_dir, built), data)
+        files[relative_path] = f"dist/{built}"
+        print(f"{relative_path} -> dist/{built}")
+    return files
+
+
+def encode_image(image, image_format):
+    """Encode an image, or return None if Pillow cannot write the format"""
+    buffer = io.BytesIO()
+    try:
+        if image_format == "webp":
+            image.save(buffer, "WEBP", quality=WEBP_QUALITY, method=6)
+        elif image_format == "avif":
+            image.save(buffer, "AVIF", quality=AVIF_QUALITY)
+        elif image_format == "jpeg":
+            image.convert("RGB").save(buffer, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        else:
+            image.save(buffer, "PNG", optimize=True)
+    except (KeyError, OSError, ValueError):
+        return None
+    return buffer.getvalue()
+
+
+def build_image_assets(static_dir, dist_dir, widths):
+    """Resize every image and write WebP/AVIF variants plus a fallback"""
+    from PIL import Image
+
+    images = {}
+    for relative_path in iter_static_files(static_dir, IMAGE_EXTENSIONS):
+        with Image.open(os.path.join(static_dir, relative_path)) as original:
+            original.load()
+            has_alpha = original.mode in ("RGBA", "LA") or "transparency" in original.info
+            source = original.convert("RGBA" if has_alpha else "RGB")
+
+        # Never upscale; always produce at least one variant
+        target_widths = [w for w in widths if w < source.width] or [source.width]
+        fallback_width = min(FALLBACK_WIDTH, source.width)
+        base = os.path.splitext(relative_path)[0]
+
+        entry = {"width": source.width, "height": source.height, "variants": {}}
+        for width in sorted(set(target_widths + [fallback_width])):
+            height = round(source.height * width / source.width)
+            resized = source if width == source.width else source.resize((width, height), Image.LANCZOS)
+
+            for image_format, ext in (("avif", ".avif"), ("webp", ".webp")):
+                if width not in target_widths:
+                    continue
+                data = encode_image(resized, image_format)
+                if data is None:
+                    continue
+                built = fingerprinted_name(base + ext, data, f"-{width}")
+                write_file(os.path.join(dist_dir, built), data)
+                entry["variants"].setdefault(image_format, []).append([f"dist/{built}", width])
+
+            if width == fallback_width:
+                fallback_format, ext = ("png", ".png") if has_alpha else ("jpeg", ".jpg")
+                data = encode_image(resized, fallback_format)
+                built = fingerprinted_name(base + ext, data, f"-{width}")
+                write_file(os.path.join(dist_dir, built), data)
+                entry["src"] = f"dist/{built}"
+
+        images[relative_path] = entry
+        print(f"{relative_path} -> {', '.join(sorted(entry['variants']))} at {target_widths}")
+    return images
+
+
+def build(static_dir="static", widths=IMAGE_WIDTHS):
+    """Rebuild static/dist and its manifest"""
+    dist_dir = os.path.join(static_dir, "dist")
+    shutil.rmtree(dist_dir, ignore_errors=True)
+    os.makedirs(dist_dir)
+
+    manifest = {
+        "files": build_text_assets(static_dir, dist_dir),
+        "images": build_image_assets(static_dir, dist_dir, widths)
+    }
+    with open(os.path.join(dist_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build optimized static assets")
+    parser.add_argument("--static", default="static", help="Static files directory")
+    parser.add_argument("--widths", default=",".join(str(w) for w in IMAGE_WIDTHS),
+                        help="Comma-separated image widths to generate")
+    args = parser.parse_args()
+
+    if brotli is None:
+        print("brotli is not installed, only gzip copies will be written")
+    build(args.static, tuple(int(w) for w in args.widths.split(",")))
+
+
+if __name__ == "__main__":
+    main()
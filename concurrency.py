@@ -0,0 +1,175 @@
+"""Per-session serialization of chat turns
+
+`SessionLocks` hands out one asyncio lock per session, so that turns of the
+same conversation load, answer and save their history one after another
+instead of racing. Locks only exist while someone holds or waits for them.
+
+`SingleFlight` coalesces identical requests in flight: the first caller for
+a key does the work and the others wait for its result. This is what keeps
+a double-submitted message or a widget retry from paying for a second
+completion and writing the turn twice.
+
+With several workers, `SharedSessionLocks` also takes a lease on the
+session in the shared state, and `SingleFlight` given a state backend
+publishes each reply briefly, so that a duplicate served by another worker
+can pick it up once it gets the session's lock. Their state calls go through
+`state.run`, off the event loop.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from state_backend import STATE_LOCK_TTL, StateError
+
+logger = logging.getLogger(__name__)
+
+# How long a finished reply is kept for duplicates waiting on other workers
+FLIGHT_RESULT_TTL = 60
+
+
+class SessionLocks:
+    """One asyncio lock per session, dropped when nobody needs it"""
+
+    def __init__(self):
+        # session_id -> [lock, number of holders and waiters]
+        self._locks = {}
+
+    @asynccontextmanager
+    async def hold(self, session_id):
+        entry = self._locks.get(session_id)
+        if entry is None:
+            entry = self._locks[session_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[session_id]
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class SharedSessionLocks(SessionLocks):
+    """Session locks that also hold a lease in the shared state, for several workers
+
+    Waiters in this process queue on the local lock first, so only one of
+    them at a time polls the shared lease. If the state backend is down,
+    turns go ahead with the local lock only.
+    """
+
+    def __init__(self, state, ttl=STATE_LOCK_TTL, poll_interval=0.01, max_poll_interval=0.2):
+        super().__init__()
+        self.state = state
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+
+    @asynccontextmanager
+    async def hold(self, session_id):
+        async with super().hold(session_id):
+            key = f"lock:session:{session_id}"
+            token = uuid.uuid4().hex
+            held = await self._acquire(key, token)
+            try:
+                yield
+            finally:
+                if held:
+                    await self.state.run(self._release, key, token)
+
+    async def _acquire(self, key, token):
+        delay = self.poll_interval
+        try:
+            while not await self.state.run(self.state.acquire, key, token, self.ttl):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_poll_interval)
+            return True
+        except StateError as e:
+            logger.warning("Session lock unavailable, using the local lock only: %s", e)
+            return False
+
+    def _release(self, key, token):
+        try:
+            self.state.release(key, token)
+        except StateError as e:
+            # The lease runs out by itself
+            logger.warning("Error releasing session lock: %s", e)
+
+
+class SingleFlight:
+    """Share the result of a call between identical concurrent callers
+
+    `join(key)` returns (True, future) to the first caller, which must call
+    `finish(key, result)` when done, and (False, future) to the others, which
+    wait with `wait(future)`. A result of None means the leader gave up
+    without an answer and the follower should do the work itself.
+
+    With a state backend, `publish(key, result)` also shares the result with
+    other workers, and `finished_since(key, arrived)` returns one that
+    another worker published after `arrived`, that is while this request was
+    already waiting. Results must then be JSON serializable; lists come back
+    as tuples. The leader publishes before it releases the session's lock,
+    so a duplicate that gets the lock next finds the result.
+    """
+
+    def __init__(self, state=None, result_ttl=FLIGHT_RESULT_TTL):
+        self.state = state
+        self.result_ttl = result_ttl
+        self._flights = {}
+
+    def join(self, key):
+        future = self._flights.get(key)
+        if future is not None:
+            return False, future
+        future = asyncio.get_running_loop().create_future()
+        self._flights[key] = future
+        return True, future
+
+    def finish(self, key, result=None):
+        future = self._flights.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    async def publish(self, key, result):
+        """Share a result with the other workers"""
+        if self.state is None or result is None:
+            return
+        try:
+            await self.state.run(self.state.set, self._state_key(key), json.dumps([time.time(), result]),
+                                 self.result_ttl)
+        except StateError as e:
+            logger.warning("Error publishing a shared reply: %s", e)
+
+    async def finished_since(self, key, arrived):
+        """A result for key that another worker published after `arrived`, or None"""
+        if self.state is None:
+            return None
+        try:
+            published = await self.state.run(self.state.get, self._state_key(key))
+        except StateError as e:
+            logger.warning("Error reading a shared reply: %s", e)
+            return None
+        if published is None:
+            return None
+        finished_at, result = json.loads(published)
+        if finished_at < arrived:
+            return None
+        return tuple(result) if isinstance(result, list) else result
+
+    @staticmethod
+    def _state_key(key):
+        digest = hashlib.sha256(json.dumps(key, ensure_ascii=False).encode("utf-8")).hexdigest()[:32]
+        return f"flight:{digest}"
+
+    async def wait(self, future):
+        # Shield it so a follower that goes away does not cancel the others
+        return await asyncio.shield(future)
+
+    def __len__(self):
+        return len(self._flights)
@@ -0,0 +1,106 @@
+"""Single-pass contact extraction
+
+One precompiled pattern finds email addresses and phone numbers in a single
+scan of the message. Each match is normalized (lowercased email, E.164
+phone number) and given a confidence score. Digit runs that are more likely
+dates, prices or party sizes ("3 people, 2 kids, budget 2000 EUR, June 15")
+are not treated as phone numbers, so they no longer create fake leads.
+"""
+import os
+import re
+from collections import namedtuple
+
+CONTACT_MIN_CONFIDENCE = float(os.getenv("CONTACT_MIN_CONFIDENCE", 0.6))
+# Country calling code assumed for national numbers written with a leading 0
+DEFAULT_COUNTRY_CODE = os.getenv("DEFAULT_PHONE_COUNTRY_CODE", "380")
+
+# Calling code to assume for national numbers, by interface language
+LANGUAGE_COUNTRY_CODES = {
+    "uk": "380",
+    "ru": "380",
+    "de": "49",
+    "ro": "40",
+}
+
+# E.164 numbers have at most 15 digits; fewer than 9 is a date or an amount
+MIN_PHONE_DIGITS = 9
+MAX_PHONE_DIGITS = 15
+
+ContactMatch = namedtuple("ContactMatch", ["kind", "value", "raw", "confidence", "start", "end"])
+
+CONTACT_PATTERN = re.compile(
+    r"""
+    (?P<email>
+        [\w.+-]+ @ [\w-]+ (?:\.[\w-]+)* \.[^\W\d_]{2,}
+    )
+    |
+    (?<![\w+])
+    (?P<phone>
+        (?:\+|00)? \(? \d{1,4} \)?
+        (?: [\s.-]? \(? \d{2,4} \)? ){2,5}
+    )
+    (?![\w@])
+    """,
+    re.VERBOSE
+)
+
+# Separator patterns typical of dates, e.g. 15.06.2024 or 2024-06-15
+DATE_PATTERN = re.compile(r"^\d{1,4}[./-]\d{1,2}[./-]\d{1,4}$")
+
+
+def normalize_phone(raw, lang=None):
+    """Normalize a phone number to E.164 and score how likely it is to be one
+
+    Returns (number, confidence), or (None, 0) if it cannot be a phone number.
+    """
+    digits = re.sub(r"\D", "", raw)
+    stripped = raw.strip()
+
+    if DATE_PATTERN.match(stripped):
+        return None, 0
+
+    if stripped.startswith("+"):
+        number, confidence = digits, 0.95
+    elif stripped.startswith("00"):
+        number, confidence = digits[2:], 0.9
+    elif digits.startswith("0"):
+        # National format: 0XX XXX XX XX
+        country_code = LANGUAGE_COUNTRY_CODES.get(lang, DEFAULT_COUNTRY_CODE)
+        number, confidence = country_code + digits[1:], 0.75
+    elif len(digits) == 10 and lang == "en":
+        # North American numbers are usually written without a prefix
+        number, confidence = "1" + digits, 0.7
+    elif digits.startswith(tuple(LANGUAGE_COUNTRY_CODES.values())):
+        # International number written without the plus sign
+        number, confidence = digits, 0.65
+    else:
+        number, confidence = digits, 0.4
+
+    if not MIN_PHONE_DIGITS <= len(number) <= MAX_PHONE_DIGITS:
+        return None, 0
+    return "+" + number, confidence
+
+
+def extract_contacts(message, lang=None):
+    """Return every email address and phone number found in a message"""
+    matches = []
+    for match in CONTACT_PATTERN.finditer(message):
+        if match.group("email"):
+            raw = match.group("email")
+            email = raw.strip(".").lower()
+            matches.append(ContactMatch("email", email, raw, 0.95, match.start(), match.end()))
+        else:
+            raw = match.group("phone").strip()
+            number, confidence = normalize_phone(raw, lang)
+            if number:
+                matches.append(ContactMatch("phone", number, raw, confidence, match.start(), match.end()))
+    return matches
+
+
+def extract_contact(message, lang=None, min_confidence=CONTACT_MIN_CONFIDENCE):
+    """Return the most confident contact in a message, or None"""
+    candidates = [m for m in extract_contacts(message, lang) if m.confidence >= min_confidence]
+    if not candidates:
+        return None
+    # Prefer emails, then the highest confidence, then the first mention
+    return max(candidates, key=lambda m: (m.kind == "email", m.confidence, -m.start))
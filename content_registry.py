@@ -0,0 +1,106 @@
+"""Translations and destination catalog, loaded once and shared by all requests
+
+The JSON files are parsed at startup into immutable per-language objects.
+They are reloaded only when a file's modification time changes (checked at
+most every CONTENT_CHECK_INTERVAL seconds), and each language also keeps a
+pre-serialized JSON slice with an ETag for the browser.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+CONTENT_CHECK_INTERVAL = float(os.getenv("CONTENT_CHECK_INTERVAL", 2.0))
+
+# Everything the site needs for one language
+LanguageContent = namedtuple("LanguageContent", ["lang", "translations", "destinations", "json", "etag"])
+
+
+def freeze(value):
+    """Recursively turn dicts and lists into read-only mappings and tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class ContentRegistry:
+    """Per-language translations and destinations with hot reload"""
+
+    def __init__(self, translations_path="static/translations.json",
+                 destinations_path="static/destinations.json",
+                 check_interval=CONTENT_CHECK_INTERVAL, default_lang="en"):
+        self.translations_path = translations_path
+        self.destinations_path = destinations_path
+        self.check_interval = check_interval
+        self.default_lang = default_lang
+        self.version = 0
+        self._lock = threading.Lock()
+        self._mtimes = None
+        self._next_check = 0
+        self._languages = {}
+        self.refresh()
+
+    def get(self, lang, fallback=True):
+        """Return the content for a language, falling back to the default language unless `fallback` is False"""
+        if time.monotonic() >= self._next_check:
+            self.refresh()
+        languages = self._languages
+        content = languages.get(lang)
+        if content is None and fallback:
+            content = languages.get(self.default_lang)
+        return content
+
+    def refresh(self):
+        """Reload the files if they changed since the last load"""
+        with self._lock:
+            self._next_check = time.monotonic() + self.check_interval
+            mtimes = (self._mtime(self.translations_path), self._mtime(self.destinations_path))
+            if mtimes == self._mtimes:
+                return False
+
+            try:
+                translations = self._load(self.translations_path)
+                destinations = self._load(self.destinations_path)
+            except Exception as e:
+                logger.error("Error loading content: %s", e)
+                # Keep serving what we have and try again on the next check
+                return False
+
+            languages = {}
+            for lang in set(translations) | set(destinations):
+                lang_translations = translations.get(lang, {})
+                lang_destinations = destinations.get(lang, [])
+                payload = json.dumps(lang_translations, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                languages[lang] = LanguageContent(
+                    lang=lang,
+                    translations=freeze(lang_translations),
+                    destinations=freeze(lang_destinations),
+                    json=payload,
+                    etag='"' + hashlib.sha256(payload).hexdigest()[:32] + '"'
+                )
+
+            # Swap in the new content in one step
+            self._languages = languages
+            self._mtimes = mtimes
+            self.version += 1
+            return True
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def _load(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
@@ -0,0 +1,155 @@
+"""Token-budgeted context window for chat completions
+
+Only the newest turns of a conversation are sent to the model, within a
+configurable token budget. Turns that slide out of the window are folded
+into a running summary that is cached per session and only recomputed when
+the window moves, so the prompt size stays flat however long the session
+gets. With a shared state backend the window and summary are kept there, so
+that a session moving between workers is not summarized again.
+"""
+import json
+import logging
+import os
+from collections import OrderedDict
+
+import llm_client
+from state_backend import STATE_SESSION_TTL, StateError
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2000))
+# Share of the budget kept after the window moves, so that it moves in steps
+# of several turns rather than on every turn
+CONTEXT_KEEP_RATIO = float(os.getenv("CONTEXT_KEEP_RATIO", 0.6))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", 250))
+
+# Tokens the chat format adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Loaded on first use, as importing tiktoken and its tables takes a while;
+# False when tiktoken is not installed
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+        except ImportError:  # Fall back to an estimate when tiktoken is not installed
+            _encoding = False
+        else:
+            try:
+                _encoding = tiktoken.encoding_for_model(llm_client.LLM_MODEL)
+            except KeyError:  # Models newer than the installed tiktoken
+                _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+
+def count_tokens(text):
+    """Count the tokens in a piece of text"""
+    encoding = _get_encoding()
+    if not encoding:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+def count_message_tokens(messages):
+    """Count the tokens a list of chat messages takes up in a prompt"""
+    return sum(count_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS for msg in messages)
+
+
+class ContextManager:
+    """Keeps each session's prompt within the token budget"""
+
+    def __init__(self, budget=CONTEXT_TOKEN_BUDGET, keep_ratio=CONTEXT_KEEP_RATIO, max_sessions=1000, state=None):
+        self.budget = budget
+        self.keep_ratio = keep_ratio
+        self.max_sessions = max_sessions
+        self.state = state
+        # session_id -> {"start": index of first message in the window, "summary": text}
+        self._windows = OrderedDict()
+
+    async def prepare(self, session_id, history):
+        """Return (summary, recent messages) to send for a session's history"""
+        previous = await self._run(self._load_window, session_id)
+        window = previous or {"start": 0, "summary": None}
+        # History can shrink if the session was archived or reset
+        if window["start"] > len(history):
+            window = {"start": 0, "summary": None}
+
+        start = window["start"]
+        if count_message_tokens(history[start:]) > self.budget:
+            start = self._next_start(history, start)
+
+        if start != window["start"]:
+            summary = await self._summarize(window["summary"], history[window["start"]:start])
+            window = {"start": start, "summary": summary}
+
+        if window != previous:
+            await self._run(self._save_window, session_id, window)
+        return window["summary"], history[start:]
+
+    async def _run(self, func, *args):
+        # Shared state is read and written off the event loop
+        if self.state is None:
+            return func(*args)
+        return await self.state.run(func, *args)
+
+    def _load_window(self, session_id):
+        if self.state is None:
+            window = self._windows.get(session_id)
+            if window is not None:
+                self._windows.move_to_end(session_id)
+            return window
+        try:
+            window = self.state.get(f"context:{session_id}")
+        except StateError as e:
+            logger.warning("Error loading context window: %s", e)
+            return None
+        return json.loads(window) if window else None
+
+    def _save_window(self, session_id, window):
+        if self.state is None:
+            self._windows[session_id] = window
+            self._windows.move_to_end(session_id)
+            while len(self._windows) > self.max_sessions:
+                self._windows.popitem(last=False)
+            return
+        try:
+            self.state.set(f"context:{session_id}", json.dumps(window, ensure_ascii=False), ttl=STATE_SESSION_TTL)
+        except StateError as e:
+            logger.warning("Error saving context window: %s", e)
+
+    def _next_start(self, history, start):
+        """Move the window start forward until the rest fits the reduced budget"""
+        target = self.budget * self.keep_ratio
+        tokens = count_message_tokens(history[start:])
+        while start < len(history) and tokens > target:
+            tokens -= count_message_tokens([history[start]])
+            start += 1
+        # Always start the window on a user turn
+        while start < len(history) and history[start]["role"] != "user":
+            start += 1
+        return start
+
+    async def _summarize(self, previous_summary, messages):
+        """Fold messages that left the window into the running summary"""
+        transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+        prompt = (
+            "Update the summary of a conversation between a traveller and a travel agent. "
+            "Keep destinations, dates, party size, budget, interests and contact details. "
+            "Answer with the summary only.\n\n"
+            f"Current summary:\n{previous_summary or '(none)'}\n\n"
+            f"New messages:\n{transcript}"
+        )
+        try:
+            return await llm_client.create_chat_completion(
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0,
+                max_tokens=SUMMARY_MAX_TOKENS
+            )
+        except Exception as e:
+            logger.warning("Error summarizing conversation: %s", e)
+            # Keep the old summary rather than failing the turn
+            return previous_summary
@@ -0,0 +1,437 @@
+"""Conversation history storage
+
+History is stored append-only: every turn adds its messages instead of
+rewriting the whole conversation. `SQLiteConversationStore` keeps them in a
+single SQLite database in WAL mode, and `CachedConversationStore` wraps any
+backend with an in-memory LRU of hot sessions whose new messages are written
+behind by a background thread.
+
+Each session also has a traveller profile (see session_profile), stored as
+one JSON document next to the history and written behind the same way.
+
+With several workers, a per-process cache would go stale as soon as another
+worker answers a turn, so `SharedConversationStore` keeps hot sessions in
+the shared state backend instead and only writes behind to the database.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from state_backend import STATE_SESSION_TTL, StateError
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationStore:
+    """Interface for conversation history backends"""
+
+    def load(self, session_id):
+        """Return the list of messages stored for a session"""
+        raise NotImplementedError
+
+    def append(self, session_id, messages):
+        """Append messages to a session's history"""
+        raise NotImplementedError
+
+    def append_many(self, batch):
+        """Append messages for several sessions, given as (session_id, messages) pairs"""
+        for session_id, messages in batch:
+            self.append(session_id, messages)
+
+    def load_profile(self, session_id):
+        """Return the traveller profile stored for a session"""
+        return {}
+
+    def save_profile(self, session_id, profile):
+        """Replace a session's traveller profile"""
+        self.save_profiles([(session_id, profile)])
+
+    def save_profiles(self, batch):
+        """Replace the profiles of several sessions, given as (session_id, profile) pairs"""
+        raise NotImplementedError
+
+    def forget(self, session_ids):
+        """Drop any cached state of sessions removed from the backend"""
+
+    def flush(self):
+        """Persist any buffered writes"""
+
+    def close(self):
+        """Flush buffered writes and release resources"""
+        self.flush()
+
+
+class SQLiteConversationStore(ConversationStore):
+    """Append-only conversation store backed by SQLite in WAL mode"""
+
+    def __init__(self, path="conversations.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS profiles (
+                session_id TEXT PRIMARY KEY,
+                profile TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def load(self, session_id, last_id=None):
+        """Return the messages stored for a session, up to the row `last_id` if given"""
+        if last_id is None:
+            query, params = "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id", (session_id,)
+        else:
+            query = "SELECT role, content FROM messages WHERE session_id = ? AND id <= ? ORDER BY id"
+            params = (session_id, last_id)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def append(self, session_id, messages):
+        self.append_many([(session_id, messages)])
+
+    def append_many(self, batch):
+        """Append messages for several sessions in one transaction"""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        rows = [
+            (session_id, msg["role"], msg["content"], now)
+            for session_id, messages in batch
+            for msg in messages
+        ]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                rows
+            )
+
+    def load_profile(self, session_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT profile FROM profiles WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def save_profiles(self, batch):
+        """Replace the profiles of several sessions in one transaction"""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        rows = [(session_id, json.dumps(profile, ensure_ascii=False), now) for session_id, profile in batch]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO profiles (session_id, profile, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (session_id) DO UPDATE SET profile = excluded.profile, updated_at = excluded.updated_at",
+                rows
+            )
+
+    def expired_sessions(self, cutoff, after="", limit=500):
+        """Return (session_id, last_active, last_id) for sessions with no messages since `cutoff`
+
+        Sessions are ordered by id, starting after `after`, so a caller can
+        page through them while deleting. `last_id` is the row of the
+        newest message, for `load` and `delete_sessions`.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT session_id, MAX(created_at), MAX(id) FROM messages WHERE session_id > ? "
+                "GROUP BY session_id HAVING MAX(created_at) < ? ORDER BY session_id LIMIT ?",
+                (after, cutoff, limit)
+            ).fetchall()
+
+    def delete_sessions(self, sessions, cutoff):
+        """Delete archived sessions, given as (session_id, last_id) pairs, in one transaction
+
+        Only messages up to `last_id` are deleted, and only if the session
+        has had no messages since `cutoff` and none after `last_id`, so a
+        session that became active again while it was being archived is
+        kept whole. Returns the session_ids that were deleted.
+        """
+        deleted = []
+        with self._lock, self._conn:
+            for session_id, last_id in sessions:
+                removed = self._conn.execute(
+                    "DELETE FROM messages WHERE session_id = ? AND id <= ? AND NOT EXISTS "
+                    "(SELECT 1 FROM messages WHERE session_id = ? AND (id > ? OR created_at >= ?))",
+                    (session_id, last_id, session_id, last_id, cutoff)
+                ).rowcount
+                if removed:
+                    self._conn.execute("DELETE FROM profiles WHERE session_id = ?", (session_id,))
+                    deleted.append(session_id)
+        return deleted
+
+    def prune_profiles(self, cutoff):
+        """Delete profiles not updated since `cutoff` whose session has no messages"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM profiles WHERE updated_at < ? "
+                "AND session_id NOT IN (SELECT DISTINCT session_id FROM messages)",
+                (cutoff,)
+            )
+
+    def has_session(self, session_id):
+        """Check whether any messages are stored for a session"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM messages WHERE session_id = ? LIMIT 1",
+                (session_id,)
+            ).fetchone()
+        return row is not None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedConversationStore(ConversationStore):
+    """LRU cache of hot sessions in front of a backend, with write-behind flushing"""
+
+    def __init__(self, backend, max_sessions=1000, flush_interval=1.0):
+        self.backend = backend
+        self.max_sessions = max_sessions
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # Serialises flushes with cache-miss reads so a read never misses
+        # messages that are half way between the buffer and the backend
+        self._flush_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._profiles = OrderedDict()
+        self._pending_profiles = {}
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="conversation-flusher", daemon=True)
+        self._flusher.start()
+
+    def load(self, session_id):
+        with self._lock:
+            if session_id in self._cache:
+                self._cache.move_to_end(session_id)
+                return list(self._cache[session_id])
+
+        # Cache miss: read from the backend without blocking appends
+        with self._flush_lock:
+            history = self.backend.load(session_id)
+            with self._lock:
+                # Messages not flushed yet are still in the buffer
+                history.extend(self._pending.get(session_id, []))
+                self._remember(session_id, history)
+                return list(history)
+
+    def append(self, session_id, messages):
+        with self._lock:
+            if session_id in self._cache:
+                self._cache[session_id].extend(messages)
+                self._cache.move_to_end(session_id)
+            self._pending.setdefault(session_id, []).extend(messages)
+
+    def load_profile(self, session_id):
+        with self._lock:
+            if session_id in self._profiles:
+                self._profiles.move_to_end(session_id)
+                return dict(self._profiles[session_id])
+
+        with self._flush_lock:
+            with self._lock:
+                # A profile saved since the last check is newer than the backend's
+                profile = self._pending_profiles.get(session_id)
+            if profile is None:
+                profile = self.backend.load_profile(session_id)
+            with self._lock:
+                self._remember_profile(session_id, profile)
+                return dict(profile)
+
+    def save_profile(self, session_id, profile):
+        with self._lock:
+            self._remember_profile(session_id, dict(profile))
+            self._pending_profiles[session_id] = dict(profile)
+
+    def save_profiles(self, batch):
+        for session_id, profile in batch:
+            self.save_profile(session_id, profile)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending.items())
+                profiles = list(self._pending_profiles.items())
+                self._pending = {}
+                self._pending_profiles = {}
+            if batch:
+                try:
+                    self.backend.append_many(batch)
+                except Exception as e:
+                    logger.error("Error flushing conversation history: %s", e)
+                    # Put the messages back in front of anything appended since
+                    with self._lock:
+                        for session_id, messages in batch:
+                            self._pending[session_id] = messages + self._pending.get(session_id, [])
+            if profiles:
+                try:
+                    self.backend.save_profiles(profiles)
+                except Exception as e:
+                    logger.error("Error flushing session profiles: %s", e)
+                    # A profile saved since is newer, so only restore the others
+                    with self._lock:
+                        for session_id, profile in profiles:
+                            self._pending_profiles.setdefault(session_id, profile)
+
+    def forget(self, session_ids):
+        with self._lock:
+            for session_id in session_ids:
+                self._cache.pop(session_id, None)
+                self._profiles.pop(session_id, None)
+
+    def close(self):
+        self._stop.set()
+        self._flusher.join(timeout=self.flush_interval * 2)
+        self.flush()
+        self.backend.close()
+
+    def _remember(self, session_id, history):
+        self._cache[session_id] = history
+        self._cache.move_to_end(session_id)
+        while len(self._cache) > self.max_sessions:
+            self._cache.popitem(last=False)
+
+    def _remember_profile(self, session_id, profile):
+        self._profiles[session_id] = profile
+        self._profiles.move_to_end(session_id)
+        while len(self._profiles) > self.max_sessions:
+            self._profiles.popitem(last=False)
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+
+class SharedConversationStore(ConversationStore):
+    """Hot sessions in a shared state backend, written behind to a backend
+
+    A session's history is a list in the state whose first item is a marker,
+    so that an empty history is told apart from one that is not loaded. New
+    messages are only appended to a list that exists; a session that has
+    expired from the state is read back from the backend on its next load.
+    If the state backend fails, reads fall back to the backend and writes
+    still reach it.
+    """
+
+    HISTORY_MARKER = "#"
+
+    def __init__(self, backend, state, ttl=STATE_SESSION_TTL, flush_interval=1.0):
+        self.backend = backend
+        self.state = state
+        self.ttl = ttl
+        # Write-behind only: nothing is cached in process, as another worker may change it
+        self._writer = CachedConversationStore(backend, max_sessions=0, flush_interval=flush_interval)
+
+    def load(self, session_id):
+        key = f"history:{session_id}"
+        try:
+            items = self.state.items(key)
+        except StateError as e:
+            logger.warning("Error loading history from the shared state: %s", e)
+            return self._writer.load(session_id)
+        if items:
+            return [json.loads(item) for item in items[1:]]
+
+        history = self._writer.load(session_id)
+        try:
+            # Only if no other worker has seeded it meanwhile, which would double the history
+            self.state.push(key, [self.HISTORY_MARKER] + [self._encode(msg) for msg in history],
+                            ttl=self.ttl, only_new=True)
+        except StateError as e:
+            logger.warning("Error caching history in the shared state: %s", e)
+        return history
+
+    def append(self, session_id, messages):
+        self._writer.append(session_id, messages)
+        try:
+            self.state.push(f"history:{session_id}", [self._encode(msg) for msg in messages],
+                            ttl=self.ttl, only_existing=True)
+        except StateError as e:
+            # Drop the shared copy, if we still can, rather than leave it behind the backend
+            logger.warning("Error appending history in the shared state: %s", e)
+            self._forget_shared([session_id])
+
+    def load_profile(self, session_id):
+        key = f"profile:{session_id}"
+        try:
+            profile = self.state.get(key)
+        except StateError as e:
+            logger.warning("Error loading profile from the shared state: %s", e)
+            return self._writer.load_profile(session_id)
+        if profile is not None:
+            return json.loads(profile)
+
+        profile = self._writer.load_profile(session_id)
+        try:
+            # A profile saved meanwhile by another worker is newer
+            self.state.set(key, self._encode(profile), ttl=self.ttl, only_new=True)
+        except StateError as e:
+            logger.warning("Error caching profile in the shared state: %s", e)
+        return profile
+
+    def save_profile(self, session_id, profile):
+        self._writer.save_profile(session_id, profile)
+        try:
+            self.state.set(f"profile:{session_id}", self._encode(profile), ttl=self.ttl)
+        except StateError as e:
+            logger.warning("Error saving profile in the shared state: %s", e)
+            self._forget_shared([session_id])
+
+    def save_profiles(self, batch):
+        for session_id, profile in batch:
+            self.save_profile(session_id, profile)
+
+    def forget(self, session_ids):
+        self._writer.forget(session_ids)
+        self._forget_shared(session_ids)
+
+    def flush(self):
+        self._writer.flush()
+
+    def close(self):
+        self._writer.close()
+
+    def _forget_shared(self, session_ids):
+        keys = [f"{kind}:{session_id}" for session_id in session_ids for kind in ("history", "profile")]
+        try:
+            self.state.delete(*keys)
+        except StateError as e:
+            logger.warning("Error dropping sessions from the shared state: %s", e)
+
+    @staticmethod
+    def _encode(value):
+        return json.dumps(value, ensure_ascii=False)
+
+
+def create_conversation_store(state=None):
+    """Create the conversation store configured by the environment, sharing hot sessions through `state` if given"""
+    backend = SQLiteConversationStore(os.getenv("CONVERSATION_DB", "conversations.db"))
+    flush_interval = float(os.getenv("CONVERSATION_FLUSH_INTERVAL", 1.0))
+    if state is not None:
+        return SharedConversationStore(backend, state, flush_interval=flush_interval)
+    return CachedConversationStore(
+        backend,
+        max_sessions=int(os.getenv("CONVERSATION_CACHE_SIZE", 1000)),
+        flush_interval=flush_interval
+    )
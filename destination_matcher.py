@@ -0,0 +1,154 @@
+"""Multilingual destination matching
+
+Destination names are indexed once from `static/destinations.json` and the
+alias table in `static/destination_aliases.json`. Messages are folded
+(casefolded, diacritics removed) and split into words in a single pass, and
+each word or short run of words is looked up in a dict, so matching cost
+depends on the message length and not on how many destinations are known.
+Matches respect word boundaries ("uk" no longer matches inside "ukraine"),
+and a stem followed by a Ukrainian, Russian or Romanian case ending also
+matches, so inflected forms such as "Барселоні" or "Spaniei" are found too.
+Only those endings are accepted, so "francs", "italic" or "Germans" do not
+match.
+"""
+import json
+import re
+import unicodedata
+
+# Shorter stems match too many unrelated words
+MIN_STEM_LENGTH = 4
+STEM_VOWELS = set("aeiouyаеєиіїоуюяыэ")
+
+# Case endings that may follow a stem: Ukrainian and Russian for names in
+# Cyrillic, Romanian genitive and definite forms for names in Latin script
+CYRILLIC_ENDINGS = (
+    "а", "я", "у", "ю", "е", "є", "і", "ї", "и", "ы",
+    "ой", "ою", "ей", "ею", "єю", "ом", "ем", "ам", "ям", "ах", "ях", "ами", "ями",
+    "ові", "еві", "ії", "ію", "ія", "ій", "ии", "ию", "ия", "ие", "ией", "ием"
+)
+LATIN_ENDINGS = ("ei", "ul", "ului", "lui")
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def fold(text):
+    """Casefold text and strip diacritics so that e.g. 'Franța' matches 'franta'"""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """Split folded text into words"""
+    return WORD_PATTERN.findall(fold(text))
+
+
+def endings_by_length(endings):
+    """Folded endings grouped by length, longest first"""
+    folded = {fold(ending) for ending in endings}
+    return [
+        (length, frozenset(ending for ending in folded if len(ending) == length))
+        for length in sorted({len(ending) for ending in folded}, reverse=True)
+    ]
+
+
+CYRILLIC_SUFFIXES = endings_by_length(CYRILLIC_ENDINGS)
+LATIN_SUFFIXES = endings_by_length(LATIN_ENDINGS)
+
+
+def slugify(name):
+    """Turn a display name into a canonical destination ID"""
+    return "-".join(tokenize(name))
+
+
+class DestinationIndex:
+    """Lookup tables from folded destination names to canonical IDs"""
+
+    def __init__(self):
+        self.names = {}
+        self._phrases = {}
+        self._stems = {}
+        self._max_words = 1
+
+    def add(self, destination_id, name, aliases):
+        """Register a destination with its display name and aliases"""
+        self.names.setdefault(destination_id, name)
+        for alias in list(aliases) + [name]:
+            words = tokenize(alias)
+            if not words:
+                continue
+            self._phrases.setdefault(" ".join(words), destination_id)
+            self._max_words = max(self._max_words, len(words))
+
+            # Single words also match followed by a case ending
+            if len(words) == 1:
+                word = words[0]
+                stem = word[:-1] if word[-1] in STEM_VOWELS else word
+                if len(stem) >= MIN_STEM_LENGTH:
+                    self._stems.setdefault(stem, destination_id)
+
+    def match(self, message):
+        """Return the IDs of the destinations mentioned in a message, in order of appearance"""
+        words = tokenize(message)
+        found = []
+        i = 0
+        while i < len(words):
+            destination_id, length = self._match_at(words, i)
+            if destination_id:
+                if destination_id not in found:
+                    found.append(destination_id)
+                i += length
+            else:
+                i += 1
+        return found
+
+    def display_name(self, destination_id):
+        """Return the display name for a destination ID"""
+        return self.names.get(destination_id) or destination_id.capitalize()
+
+    def _match_at(self, words, i):
+        # Prefer the longest phrase starting at this word
+        for length in range(min(self._max_words, len(words) - i), 0, -1):
+            destination_id = self._phrases.get(" ".join(words[i:i + length]))
+            if destination_id:
+                return destination_id, length
+
+        word = words[i]
+        suffixes = CYRILLIC_SUFFIXES if "\u0400" <= word[0] <= "\u04ff" else LATIN_SUFFIXES
+        for length, endings in suffixes:
+            if len(word) - length < MIN_STEM_LENGTH or word[-length:] not in endings:
+                continue
+            destination_id = self._stems.get(word[:-length])
+            if destination_id:
+                return destination_id, 1
+
+        return None, 0
+
+    @classmethod
+    def from_files(cls, destinations_path="static/destinations.json",
+                   aliases_path="static/destination_aliases.json"):
+        """Build the index from the destination catalog and the alias table"""
+        index = cls()
+
+        with open(aliases_path, 'r', encoding='utf-8') as f:
+            for destination_id, entry in json.load(f).items():
+                index.add(destination_id, entry["name"], entry.get("aliases", []))
+
+        # Catalog entries are "City, Country" and are listed in the same
+        # order for every language, so the English entry names the IDs
+        with open(destinations_path, 'r', encoding='utf-8') as f:
+            catalog = json.load(f)
+        for position, entry in enumerate(catalog.get("en", [])):
+            parts = [part.strip() for part in entry["name"].split(",")]
+            localized = [
+                [part.strip() for part in entries[position]["name"].split(",")]
+                for entries in catalog.values()
+                if position < len(entries)
+            ]
+            for level, english_name in enumerate(parts):
+                index.add(
+                    slugify(english_name),
+                    english_name,
+                    [names[level] for names in localized if level < len(names)]
+                )
+
+        return index
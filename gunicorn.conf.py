@@ -0,0 +1,39 @@
+"""Gunicorn settings for running the app with several worker processes
+
+    STATE_BACKEND_URL=redis://127.0.0.1:6379/0 gunicorn -c gunicorn.conf.py app:app
+
+Each worker is a uvicorn event loop with its own warm-up, background
+threads and connections; sessions, locks, rate limits, cached replies and
+metrics are shared through STATE_BACKEND_URL, so requests need no sticky
+routing. WEB_CONCURRENCY defaults to one worker per CPU when a state backend
+is configured and to a single worker otherwise. The in-flight cap
+(CHAT_MAX_IN_FLIGHT) applies per worker.
+
+Multi-host is not supported. Conversation history, profiles, the lead queue
+and its CSV fallback are kept in SQLite and CSV files on this host
+(CONVERSATION_DB, LEAD_QUEUE_DB, LEAD_FALLBACK_CSV); the shared state only
+holds a copy of hot sessions that expires. Hosts with files of their own
+would each hold part of a session's history and queue leads of their own,
+so warm-up fails when workers on another host already use the same
+STATE_BACKEND_URL. Scaling out further needs those stores moved to a shared
+database first. The retention job runs once per round.
+"""
+import os
+
+from app import WEB_CONCURRENCY
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', 8000)}"
+workers = WEB_CONCURRENCY
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Importing the app does no I/O, so it is imported once and the workers are
+# forked from it; each worker warms up in its own lifespan
+preload_app = True
+
+# Longer than a chat turn with retries (LLM_DEADLINE), so a slow reply is not mistaken for a hung worker
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 90))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+# Recycle workers now and then, spread out so they do not restart together
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = max(1, max_requests // 10)
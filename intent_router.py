@@ -0,0 +1,200 @@
+"""Intent routing for chat turns
+
+Each message is classified as a greeting, a contact share, a destination
+pick, an itinerary request or a FAQ. Clear cases are caught by rules; the
+rest go to a small naive Bayes model trained at startup on the seed phrases
+below. Greetings only come from the rule, since a short seed list would
+otherwise win every message the model has no words for. The intent decides which model answers and how many tokens it may
+use, and a bare greeting at the start of a chat or a message that only
+shares contact details gets a templated reply without calling the LLM.
+
+Models are picked from two tiers: LLM_FAST_MODEL for short turns and
+LLM_STRONG_MODEL for itineraries. Both default to LLM_MODEL.
+"""
+import json
+import math
+import os
+import re
+from collections import Counter, namedtuple
+
+import llm_client
+from contact_extractor import CONTACT_PATTERN
+from context_window import count_message_tokens, count_tokens
+from destination_matcher import tokenize
+from observability import Counter as MetricCounter, Histogram
+
+LLM_FAST_MODEL = os.getenv("LLM_FAST_MODEL") or llm_client.LLM_MODEL
+LLM_STRONG_MODEL = os.getenv("LLM_STRONG_MODEL") or llm_client.LLM_MODEL
+# Below this probability the classifier's guess is not trusted
+INTENT_MIN_CONFIDENCE = float(os.getenv("INTENT_MIN_CONFIDENCE", 0.5))
+
+# USD per 1K prompt and completion tokens, for the cost estimate
+LLM_PRICES = json.loads(os.getenv("LLM_PRICES", '{"gpt-3.5-turbo": [0.0015, 0.002], "gpt-4": [0.03, 0.06]}'))
+
+INTENT_TURNS = MetricCounter("chat_intent_turns_total", "Chat turns by intent and how they were answered", ["intent", "answer"])
+INTENT_DURATION = Histogram("chat_intent_duration_seconds", "Time to answer a chat turn by intent", ["intent"])
+LLM_TOKENS = MetricCounter("llm_tokens_total", "Estimated LLM tokens by intent", ["intent", "model", "kind"])
+LLM_COST = MetricCounter("llm_cost_usd_total", "Estimated LLM cost in USD by intent", ["intent", "model"])
+
+# Model tier and max_tokens per intent
+INTENT_BUDGETS = {
+    "greeting": ("fast", 200),
+    "contact": ("fast", 250),
+    "destination": ("fast", 450),
+    "faq": ("fast", 350),
+    "itinerary": ("strong", 1000),
+    "other": ("fast", 600),
+}
+
+# Longer messages ask for more than a templated reply can give
+GREETING_MAX_WORDS = 4
+CONTACT_MAX_WORDS = 8
+
+GREETING_WORDS = set(tokenize(
+    "hi hello hey hallo guten tag morgen servus moin привіт вітаю добрий день вечір "
+    "здравствуйте привет добрый salut buna ziua"
+))
+
+ITINERARY_PATTERN = re.compile(
+    r"\b(?:itinerary|itinerar\w*|day[- ]by[- ]day|route|reiseplan\w*|reiseroute|tagesplan|"
+    r"маршрут\w*|план\w* поїздк\w*|план\w* поездк\w*|"
+    r"program\w* (?:of|for) (?:the |our )?(?:trip|tour)|programul (?:excursiei|călătoriei|turului)|"
+    r"\d+\s*(?:days?|nights?|tage?n?|nächte|дн\w*|ноч\w*|zile|nopți))\b",
+    re.IGNORECASE
+)
+
+# Seed phrases for the classifier, a few per intent and language
+TRAINING_PHRASES = {
+    "destination": [
+        "i want to go to bali", "we are thinking about greece", "somewhere warm with beaches",
+        "where should we travel in winter", "suggest a destination for a family holiday",
+        "ich möchte nach spanien", "wohin sollen wir reisen", "хочу поїхати до єгипту",
+        "куди поїхати на море", "хочу поехать в турцию", "куда поехать летом", "vreau să merg în grecia",
+        "unde să mergem în vacanță",
+    ],
+    "itinerary": [
+        "plan a 10 day trip", "make an itinerary for japan", "what should we do each day",
+        "plan our honeymoon week by week", "erstelle einen reiseplan", "plane eine rundreise",
+        "склади маршрут подорожі", "план поїздки на тиждень", "составь маршрут", "план поездки на неделю",
+        "fă un itinerariu", "planifică o călătorie de o săptămână",
+    ],
+    "faq": [
+        "do i need a visa", "how much does it cost", "what is the best time to visit",
+        "is it safe to travel", "what currency do they use", "do you offer insurance",
+        "brauche ich ein visum", "wie viel kostet es", "чи потрібна віза", "скільки коштує тур",
+        "нужна ли виза", "сколько стоит", "am nevoie de viză", "cât costă",
+    ],
+}
+
+Route = namedtuple("Route", ["intent", "model", "max_tokens", "reply"])
+
+GREETING_REPLIES = {
+    "en": "👋 Hi! Where would you like to travel? Tell me a destination, or what kind of trip you have in mind, and I'll suggest some ideas.",
+    "de": "👋 Hallo! Wohin möchtest du reisen? Nenne mir ein Reiseziel oder erzähl mir, was für eine Reise du dir vorstellst, und ich mache dir Vorschläge.",
+    "uk": "👋 Привіт! Куди б ви хотіли поїхати? Назвіть напрямок або розкажіть, яку подорож ви плануєте, і я запропоную ідеї.",
+    "ru": "👋 Привет! Куда бы вы хотели поехать? Назовите направление или расскажите, какую поездку вы планируете, и я предложу идеи.",
+    "ro": "👋 Salut! Unde ai vrea să călătorești? Spune-mi o destinație sau ce fel de călătorie îți dorești și îți voi sugera câteva idei.",
+}
+
+CONTACT_REPLIES = {
+    "en": "✅ Thank you! A travel specialist will contact you at {contact} shortly. Is there anything else you'd like to know about your trip?",
+    "de": "✅ Vielen Dank! Ein Reiseberater wird sich in Kürze unter {contact} bei dir melden. Möchtest du noch etwas über deine Reise wissen?",
+    "uk": "✅ Дякую! Наш турагент незабаром зв'яжеться з вами за контактом {contact}. Чи хочете дізнатися ще щось про подорож?",
+    "ru": "✅ Спасибо! Наш турагент скоро свяжется с вами по контакту {contact}. Хотите узнать что-нибудь ещё о поездке?",
+    "ro": "✅ Mulțumesc! Un specialist în turism vă va contacta în curând la {contact}. Mai doriți să aflați ceva despre călătorie?",
+}
+
+
+class IntentClassifier:
+    """Multinomial naive Bayes over folded words"""
+
+    def __init__(self, training_phrases=TRAINING_PHRASES):
+        self.word_counts = {}
+        self.totals = {}
+        self.priors = {}
+        vocabulary = set()
+        phrase_count = sum(len(phrases) for phrases in training_phrases.values())
+        for intent, phrases in training_phrases.items():
+            counts = Counter(word for phrase in phrases for word in tokenize(phrase))
+            self.word_counts[intent] = counts
+            self.totals[intent] = sum(counts.values())
+            self.priors[intent] = math.log(len(phrases) / phrase_count)
+            vocabulary.update(counts)
+        self.vocabulary = vocabulary
+        self.vocabulary_size = len(vocabulary)
+
+    def classify(self, message):
+        """Return (intent, probability) for the most likely intent"""
+        # Words no intent was trained on say nothing about the intent, and
+        # with add-one smoothing they would favor the intent with the
+        # fewest seed words
+        words = [word for word in tokenize(message) if word in self.vocabulary]
+        scores = {}
+        for intent, counts in self.word_counts.items():
+            denominator = self.totals[intent] + self.vocabulary_size
+            scores[intent] = self.priors[intent] + sum(
+                math.log((counts.get(word, 0) + 1) / denominator) for word in words
+            )
+        best = max(scores, key=scores.get)
+        # Normalize the log scores into a probability for the winner
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1 / total
+
+
+class IntentRouter:
+    """Chooses the intent, model and token budget for a chat turn"""
+
+    def __init__(self, destination_index, classifier=None):
+        self.destination_index = destination_index
+        self.classifier = classifier or IntentClassifier()
+
+    def classify(self, message, contact=None):
+        """Return the intent of a message"""
+        words = tokenize(message)
+        # An itinerary request that also shares a contact still needs the itinerary budget
+        if ITINERARY_PATTERN.search(message):
+            return "itinerary"
+        if contact:
+            return "contact"
+        destinations = self.destination_index.match(message)
+        if words and len(words) <= GREETING_MAX_WORDS and words[0] in GREETING_WORDS and not destinations:
+            return "greeting"
+        if destinations:
+            return "destination"
+
+        intent, probability = self.classifier.classify(message)
+        if probability >= INTENT_MIN_CONFIDENCE:
+            return intent
+        return "other"
+
+    def route(self, message, lang, history=(), contact=None):
+        """Decide how to answer a turn; `reply` is set when no LLM call is needed"""
+        intent = self.classify(message, contact)
+        tier, max_tokens = INTENT_BUDGETS[intent]
+        model = LLM_STRONG_MODEL if tier == "strong" else LLM_FAST_MODEL
+
+        reply = None
+        if intent == "greeting" and not history and len(tokenize(message)) <= GREETING_MAX_WORDS:
+            reply = GREETING_REPLIES.get(lang, GREETING_REPLIES["en"])
+        elif intent == "contact" and len(tokenize(CONTACT_PATTERN.sub(" ", message))) <= CONTACT_MAX_WORDS:
+            # The message is little more than the contact itself
+            reply = CONTACT_REPLIES.get(lang, CONTACT_REPLIES["en"]).format(contact=contact)
+        return Route(intent, model, max_tokens, reply)
+
+
+def record_turn(route, answer, seconds):
+    """Count a finished turn; `answer` says where the reply came from"""
+    INTENT_TURNS.inc(intent=route.intent, answer=answer)
+    INTENT_DURATION.observe(seconds, intent=route.intent)
+
+
+def record_llm_usage(route, messages, reply):
+    """Estimate the tokens and cost of an LLM call for a turn"""
+    prompt_tokens = count_message_tokens(messages)
+    completion_tokens = count_tokens(reply)
+    LLM_TOKENS.inc(prompt_tokens, intent=route.intent, model=route.model, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, intent=route.intent, model=route.model, kind="completion")
+    prices = LLM_PRICES.get(route.model)
+    if prices:
+        cost = (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1000
+        LLM_COST.inc(cost, intent=route.intent, model=route.model)
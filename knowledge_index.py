@@ -0,0 +1,274 @@
+"""Retrieval over the destination catalog
+
+Every field of every catalog entry in `static/destinations.json` (overview,
+highlights, best time to visit) becomes a small document in a per-language
+BM25 index that is built once at startup. Each language has its own
+analyzer: stop words and a light suffix stemmer on top of the folding in
+destination_matcher.
+
+`lookup` handles a chat message in one of two ways:
+
+* a short question about one catalog destination and one field ("when is
+  the best time to visit Santorini?") is answered directly from the
+  catalog, without calling the LLM, when the entry covers every word of it;
+* otherwise the best matching fields are returned as snippets to put in the
+  prompt, in place of the whole catalog.
+"""
+import json
+import math
+import os
+from collections import Counter, namedtuple
+
+from destination_matcher import fold, slugify, tokenize
+
+KNOWLEDGE_DIRECT_ANSWERS = os.getenv("KNOWLEDGE_DIRECT_ANSWERS", "true").lower() in ("1", "true", "yes")
+KNOWLEDGE_MAX_SNIPPETS = int(os.getenv("KNOWLEDGE_MAX_SNIPPETS", 3))
+KNOWLEDGE_MIN_SCORE = float(os.getenv("KNOWLEDGE_MIN_SCORE", 1.5))
+# Longer messages usually ask for more than one fact
+KNOWLEDGE_MAX_QUESTION_WORDS = int(os.getenv("KNOWLEDGE_MAX_QUESTION_WORDS", 16))
+# Score lead the best hit needs over the runner-up to be answered directly
+KNOWLEDGE_DIRECT_MARGIN = float(os.getenv("KNOWLEDGE_DIRECT_MARGIN", 0.25))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+MIN_STEM_LENGTH = 3
+
+FIELDS = ("desc", "highlights", "best_time")
+
+# Label of each field in the snippets given to the model
+FIELD_LABELS = {
+    "desc": "overview",
+    "highlights": "highlights",
+    "best_time": "best time to visit",
+}
+
+STOP_WORDS = {
+    "en": "a an the is are was be to of in on at for and or with what which when where how do does i we you "
+          "me my our it this that there can could would should about tell",
+    "de": "der die das den dem des ein eine einen einem ist sind war zu in im an am auf für und oder mit was "
+          "welche wann wo wie ich wir du sie mir uns es nach kann können",
+    "uk": "і й та в у на до з із за про що як де коли чи це я ми ви мені нам є бути можна який яка які",
+    "ru": "и в во на до с со за про что как где когда ли это я мы вы мне нам есть быть можно какой какая какие",
+    "ro": "și si în in la de din pe cu pentru ce care când unde cum este sunt eu noi voi îmi ne a al o un "
+          "poate despre",
+}
+
+SUFFIXES = {
+    "en": ("ing", "es", "ed", "s"),
+    "de": ("en", "er", "es", "e", "n", "s"),
+    "uk": ("ами", "ями", "ого", "ому", "ими", "ий", "ій", "ої", "ою", "ею", "ів", "ах", "ях", "ам", "ям",
+           "і", "и", "а", "я", "у", "ю", "е", "о"),
+    "ru": ("ами", "ями", "ого", "его", "ому", "ыми", "ими", "ый", "ий", "ое", "ая", "ой", "ей", "ов", "ах", "ях", "ам", "ям",
+           "ы", "и", "а", "я", "у", "ю", "е", "о"),
+    "ro": ("ului", "ilor", "lor", "ul", "le", "ii", "a", "e", "i"),
+}
+
+# Words that show which field a question is about
+FIELD_KEYWORDS = {
+    "best_time": {
+        "en": ["when", "best time", "season", "month", "weather"],
+        "de": ["wann", "reisezeit", "beste zeit", "saison", "monat", "wetter"],
+        "uk": ["коли", "найкращий час", "кращий час", "сезон", "місяць", "погода"],
+        "ru": ["когда", "лучшее время", "сезон", "месяц", "погода"],
+        "ro": ["când", "cea mai bună perioadă", "perioada", "sezon", "luna", "vremea"],
+    },
+    "highlights": {
+        "en": ["see", "sights", "sightseeing", "attractions", "highlights", "landmarks"],
+        "de": ["sehen", "sehenswürdigkeiten", "attraktionen", "highlights", "besichtigen"],
+        "uk": ["подивитися", "побачити", "пам'ятки", "визначні місця", "цікаві місця"],
+        "ru": ["посмотреть", "увидеть", "достопримечательности", "интересные места"],
+        "ro": ["văd", "vedea", "vizitat", "obiective", "atracții"],
+    },
+}
+
+DIRECT_ANSWERS = {
+    "best_time": {
+        "en": "🌤️ The best time to visit {name} is {value}.",
+        "de": "🌤️ Die beste Reisezeit für {name}: {value}.",
+        "uk": "🌤️ {name} — найкращий час для подорожі: {value}.",
+        "ru": "🌤️ {name} — лучшее время для поездки: {value}.",
+        "ro": "🌤️ Cea mai bună perioadă pentru a vizita {name}: {value}.",
+    },
+    "highlights": {
+        "en": "✨ Top highlights in {name}: {value}.",
+        "de": "✨ Die Highlights in {name}: {value}.",
+        "uk": "✨ {name} — головні пам'ятки: {value}.",
+        "ru": "✨ {name} — главные достопримечательности: {value}.",
+        "ro": "✨ Atracțiile principale din {name}: {value}.",
+    },
+}
+
+FOLLOW_UPS = {
+    "en": "Would you like me to help you plan a trip there?",
+    "de": "Soll ich dir helfen, eine Reise dorthin zu planen?",
+    "uk": "Хочете, я допоможу спланувати подорож?",
+    "ru": "Хотите, я помогу спланировать поездку?",
+    "ro": "Vrei să te ajut să planifici o călătorie acolo?",
+}
+
+Document = namedtuple("Document", ["destination_id", "field", "name", "value", "length", "terms"])
+KnowledgeResult = namedtuple("KnowledgeResult", ["answer", "snippets"])
+
+
+class Analyzer:
+    """Folding, stop words and suffix stemming for one language"""
+
+    def __init__(self, lang):
+        self.stop_words = set(tokenize(STOP_WORDS.get(lang, "")))
+        # Longest suffix first, folded like the text it is stripped from
+        self.suffixes = sorted((fold(s) for s in SUFFIXES.get(lang, ())), key=len, reverse=True)
+
+    def stem(self, word):
+        for suffix in self.suffixes:
+            if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM_LENGTH:
+                return word[:-len(suffix)]
+        return word
+
+    def stems(self, text):
+        return [self.stem(word) for word in tokenize(text)]
+
+    def analyze(self, text):
+        return [self.stem(word) for word in tokenize(text) if word not in self.stop_words]
+
+
+class BM25Index:
+    """Okapi BM25 over the documents of one language"""
+
+    def __init__(self, analyzer):
+        self.analyzer = analyzer
+        self.documents = []
+        self._postings = {}
+
+    def add(self, document, text):
+        terms = Counter(self.analyzer.analyze(text))
+        doc_id = len(self.documents)
+        self.documents.append(document._replace(length=sum(terms.values()), terms=frozenset(terms)))
+        for term, frequency in terms.items():
+            self._postings.setdefault(term, []).append((doc_id, frequency))
+
+    def search(self, terms, limit):
+        """Return up to `limit` (score, document) pairs, best first"""
+        if not self.documents:
+            return []
+        count = len(self.documents)
+        average_length = sum(doc.length for doc in self.documents) / count
+        scores = {}
+        for term in set(terms):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings:
+                length = self.documents[doc_id].length
+                norm = frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (BM25_K1 + 1) / norm
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [(score, self.documents[doc_id]) for doc_id, score in best]
+
+
+class KnowledgeIndex:
+    """Per-language BM25 indexes over the destination catalog"""
+
+    def __init__(self, destination_index):
+        self.destination_index = destination_index
+        self._indexes = {}
+        self._analyzers = {}
+        self._field_keywords = {}
+
+    def _analyzer(self, lang):
+        analyzer = self._analyzers.get(lang)
+        if analyzer is None:
+            analyzer = self._analyzers[lang] = Analyzer(lang)
+            self._field_keywords[lang] = {
+                field: [analyzer.stems(keyword) for keyword in keywords.get(lang, [])]
+                for field, keywords in FIELD_KEYWORDS.items()
+            }
+        return analyzer
+
+    def add(self, lang, destination_id, entry):
+        """Index the fields of one catalog entry"""
+        index = self._indexes.get(lang)
+        if index is None:
+            index = self._indexes[lang] = BM25Index(self._analyzer(lang))
+        for field in FIELDS:
+            value = entry.get(field)
+            if not value:
+                continue
+            if not isinstance(value, str):
+                value = ", ".join(value)
+            # Field keywords in the text let "when..." questions find the right field
+            keywords = " ".join(FIELD_KEYWORDS.get(field, {}).get(lang, []))
+            index.add(
+                Document(destination_id, field, entry["name"], value, 0, frozenset()),
+                f"{entry['name']} {value} {keywords}"
+            )
+
+    def lookup(self, message, lang):
+        """Answer a message from the catalog, or find snippets for the prompt"""
+        index = self._indexes.get(lang)
+        if index is None:
+            return KnowledgeResult(None, [])
+
+        terms = index.analyzer.analyze(message)
+        hits = [(score, doc) for score, doc in index.search(terms, KNOWLEDGE_MAX_SNIPPETS)
+                if score >= KNOWLEDGE_MIN_SCORE]
+        if not hits:
+            return KnowledgeResult(None, [])
+
+        answer = self._direct_answer(message, lang, hits) if KNOWLEDGE_DIRECT_ANSWERS else None
+        snippets = [f"{doc.name} — {FIELD_LABELS[doc.field]}: {doc.value}" for _, doc in hits]
+        return KnowledgeResult(answer, snippets)
+
+    def _direct_answer(self, message, lang, hits):
+        """Answer only short questions about exactly one destination and one field"""
+        if len(tokenize(message)) > KNOWLEDGE_MAX_QUESTION_WORDS:
+            return None
+
+        catalog_ids = {doc.destination_id for doc in self._indexes[lang].documents}
+        destinations = [d for d in self.destination_index.match(message) if d in catalog_ids]
+        if len(destinations) != 1:
+            return None
+
+        # Question words such as "when" are stop words for ranking but count here
+        present = set(self._indexes[lang].analyzer.stems(message))
+        fields = [
+            field for field, keywords in self._field_keywords[lang].items()
+            if any(keyword and all(word in present for word in keyword) for keyword in keywords)
+        ]
+        if len(fields) != 1 or lang not in DIRECT_ANSWERS[fields[0]]:
+            return None
+
+        # The best hit has to agree and clearly lead, which rules out near ties
+        score, top = hits[0]
+        if top.destination_id != destinations[0] or top.field != fields[0]:
+            return None
+        runner_up = hits[1][0] if len(hits) > 1 else 0.0
+        if score - runner_up < KNOWLEDGE_DIRECT_MARGIN:
+            return None
+
+        # Every content word has to be in the entry or in the reply, so that
+        # "weather in December" or "cheapest flights" go to the LLM instead
+        text = DIRECT_ANSWERS[top.field][lang].format(name=top.name, value=top.value)
+        analyzer = self._indexes[lang].analyzer
+        covered = top.terms | set(analyzer.analyze(text))
+        if any(term not in covered for term in analyzer.analyze(message)):
+            return None
+
+        return f"{text}\n\n{FOLLOW_UPS[lang]}"
+
+    @classmethod
+    def from_file(cls, destination_index, destinations_path="static/destinations.json"):
+        """Build the index from the destination catalog"""
+        index = cls(destination_index)
+        with open(destinations_path, 'r', encoding='utf-8') as f:
+            catalog = json.load(f)
+
+        # Entries are listed in the same order for every language and are
+        # named after the English city, as in DestinationIndex.from_files
+        english = catalog.get("en", [])
+        for lang, entries in catalog.items():
+            for position, entry in enumerate(entries):
+                if position < len(english):
+                    destination_id = slugify(english[position]["name"].split(",")[0])
+                    index.add(lang, destination_id, entry)
+        return index
@@ -0,0 +1,306 @@
+"""Background lead capture
+
+Captured contacts are written to a small SQLite queue on local disk and the
+request returns straight away. A background worker holds one authorized
+Google Sheets client, sends queued leads in batches with `append_rows`,
+retries failures with exponential backoff and, once a lead has used up its
+attempts, writes it to the `contact_leads.csv` fallback instead.
+
+A contact that is already waiting in the queue is not queued again.
+
+Every worker process runs its own sender on the same queue file. A sender
+claims a batch in one statement, pushing its next attempt LEAD_CLAIM_TIMEOUT
+seconds out, so no two senders get the same lead; if a sender dies, its
+claim runs out and the leads are sent by another.
+
+Set LEAD_SHEETS_BACKEND=memory to use `InMemorySheet` instead of Google, so
+the whole flow can be exercised offline, or LEAD_SHEETS_BACKEND=http with
+LEAD_SHEETS_URL to talk to a Sheets-API-compatible stand-in such as the one
+in benchmarks/fakes.py.
+"""
+import csv
+import io
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import urllib.request
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+LEAD_QUEUE_DB = os.getenv("LEAD_QUEUE_DB", "lead_queue.db")
+LEAD_SHEETS_BACKEND = os.getenv("LEAD_SHEETS_BACKEND", "google")
+LEAD_BATCH_SIZE = int(os.getenv("LEAD_BATCH_SIZE", 50))
+LEAD_POLL_INTERVAL = float(os.getenv("LEAD_POLL_INTERVAL", 2.0))
+LEAD_MAX_ATTEMPTS = int(os.getenv("LEAD_MAX_ATTEMPTS", 5))
+LEAD_RETRY_BASE_DELAY = float(os.getenv("LEAD_RETRY_BASE_DELAY", 5.0))
+LEAD_CLAIM_TIMEOUT = float(os.getenv("LEAD_CLAIM_TIMEOUT", 300))
+LEAD_FALLBACK_CSV = os.getenv("LEAD_FALLBACK_CSV", "contact_leads.csv")
+LEAD_SHEETS_URL = os.getenv("LEAD_SHEETS_URL", "http://127.0.0.1:9002")
+
+SHEET_URL = "https://docs.google.com/spreadsheets/d/1u0oWbOWXJaPwKfBXBrebc67s0PAz1tgCh7Og_Neaofk/edit?gid=0#gid=0"
+SHEET_COLUMNS = ["Name", "Contact", "Destination", "Interests", "Budget", "Language", "Timestamp"]
+
+
+def build_lead_row(contact_data):
+    """Build the spreadsheet row for a contact"""
+    return [
+        contact_data.get("name", "Not provided"),
+        contact_data.get("contact"),
+        contact_data.get("destination") or "Not specified",
+        ", ".join(contact_data.get("interests", [])) if isinstance(contact_data.get("interests"), list) else "Not specified",
+        contact_data.get("budget") or "Not specified",
+        contact_data.get("language") or "en",
+        datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    ]
+
+
+def open_google_sheet():
+    """Authorize with Google once and open the leads worksheet"""
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
+    creds_file = "google_credentials.json"
+    google_creds = os.getenv("GOOGLE_CREDENTIALS")
+
+    # Create credentials file from environment if it doesn't exist
+    if not os.path.exists(creds_file) and google_creds:
+        with open(creds_file, "w") as f:
+            f.write(google_creds)
+
+    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+    credentials = ServiceAccountCredentials.from_json_keyfile_name(creds_file, scope)
+    client = gspread.authorize(credentials)
+
+    return client.open_by_key(get_sheet_id()).sheet1
+
+
+def get_sheet_id():
+    """Get the spreadsheet ID from the sheet URL"""
+    return SHEET_URL.split("/d/")[1].split("/")[0]
+
+
+class InMemorySheet:
+    """Stand-in for a gspread worksheet that keeps rows in memory
+
+    `fail_times` makes the next N calls to `append_rows` raise, to exercise
+    the retry and fallback paths.
+    """
+
+    def __init__(self, fail_times=0):
+        self.rows = []
+        self.calls = 0
+        self.fail_times = fail_times
+
+    def append_rows(self, rows, value_input_option="RAW"):
+        self.calls += 1
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise ConnectionError("Simulated Google Sheets failure")
+        self.rows.extend(rows)
+
+
+class HTTPSheet:
+    """Worksheet that appends rows through the Sheets v4 values:append call
+
+    Points at LEAD_SHEETS_URL instead of Google, for load tests against a
+    local stand-in.
+    """
+
+    def __init__(self, base_url=LEAD_SHEETS_URL, sheet_id=None, timeout=10.0):
+        self.base_url = base_url.rstrip("/")
+        self.sheet_id = sheet_id or get_sheet_id()
+        self.timeout = timeout
+
+    def append_rows(self, rows, value_input_option="RAW"):
+        url = f"{self.base_url}/v4/spreadsheets/{self.sheet_id}/values/Sheet1!A1:append?valueInputOption={value_input_option}"
+        request = urllib.request.Request(
+            url,
+            data=json.dumps({"values": rows}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.load(response)
+
+
+SHEET_BACKENDS = {
+    "google": open_google_sheet,
+    "memory": InMemorySheet,
+    "http": HTTPSheet,
+}
+
+
+def write_rows_to_csv(rows, path=LEAD_FALLBACK_CSV):
+    """Append lead rows to the local CSV fallback file"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(rows)
+    with open(path, 'a', newline='') as f:
+        # One write per call, so rows appended by several worker processes do not interleave
+        header = ""
+        if f.tell() == 0:
+            header_buffer = io.StringIO()
+            csv.writer(header_buffer).writerow(SHEET_COLUMNS)
+            header = header_buffer.getvalue()
+        f.write(header + buffer.getvalue())
+
+
+class LeadQueue:
+    """Durable lead queue drained into Google Sheets by a background thread"""
+
+    def __init__(self, db_path=LEAD_QUEUE_DB, sheet_factory=None, batch_size=LEAD_BATCH_SIZE,
+                 poll_interval=LEAD_POLL_INTERVAL, max_attempts=LEAD_MAX_ATTEMPTS,
+                 retry_base_delay=LEAD_RETRY_BASE_DELAY, fallback_csv=LEAD_FALLBACK_CSV,
+                 claim_timeout=LEAD_CLAIM_TIMEOUT):
+        if sheet_factory is None:
+            sheet_factory = SHEET_BACKENDS.get(LEAD_SHEETS_BACKEND, open_google_sheet)
+        self.sheet_factory = sheet_factory
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.fallback_csv = fallback_csv
+        self.claim_timeout = claim_timeout
+
+        self._sheet = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._worker = None
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS leads (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                row TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.commit()
+
+    def put(self, contact_data):
+        """Queue a contact for saving; returns False if there is nothing to save or it is already queued"""
+        if not contact_data.get("contact"):
+            return False
+        row = build_lead_row(contact_data)
+        # One statement, so two processes queueing the same contact at once still add it once
+        with self._lock, self._conn:
+            queued = self._conn.execute(
+                """
+                INSERT INTO leads (row) SELECT ?
+                WHERE NOT EXISTS (SELECT 1 FROM leads WHERE json_extract(row, '$[1]') = ?)
+                """,
+                (json.dumps(row, ensure_ascii=False), row[1])
+            ).rowcount
+        if not queued:
+            return False
+        self._wakeup.set()
+        return True
+
+    def pending_count(self):
+        """Number of leads waiting to be sent"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM leads").fetchone()[0]
+
+    def start(self):
+        """Start the background worker"""
+        if self._worker is None or not self._worker.is_alive():
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run, name="lead-queue", daemon=True)
+            self._worker.start()
+
+    def stop(self, timeout=10.0):
+        """Stop the worker after one last attempt to drain the queue"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+        with self._lock:
+            self._conn.close()
+
+    def drain(self):
+        """Send every lead that is due, batch by batch; returns the number handled"""
+        handled = 0
+        while True:
+            batch = self._due_batch()
+            if not batch:
+                return handled
+            self._send(batch)
+            handled += len(batch)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.drain()
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+        self.drain()
+
+    def _due_batch(self):
+        # Claimed by a single UPDATE, which other processes cannot interleave with
+        now = time.time()
+        with self._lock, self._conn:
+            batch = self._conn.execute(
+                """
+                UPDATE leads SET next_attempt_at = ?
+                WHERE id IN (SELECT id FROM leads WHERE next_attempt_at <= ? ORDER BY id LIMIT ?)
+                RETURNING id, row, attempts
+                """,
+                (now + self.claim_timeout, now, self.batch_size)
+            ).fetchall()
+        return sorted(batch)
+
+    def _get_sheet(self):
+        # Authorize once and reuse the client for every batch
+        if self._sheet is None:
+            self._sheet = self.sheet_factory()
+        return self._sheet
+
+    def _send(self, batch):
+        rows = [json.loads(row) for _, row, _ in batch]
+        try:
+            self._get_sheet().append_rows(rows, value_input_option="RAW")
+        except Exception as e:
+            logger.warning("Error saving %d leads to Google Sheet: %s", len(rows), e)
+            # Re-authorize on the next attempt in case the session expired
+            self._sheet = None
+            self._retry_or_fall_back(batch)
+            return
+
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM leads WHERE id = ?", [(lead_id,) for lead_id, _, _ in batch])
+
+    def _retry_or_fall_back(self, batch):
+        retry = []
+        give_up = []
+        for lead_id, row, attempts in batch:
+            if attempts + 1 >= self.max_attempts:
+                give_up.append((lead_id, json.loads(row)))
+            else:
+                # Exponential backoff with jitter
+                delay = self.retry_base_delay * (2 ** attempts) * random.uniform(0.5, 1.5)
+                retry.append((attempts + 1, time.time() + delay, lead_id))
+
+        if give_up:
+            try:
+                write_rows_to_csv([row for _, row in give_up], self.fallback_csv)
+                logger.info("Saved %d leads to local CSV file: %s", len(give_up), self.fallback_csv)
+            except Exception as csv_err:
+                logger.error("Error saving to CSV: %s", csv_err)
+                # Keep them queued rather than losing them
+                retry.extend((self.max_attempts, time.time() + self.retry_base_delay, lead_id) for lead_id, _ in give_up)
+                give_up = []
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE leads SET attempts = ?, next_attempt_at = ? WHERE id = ?", retry
+            )
+            self._conn.executemany(
+                "DELETE FROM leads WHERE id = ?", [(lead_id,) for lead_id, _ in give_up]
+            )
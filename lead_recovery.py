@@ -0,0 +1,449 @@
+"""Offline lead recovery and conversation analytics
+
+Usage:
+    python lead_recovery.py [--db conversations.db] [--archive-dir archives] [--legacy-dir conversations]
+                            [--out recovery] [--format csv|parquet] [--workers 8]
+                            [--existing sheet_export.csv ...] [--enqueue] [--restart]
+
+Reruns the contact, destination and profile extractors over the user turns
+of every stored conversation: the SQLite store, the retention archives and
+any legacy conversations/*.json files. Contacts that are not already a known
+lead (in contact_leads.csv, the lead queue, or the --existing exports of the
+sheet) are written to recovered_leads.csv, and with --enqueue are also
+queued for the Google Sheet. Sessions, user turns, contacts and recovered
+leads are counted per language and per destination and written as CSV, or
+as Parquet when pyarrow is installed.
+
+A session found in more than one source, such as a conversation migrated
+without --remove or archived twice, is counted once: from the database if
+it is there, else from its newest archive copy, else from its legacy file.
+
+The work is split into units (a range of session IDs in the database, an
+archive part, or a hash shard of the legacy files) that a process pool
+works through, so memory use depends on the unit size and not on the number
+of sessions. The plan and every finished unit are recorded in a checkpoint
+in the output directory; running again resumes where an interrupted run
+stopped. Use --restart to start over.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+import zlib
+from collections import Counter
+
+from contact_extractor import extract_contact
+from destination_matcher import DestinationIndex
+from lead_queue import LEAD_FALLBACK_CSV, LEAD_QUEUE_DB, SHEET_COLUMNS, LeadQueue, build_lead_row
+from migrate_conversations import load_conversation_file
+from retention import open_part
+from session_profile import extract_profile_delta, merge_profile
+
+# Counted per (language, destination)
+AGGREGATE_FIELDS = ("sessions", "user_turns", "sessions_with_contact", "recovered_leads")
+LEAD_COLUMNS = SHEET_COLUMNS + ["Session"]
+
+UKRAINIAN_LETTERS = set("іїєґ")
+ROMANIAN_LETTERS = set("ăâîșşțţ")
+GERMAN_LETTERS = set("äöüß")
+GERMAN_WORDS = {"ich", "und", "nicht", "wir", "möchte", "nach", "reise", "urlaub", "der", "die", "das"}
+ROMANIAN_WORDS = {"și", "si", "vreau", "să", "sa", "pentru", "călătorie", "vacanță", "unde", "este"}
+
+# Session IDs looked up per query when checking other sources
+LOOKUP_CHUNK = 500
+
+# Set in each worker process by _init_worker
+_destination_index = None
+
+
+def guess_language(text):
+    """Guess the chat language of a conversation from its user turns"""
+    letters = set(text.lower())
+    if letters & set("абвгдежзийклмнопрстуфхцчшщьюяыэъё"):
+        return "uk" if letters & UKRAINIAN_LETTERS else "ru"
+    if letters & ROMANIAN_LETTERS:
+        return "ro"
+    words = set(text.lower().split())
+    if letters & GERMAN_LETTERS or len(words & GERMAN_WORDS) >= 2:
+        return "de"
+    if len(words & ROMANIAN_WORDS) >= 2:
+        return "ro"
+    return "en"
+
+
+def normalize_contact(value):
+    """Normalize a contact from any source so that duplicates compare equal"""
+    value = (value or "").strip()
+    match = extract_contact(value)
+    return match.value if match else value.lower()
+
+
+def analyze_session(session_id, messages):
+    """Rerun the extractors over a session's user turns
+
+    Returns (language, destination, user turns, leads), where each lead is a
+    contact_data dict as given to LeadQueue.put.
+    """
+    user_turns = [msg["content"] for msg in messages if msg.get("role") == "user" and msg.get("content")]
+    lang = guess_language(" ".join(user_turns))
+    profile = {}
+    contacts = {}
+    for text in user_turns:
+        destinations = _destination_index.match(text)
+        destination = _destination_index.display_name(destinations[0]) if destinations else None
+        contact = extract_contact(text, lang)
+        profile = merge_profile(profile, extract_profile_delta(text, destination, contact))
+        if contact:
+            contacts.setdefault(contact.value, contact.kind)
+
+    leads = [
+        {
+            "name": profile.get("name", "Not provided"),
+            "contact": value,
+            "destination": profile.get("destination"),
+            "interests": profile.get("interests", []),
+            "budget": profile.get("budget"),
+            "language": lang,
+            "session_id": session_id
+        }
+        for value in contacts
+    ]
+    return lang, profile.get("destination") or "unknown", len(user_turns), leads
+
+
+def iter_unit_sessions(unit):
+    """Yield (session_id, messages) for every session in a unit"""
+    kind = unit["kind"]
+    if kind == "db":
+        conn = sqlite3.connect(f"file:{unit['path']}?mode=ro", uri=True)
+        try:
+            rows = conn.execute(
+                "SELECT session_id, role, content FROM messages WHERE session_id > ? AND session_id <= ? "
+                "ORDER BY session_id, id",
+                (unit["after"], unit["upto"])
+            )
+            session_id, messages = None, []
+            for row_session, role, content in rows:
+                if row_session != session_id:
+                    if messages:
+                        yield session_id, messages
+                    session_id, messages = row_session, []
+                messages.append({"role": role, "content": content})
+            if messages:
+                yield session_id, messages
+        finally:
+            conn.close()
+    elif kind == "archive":
+        with open_part(unit["path"]) as f:
+            records = [(number, json.loads(line)) for number, line in enumerate(f)]
+        newest = archived_copies(unit.get("index"), [record["session_id"] for _, record in records])
+        in_db = sessions_in_db(unit.get("db"), [record["session_id"] for _, record in records])
+        for number, record in records:
+            session_id = record["session_id"]
+            # Counted from the database, or from the copy the archive index points at
+            if session_id in in_db or newest.get(session_id, (unit["part"], number)) != (unit["part"], number):
+                continue
+            yield session_id, record["messages"]
+    elif kind == "legacy":
+        for name in unit["files"]:
+            history = load_conversation_file(os.path.join(unit["path"], name))
+            if history is not None:
+                yield name[:-len(".json")], history
+
+
+def shard_of(name, shards):
+    return zlib.crc32(name.encode("utf-8")) % shards
+
+
+def _lookup(path, query, session_ids):
+    """Run `query` for chunks of session IDs in a read-only database, returning the rows"""
+    rows = []
+    if not path or not os.path.exists(path) or not session_ids:
+        return rows
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        for start in range(0, len(session_ids), LOOKUP_CHUNK):
+            chunk = session_ids[start:start + LOOKUP_CHUNK]
+            rows.extend(conn.execute(query.format(",".join("?" * len(chunk))), chunk))
+    except sqlite3.OperationalError:
+        # No such table yet
+        pass
+    finally:
+        conn.close()
+    return rows
+
+
+def sessions_in_db(db_path, session_ids):
+    """The given session IDs that have messages in the conversation database"""
+    return {row[0] for row in _lookup(db_path, "SELECT DISTINCT session_id FROM messages WHERE session_id IN ({})",
+                                      session_ids)}
+
+
+def archived_copies(index_path, session_ids):
+    """Map the given session IDs to the (part, line) of their newest archive copy"""
+    return {
+        session_id: (path, line)
+        for session_id, path, line in _lookup(
+            index_path, "SELECT session_id, path, line FROM archived_sessions WHERE session_id IN ({})", session_ids
+        )
+    }
+
+
+def process_unit(unit):
+    """Analyze every session of a unit; runs in a worker process"""
+    aggregates = Counter()
+    leads = []
+    for session_id, messages in iter_unit_sessions(unit):
+        lang, destination, user_turns, session_leads = analyze_session(session_id, messages)
+        aggregates[(lang, destination, "sessions")] += 1
+        aggregates[(lang, destination, "user_turns")] += user_turns
+        if session_leads:
+            aggregates[(lang, destination, "sessions_with_contact")] += 1
+        leads.extend(session_leads)
+    return unit["id"], aggregates, leads
+
+
+def _init_worker():
+    global _destination_index
+    _destination_index = DestinationIndex.from_files()
+
+
+def plan_units(db_path, archive_dir, legacy_dir, batch_size, shards):
+    """List the units of work, reading only session IDs and file names"""
+    units = []
+    if db_path and os.path.exists(db_path):
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            # Every batch_size-th session ID closes a range
+            after, count = "", 0
+            for (session_id,) in conn.execute("SELECT DISTINCT session_id FROM messages ORDER BY session_id"):
+                count += 1
+                if count == batch_size:
+                    units.append({"id": f"db:{after}", "kind": "db", "path": db_path, "after": after, "upto": session_id})
+                    after, count = session_id, 0
+            if count:
+                # The last range is open, so sessions added later are not missed on resume
+                units.append({"id": f"db:{after}", "kind": "db", "path": db_path, "after": after, "upto": "\U0010ffff"})
+        finally:
+            conn.close()
+
+    if archive_dir and os.path.isdir(archive_dir):
+        for root, _, files in os.walk(archive_dir):
+            for name in sorted(files):
+                if name.startswith("part-") and name.endswith((".jsonl.gz", ".jsonl.zst")):
+                    path = os.path.join(root, name)
+                    part = os.path.relpath(path, archive_dir)
+                    units.append({"id": f"archive:{part}", "kind": "archive", "path": path, "part": part,
+                                  "index": os.path.join(archive_dir, "index.db"), "db": db_path})
+
+    if legacy_dir and os.path.isdir(legacy_dir):
+        # The directory is listed once here rather than by every shard
+        with os.scandir(legacy_dir) as entries:
+            names = sorted(entry.name for entry in entries if entry.name.endswith(".json"))
+        session_ids = [name[:-len(".json")] for name in names]
+        elsewhere = sessions_in_db(db_path, session_ids)
+        if archive_dir:
+            elsewhere.update(archived_copies(os.path.join(archive_dir, "index.db"), session_ids))
+        files = {}
+        for name, session_id in zip(names, session_ids):
+            if session_id not in elsewhere:
+                files.setdefault(shard_of(name, shards), []).append(name)
+        for shard, shard_files in sorted(files.items()):
+            units.append({"id": f"legacy:{shard}", "kind": "legacy", "path": legacy_dir, "files": shard_files})
+    return units
+
+
+def load_known_contacts(paths, queue_db):
+    """Contacts that are already leads: CSV files with a Contact column and the lead queue"""
+    known = set()
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            # Every file starts with a header, the fallback CSV too; without a
+            # Contact column the contact is in the second column, as in SHEET_COLUMNS
+            column = header.index("Contact") if "Contact" in header else 1
+            for row in reader:
+                if len(row) > column:
+                    known.add(normalize_contact(row[column]))
+
+    if queue_db and os.path.exists(queue_db):
+        conn = sqlite3.connect(f"file:{queue_db}?mode=ro", uri=True)
+        try:
+            for (row,) in conn.execute("SELECT row FROM leads"):
+                known.add(normalize_contact(json.loads(row)[1]))
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            conn.close()
+    known.discard("")
+    return known
+
+
+class Checkpoint:
+    """The plan, finished units and running totals of a recovery run"""
+
+    def __init__(self, path):
+        self.path = path
+        self.units = None
+        self.done = set()
+        self.aggregates = Counter()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        self.units = state["units"]
+        self.done = set(state["done"])
+        self.aggregates = Counter({tuple(key.split("\t")): value for key, value in state["aggregates"].items()})
+        return True
+
+    def save(self):
+        state = {
+            "units": self.units,
+            "done": sorted(self.done),
+            "aggregates": {"\t".join(key): value for key, value in self.aggregates.items()}
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def write_table(path, columns, rows, output_format):
+    """Write rows as CSV, or as Parquet with pyarrow"""
+    if output_format == "parquet":
+        import pyarrow
+        import pyarrow.parquet
+
+        table = pyarrow.table({column: [row[i] for row in rows] for i, column in enumerate(columns)})
+        pyarrow.parquet.write_table(table, path + ".parquet")
+        return path + ".parquet"
+    with open(path + ".csv", 'w', newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(rows)
+    return path + ".csv"
+
+
+def write_aggregates(out_dir, aggregates, output_format):
+    """Write the per-language and per-destination tables"""
+    by_language = {}
+    by_destination = {}
+    for (lang, destination, field), value in aggregates.items():
+        by_language.setdefault(lang, Counter())[field] += value
+        by_destination.setdefault(destination, Counter())[field] += value
+
+    paths = []
+    for name, key_column, groups in (("by_language", "language", by_language),
+                                     ("by_destination", "destination", by_destination)):
+        rows = [
+            [key] + [counts[field] for field in AGGREGATE_FIELDS]
+            for key, counts in sorted(groups.items(), key=lambda item: -item[1]["sessions"])
+        ]
+        paths.append(write_table(os.path.join(out_dir, name), [key_column, *AGGREGATE_FIELDS], rows, output_format))
+    return paths
+
+
+def recover(db_path, archive_dir, legacy_dir, out_dir, existing=(), output_format="csv", workers=None,
+            batch_size=500, shards=64, enqueue=False, restart=False, checkpoint_every=20):
+    """Run the pipeline, returning the totals of this run and the paths of the tables"""
+    if output_format == "parquet":
+        # Fail before hours of work rather than after
+        import pyarrow  # noqa: F401
+
+    os.makedirs(out_dir, exist_ok=True)
+    leads_path = os.path.join(out_dir, "recovered_leads.csv")
+    checkpoint = Checkpoint(os.path.join(out_dir, "checkpoint.json"))
+    if restart:
+        for path in (checkpoint.path, leads_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    if checkpoint.load():
+        print(f"Resuming: {len(checkpoint.done)} of {len(checkpoint.units)} units already done")
+    else:
+        checkpoint.units = plan_units(db_path, archive_dir, legacy_dir, batch_size, shards)
+        checkpoint.save()
+
+    # Leads written by an earlier run count as known, so a resumed unit adds no duplicates
+    known = load_known_contacts([LEAD_FALLBACK_CSV, leads_path, *existing], LEAD_QUEUE_DB)
+    queue = LeadQueue(LEAD_QUEUE_DB) if enqueue else None
+
+    pending = [unit for unit in checkpoint.units if unit["id"] not in checkpoint.done]
+    new_file = not os.path.exists(leads_path)
+    totals = Counter()
+    start = time.perf_counter()
+    with open(leads_path, 'a', newline="", encoding="utf-8") as leads_file, \
+            multiprocessing.Pool(workers, initializer=_init_worker) as pool:
+        writer = csv.writer(leads_file)
+        if new_file:
+            writer.writerow(LEAD_COLUMNS)
+        for finished, (unit_id, aggregates, leads) in enumerate(pool.imap_unordered(process_unit, pending), 1):
+            for lead in leads:
+                contact = normalize_contact(lead["contact"])
+                if contact in known:
+                    totals["duplicate_leads"] += 1
+                    continue
+                known.add(contact)
+                writer.writerow(build_lead_row(lead) + [lead["session_id"]])
+                aggregates[(lead["language"], lead["destination"] or "unknown", "recovered_leads")] += 1
+                totals["recovered_leads"] += 1
+                if queue:
+                    queue.put(lead)
+
+            checkpoint.aggregates.update(aggregates)
+            checkpoint.done.add(unit_id)
+            if finished % checkpoint_every == 0 or finished == len(pending):
+                # Leads go to disk before the unit is recorded as done
+                leads_file.flush()
+                os.fsync(leads_file.fileno())
+                checkpoint.save()
+                sessions = sum(v for k, v in checkpoint.aggregates.items() if k[2] == "sessions")
+                print(f"{len(checkpoint.done)}/{len(checkpoint.units)} units, {sessions} sessions, "
+                      f"{time.perf_counter() - start:.0f}s")
+
+    if queue:
+        queue.stop()
+    return {
+        "sessions": sum(v for k, v in checkpoint.aggregates.items() if k[2] == "sessions"),
+        "recovered_leads": totals["recovered_leads"],
+        "duplicate_leads": totals["duplicate_leads"],
+        "tables": write_aggregates(out_dir, checkpoint.aggregates, output_format)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recover missed leads and aggregate stored conversations")
+    parser.add_argument("--db", default=os.getenv("CONVERSATION_DB", "conversations.db"), help="SQLite database path")
+    parser.add_argument("--archive-dir", default=os.getenv("ARCHIVE_DIR", "archives"), help="Retention archives")
+    parser.add_argument("--legacy-dir", default="conversations", help="Directory with <session_id>.json files")
+    parser.add_argument("--out", default="recovery", help="Directory for results and the checkpoint")
+    parser.add_argument("--format", choices=("csv", "parquet"), default="csv", help="Format of the aggregate tables")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+    parser.add_argument("--batch-size", type=int, default=500, help="Database sessions per unit")
+    parser.add_argument("--shards", type=int, default=64, help="Units the legacy directory is split into")
+    parser.add_argument("--existing", action="append", default=[], help="CSV export of known leads (repeatable)")
+    parser.add_argument("--enqueue", action="store_true", help="Queue recovered leads for the Google Sheet")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start over")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    totals = recover(
+        args.db, args.archive_dir, args.legacy_dir, args.out, args.existing, args.format, args.workers,
+        args.batch_size, args.shards, args.enqueue, args.restart
+    )
+    print(f"Done in {time.perf_counter() - start:.1f}s: {totals['sessions']} sessions, "
+          f"{totals['recovered_leads']} leads recovered, {totals['duplicate_leads']} already known")
+    for path in totals["tables"]:
+        print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""Async OpenAI client used by the chat endpoints
+
+All chat completions go through this module so that request handlers never
+block the event loop. A single aiohttp session is shared between calls
+(connection pooling), and the number of calls in flight at once is capped
+by a semaphore.
+
+Every call also runs against a deadline:
+
+* each attempt has its own timeout, and failed attempts are retried with
+  jittered exponential backoff while the deadline allows;
+* with LLM_HEDGE enabled, a second identical request is sent when the first
+  one is slower than the recent p95, and whichever answers first wins;
+* a circuit breaker per model stops calling a provider that keeps failing
+  and lets a single probe through once LLM_BREAKER_RESET seconds have passed;
+* LLM_FALLBACK_MODEL, if set, is tried when the main model is unavailable.
+
+When nothing works `LLMUnavailable` is raised, so the caller can answer with
+a canned message instead.
+
+openai and aiohttp are slow to import, so they are only imported by `load`,
+on the first call or during the app's warm-up.
+"""
+import asyncio
+import os
+import random
+import time
+from collections import deque
+
+from observability import Counter, Gauge
+
+# Model and limits can be tuned per deployment through the environment
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 30))
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", 45))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", 0.5))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "false").lower() in ("1", "true", "yes")
+# Observed calls needed before the p95 is trusted for hedging
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 50))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", 5))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", 30))
+# Longest gap allowed between two chunks of a streamed reply
+LLM_STREAM_IDLE_TIMEOUT = float(os.getenv("LLM_STREAM_IDLE_TIMEOUT", 15))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 50))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", 100))
+
+# Set by load()
+aiohttp = None
+openai = None
+# Failures that say nothing about the request itself and are worth retrying
+RETRYABLE_ERRORS = (asyncio.TimeoutError,)
+
+LLM_ATTEMPTS = Counter("llm_attempts_total", "LLM requests sent, by outcome", ["model", "outcome"])
+LLM_HEDGES = Counter("llm_hedged_requests_total", "Hedged LLM requests sent", ["model"])
+LLM_BREAKER_OPEN = Gauge("llm_circuit_open", "1 while the circuit breaker for a model is open", ["model"])
+
+_session = None
+_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+
+class LLMUnavailable(Exception):
+    """No model could answer within the deadline"""
+
+
+class CircuitBreaker:
+    """Fails fast after repeated failures, then lets one probe through"""
+
+    def __init__(self, model, failure_threshold=LLM_BREAKER_FAILURES, reset_timeout=LLM_BREAKER_RESET):
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return False
+        # Half open: let one request through and hold the rest for another period
+        self.opened_at = time.monotonic()
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        LLM_BREAKER_OPEN.set(0, model=self.model)
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            LLM_BREAKER_OPEN.set(1, model=self.model)
+
+
+class LatencyTracker:
+    """Recent call latencies, for the hedging threshold"""
+
+    def __init__(self, size=500):
+        self._samples = deque(maxlen=size)
+
+    def observe(self, seconds):
+        self._samples.append(seconds)
+
+    def p95(self):
+        if len(self._samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+
+_breakers = {}
+_latency = LatencyTracker()
+
+
+def load():
+    """Import the HTTP and OpenAI clients if that has not happened yet"""
+    global aiohttp, openai, RETRYABLE_ERRORS
+    if openai is not None:
+        return
+    import aiohttp as aiohttp_module
+    import openai as openai_module
+
+    openai_module.api_key = os.getenv("OPENAI_API_KEY")
+    RETRYABLE_ERRORS = (
+        asyncio.TimeoutError,
+        aiohttp_module.ClientError,
+        openai_module.error.Timeout,
+        openai_module.error.APIConnectionError,
+        openai_module.error.APIError,
+        openai_module.error.RateLimitError,
+        openai_module.error.ServiceUnavailableError,
+        openai_module.error.TryAgain,
+    )
+    aiohttp, openai = aiohttp_module, openai_module
+
+
+def _get_breaker(model):
+    breaker = _breakers.get(model)
+    if breaker is None:
+        breaker = _breakers[model] = CircuitBreaker(model)
+    return breaker
+
+
+def _get_session():
+    """Return the shared aiohttp session, creating it on first use"""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=LLM_POOL_SIZE, ttl_dns_cache=300)
+        _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+
+async def close():
+    """Close the shared HTTP session (called on application shutdown)"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def _models(model):
+    model = model or LLM_MODEL
+    if LLM_FALLBACK_MODEL and LLM_FALLBACK_MODEL != model:
+        return [model, LLM_FALLBACK_MODEL]
+    return [model]
+
+
+def _backoff(attempt):
+    return LLM_RETRY_BASE_DELAY * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+async def _request(model, messages, temperature, max_tokens, timeout):
+    """Send one completion request and return the reply text"""
+    async with _semaphore:
+        start = time.monotonic()
+        response = await asyncio.wait_for(
+            openai.ChatCompletion.acreate(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                request_timeout=timeout
+            ),
+            timeout
+        )
+        _latency.observe(time.monotonic() - start)
+    return response.choices[0].message["content"]
+
+
+async def _hedged_request(model, messages, temperature, max_tokens, timeout):
+    """Send a request, and a second one if the first is slower than the recent p95"""
+    hedge_after = _latency.p95() if LLM_HEDGE else None
+    if hedge_after is None or hedge_after >= timeout:
+        return await _request(model, messages, temperature, max_tokens, timeout)
+
+    tasks = [asyncio.create_task(_request(model, messages, temperature, max_tokens, timeout))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        if not done:
+            LLM_HEDGES.inc(model=model)
+            tasks.append(asyncio.create_task(
+                _request(model, messages, temperature, max_tokens, timeout - hedge_after)
+            ))
+
+        # First successful answer wins; fail only if every request failed
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def create_chat_completion(messages, model=None, temperature=0.7, max_tokens=800, timeout=None, deadline=None):
+    """Run a chat completion without blocking the event loop and return the reply text"""
+    load()
+    timeout = timeout or LLM_TIMEOUT
+    deadline_at = time.monotonic() + (deadline or LLM_DEADLINE)
+
+    # openai keeps the aiohttp session in a context variable, so it has to be
+    # set in the context of the calling task
+    openai.aiosession.set(_get_session())
+
+    last_error = None
+    for model_name in _models(model):
+        breaker = _get_breaker(model_name)
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0 or not breaker.allow():
+                break
+            try:
+                reply = await _hedged_request(model_name, messages, temperature, max_tokens, min(timeout, remaining))
+            except RETRYABLE_ERRORS as e:
+                LLM_ATTEMPTS.inc(model=model_name, outcome="error")
+                breaker.record_failure()
+                last_error = e
+            else:
+                LLM_ATTEMPTS.inc(model=model_name, outcome="ok")
+                breaker.record_success()
+                return reply
+
+            delay = _backoff(attempt)
+            if attempt == LLM_MAX_RETRIES or time.monotonic() + delay >= deadline_at:
+                break
+            await asyncio.sleep(delay)
+
+    raise LLMUnavailable(f"No model answered: {type(last_error).__name__ if last_error else 'circuit open'}") from last_error
+
+
+async def stream_chat_completion(messages, model=None, temperature=0.7, max_tokens=800, timeout=None, deadline=None):
+    """Stream a chat completion, yielding pieces of the reply text as they arrive
+
+    Failures before the first chunk are retried like create_chat_completion,
+    without hedging. Once text has been yielded a failure cannot be retried
+    and raises LLMUnavailable.
+    """
+    load()
+    timeout = timeout or LLM_TIMEOUT
+    deadline_at = time.monotonic() + (deadline or LLM_DEADLINE)
+    openai.aiosession.set(_get_session())
+
+    last_error = None
+    for model_name in _models(model):
+        breaker = _get_breaker(model_name)
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0 or not breaker.allow():
+                break
+            started = False
+            try:
+                async with _semaphore:
+                    # The timeout covers the wait for the first chunk; after that
+                    # only the gap between chunks is bounded
+                    response = await asyncio.wait_for(
+                        openai.ChatCompletion.acreate(
+                            model=model_name,
+                            messages=messages,
+                            temperature=temperature,
+                            max_tokens=max_tokens,
+                            request_timeout=min(timeout, remaining),
+                            stream=True
+                        ),
+                        min(timeout, remaining)
+                    )
+                    chunks = response.__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), LLM_STREAM_IDLE_TIMEOUT)
+                        except StopAsyncIteration:
+                            break
+                        text = chunk.choices[0].delta.get("content")
+                        if text:
+                            started = True
+                            yield text
+            except RETRYABLE_ERRORS as e:
+                LLM_ATTEMPTS.inc(model=model_name, outcome="error")
+                breaker.record_failure()
+                last_error = e
+                if started:
+                    raise LLMUnavailable(f"Stream interrupted: {type(e).__name__}") from e
+            else:
+                LLM_ATTEMPTS.inc(model=model_name, outcome="ok")
+                breaker.record_success()
+                return
+
+            delay = _backoff(attempt)
+            if attempt == LLM_MAX_RETRIES or time.monotonic() + delay >= deadline_at:
+                break
+            await asyncio.sleep(delay)
+
+    raise LLMUnavailable(f"No model answered: {type(last_error).__name__ if last_error else 'circuit open'}") from last_error
@@ -0,0 +1,101 @@
+"""Migrate per-session JSON conversation files into the SQLite conversation store
+
+Usage:
+    python migrate_conversations.py [--source conversations] [--db conversations.db]
+                                    [--batch-size 500] [--remove]
+
+The directory is streamed with os.scandir, so memory use does not depend on
+the number of files. Sessions already present in the database are skipped,
+which makes the migration safe to re-run after an interruption.
+"""
+import argparse
+import json
+import logging
+import os
+
+from conversation_store import SQLiteConversationStore
+
+logger = logging.getLogger(__name__)
+
+
+def iter_conversation_files(source):
+    """Yield (session_id, path) for every JSON conversation file"""
+    with os.scandir(source) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(".json"):
+                yield entry.name[:-len(".json")], entry.path
+
+
+def load_conversation_file(path):
+    """Load the messages from a conversation file, or None if it is unreadable"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            history = json.load(f)
+    except Exception as e:
+        logger.warning("Skipping unreadable file %s: %s", path, e)
+        return None
+    return [
+        {"role": msg["role"], "content": msg["content"]}
+        for msg in history
+        if isinstance(msg, dict) and "role" in msg and "content" in msg
+    ]
+
+
+def migrate(source, db_path, batch_size=500, remove=False):
+    """Copy every conversation file into the database, returning migration counts"""
+    store = SQLiteConversationStore(db_path)
+    counts = {"migrated": 0, "skipped": 0, "failed": 0}
+    batch = []
+    batch_paths = []
+
+    def write_batch():
+        store.append_many(batch)
+        if remove:
+            for path in batch_paths:
+                os.remove(path)
+        batch.clear()
+        batch_paths.clear()
+
+    try:
+        for session_id, path in iter_conversation_files(source):
+            if store.has_session(session_id):
+                # Left behind by an interrupted run that had already written it
+                if remove:
+                    os.remove(path)
+                counts["skipped"] += 1
+                continue
+
+            history = load_conversation_file(path)
+            if history is None:
+                counts["failed"] += 1
+                continue
+
+            batch.append((session_id, history))
+            batch_paths.append(path)
+            counts["migrated"] += 1
+
+            if len(batch) >= batch_size:
+                write_batch()
+                print(f"Migrated {counts['migrated']} sessions...")
+
+        write_batch()
+    finally:
+        store.close()
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate JSON conversation files into SQLite")
+    parser.add_argument("--source", default="conversations", help="Directory with <session_id>.json files")
+    parser.add_argument("--db", default=os.getenv("CONVERSATION_DB", "conversations.db"), help="SQLite database path")
+    parser.add_argument("--batch-size", type=int, default=500, help="Sessions written per transaction")
+    parser.add_argument("--remove", action="store_true", help="Delete JSON files once they are migrated")
+    args = parser.parse_args()
+
+    counts = migrate(args.source, args.db, args.batch_size, args.remove)
+    print(f"Done: {counts['migrated']} migrated, {counts['skipped']} already present, {counts['failed']} unreadable")
+
+
+if __name__ == "__main__":
+    main()
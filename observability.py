@@ -0,0 +1,348 @@
+"""Structured logging, timing spans and Prometheus metrics
+
+Log records are handed to a queue and written by a background listener
+thread, so logging never blocks the event loop on stdout. Records are
+formatted as one JSON object per line, and records below WARNING can be
+sampled with LOG_SAMPLE_RATE.
+
+Metrics are kept in process and rendered in the Prometheus text format by
+the /metrics endpoint. `span()` times a stage of request handling into the
+stage latency histogram.
+
+With several workers, `SharedMetrics` has each worker publish a snapshot of
+its metrics to the shared state backend, and /metrics on any worker renders
+the sum over all of them.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from state_backend import StateError
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 1.0))
+METRICS_PUBLISH_INTERVAL = float(os.getenv("METRICS_PUBLISH_INTERVAL", 5.0))
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+
+
+class JSONFormatter(logging.Formatter):
+    """Format log records as single-line JSON objects"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep every warning and error, and a sample of lower-level records"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+def setup_logging(level=LOG_LEVEL, sample_rate=LOG_SAMPLE_RATE):
+    """Route all logging through a queue to a JSON stream handler"""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JSONFormatter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Flush queued log records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + list(extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metric:
+    """Base class for metrics with a fixed set of label names"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def items(self):
+        with self._lock:
+            # Histogram states are copied, as they change in place
+            return [
+                (key, dict(value, counts=list(value["counts"])) if isinstance(value, dict) else value)
+                for key, value in self._values.items()
+            ]
+
+    def render(self, values=None):
+        """Render this metric's values, or the given {label values: value} instead"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        if values is None:
+            values = dict(self.items())
+        for key, value in sorted(values.items()):
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that can go up and down"""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def _render_value(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state["counts"]):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, [("le", bound)])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+        lines.append(f"{self.name}_bucket{labels} {state['count']}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state['sum']}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state['count']}")
+        return lines
+
+
+REGISTRY = []
+
+
+def snapshot():
+    """Values of every registered metric as JSON-serializable data"""
+    return {metric.name: [[list(key), value] for key, value in metric.items()] for metric in REGISTRY}
+
+
+def _add_values(a, b):
+    if isinstance(a, dict):
+        return {
+            "counts": [x + y for x, y in zip(a["counts"], b["counts"])],
+            "sum": a["sum"] + b["sum"],
+            "count": a["count"] + b["count"]
+        }
+    return a + b
+
+
+def merge_snapshots(snapshots):
+    """Sum snapshots of several workers into {metric name: {label values: value}}"""
+    merged = {}
+    for metrics in snapshots:
+        for name, entries in metrics.items():
+            values = merged.setdefault(name, {})
+            for key, value in entries:
+                key = tuple(key)
+                values[key] = _add_values(values[key], value) if key in values else value
+    return merged
+
+
+def render_metrics(snapshots=None):
+    """Render every registered metric in the Prometheus text format, summed over `snapshots` if given"""
+    merged = merge_snapshots(snapshots) if snapshots is not None else None
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(None if merged is None else merged.get(metric.name, {})))
+    return "\n".join(lines) + "\n"
+
+
+class SharedMetrics:
+    """Publishes this worker's metrics to a state backend and renders those of all workers
+
+    Gauges are summed like counters, which suits the in-flight and queue
+    gauges. A worker that has not published for three intervals is dropped,
+    so a restarted worker looks like a counter reset to Prometheus.
+    """
+
+    def __init__(self, state, interval=METRICS_PUBLISH_INTERVAL):
+        self.state = state
+        self.interval = interval
+        self.worker = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        # Named after the process that publishes, which is not the one that imported this module under a forking server
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="metrics-publisher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval)
+        try:
+            self.state.hdel("metrics", self.worker)
+        except StateError as e:
+            logger.warning("Error removing published metrics: %s", e)
+
+    def publish(self):
+        self.state.hset("metrics", self.worker, json.dumps({"at": time.time(), "metrics": snapshot()}))
+
+    def render(self):
+        """Render the metrics of every live worker, or of this one if the state backend is down"""
+        try:
+            self.publish()
+            published = self.state.hgetall("metrics")
+        except StateError as e:
+            logger.warning("Rendering this worker's metrics only: %s", e)
+            return render_metrics()
+
+        oldest = time.time() - 3 * self.interval
+        snapshots, stale = [], []
+        for worker, data in published.items():
+            data = json.loads(data)
+            if data["at"] < oldest:
+                stale.append(worker)
+            else:
+                snapshots.append(data["metrics"])
+        if stale:
+            try:
+                self.state.hdel("metrics", *stale)
+            except StateError:
+                pass
+        return render_metrics(snapshots)
+
+    def other_hosts(self):
+        """Hosts other than this one whose workers have published lately"""
+        oldest = time.time() - 3 * self.interval
+        this_host = socket.gethostname()
+        hosts = set()
+        for worker, data in self.state.hgetall("metrics").items():
+            host = worker.rpartition(":")[0]
+            if host != this_host and json.loads(data)["at"] >= oldest:
+                hosts.add(host)
+        return sorted(hosts)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.publish()
+            except StateError as e:
+                logger.warning("Error publishing metrics: %s", e)
+
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"]
+)
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests handled", ["method", "route", "status"])
+STAGE_DURATION = Histogram(
+    "chat_stage_duration_seconds", "Time spent in each stage of a chat turn", ["stage"]
+)
+STAGE_ERRORS = Counter("chat_stage_errors_total", "Errors raised in each stage of a chat turn", ["stage"])
+
+
+@contextmanager
+def span(stage):
+    """Time a stage of request handling into the stage latency histogram"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage=stage)
@@ -0,0 +1,133 @@
+"""Cache of rendered HTML pages
+
+The chat page only changes with the language, the year in the footer, the
+content registry version and the template itself, so each page is rendered
+once and replaced only when one of them changes. The body is stored with a
+strong ETag and gzip (and brotli, if the `brotli` package is installed)
+copies compressed once at render time. A request then costs a dict lookup:
+304 if the browser already has the page, otherwise the precompressed body it
+accepts.
+
+Templates are checked for changes at most every CONTENT_CHECK_INTERVAL
+seconds, like the JSON content.
+"""
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import namedtuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from starlette.responses import Response
+
+from content_registry import CONTENT_CHECK_INTERVAL
+from observability import Counter
+from static_assets import accepted_encodings
+
+PAGE_CACHE_CONTROL = os.getenv("PAGE_CACHE_CONTROL", "no-cache")
+
+PAGE_REQUESTS = Counter("page_cache_requests_total", "Rendered page requests by cache result", ["result"])
+
+# One representation of a page: body, Content-Encoding and ETag
+Representation = namedtuple("Representation", ["body", "encoding", "etag"])
+
+
+def etag_matches(header, etag):
+    """Check an If-None-Match header against a strong ETag"""
+    if not header:
+        return False
+    candidates = {candidate.strip() for candidate in header.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+class RenderedPage:
+    """A rendered page with its precompressed copies"""
+
+    def __init__(self, html):
+        body = html.encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        # Each encoding is its own representation and needs its own strong ETag
+        self.representations = {None: Representation(body, None, f'"{digest}"')}
+        self.representations["gzip"] = Representation(gzip.compress(body, compresslevel=9, mtime=0), "gzip", f'"{digest}-gz"')
+        if brotli is not None:
+            self.representations["br"] = Representation(brotli.compress(body, quality=11), "br", f'"{digest}-br"')
+
+    def negotiate(self, accept_encoding):
+        """Pick the smallest representation the client accepts"""
+        accepted = accepted_encodings(accept_encoding or "")
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.representations:
+                return self.representations[encoding]
+        return self.representations[None]
+
+
+def page_response(page, request, headers=None):
+    """Answer a request for a rendered page, with 304 when the client's copy is current"""
+    representation = page.negotiate(request.headers.get("accept-encoding"))
+    headers = dict(headers or {})
+    headers.update({
+        "ETag": representation.etag,
+        "Cache-Control": PAGE_CACHE_CONTROL,
+        "Vary": "Accept-Encoding"
+    })
+    if etag_matches(request.headers.get("if-none-match"), representation.etag):
+        PAGE_REQUESTS.inc(result="not_modified")
+        return Response(status_code=304, headers=headers)
+
+    if representation.encoding:
+        headers["Content-Encoding"] = representation.encoding
+    return Response(content=representation.body, media_type="text/html; charset=utf-8", headers=headers)
+
+
+class PageCache:
+    """One rendered page per key, replaced when its version or a template changes"""
+
+    def __init__(self, template_dir="templates", check_interval=CONTENT_CHECK_INTERVAL):
+        self.template_dir = template_dir
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._pages = {}
+        self._template_version = None
+        self._next_check = 0
+
+    def get(self, key, version, render):
+        """Return the RenderedPage for a key, calling `render()` for its HTML if it is missing or stale"""
+        if time.monotonic() >= self._next_check:
+            self._check_templates()
+
+        cached = self._pages.get(key)
+        if cached is not None and cached[0] == version:
+            PAGE_REQUESTS.inc(result="hit")
+            return cached[1]
+
+        page = RenderedPage(render())
+        with self._lock:
+            self._pages[key] = (version, page)
+        PAGE_REQUESTS.inc(result="miss")
+        return page
+
+    def clear(self):
+        with self._lock:
+            self._pages = {}
+
+    def _check_templates(self):
+        with self._lock:
+            self._next_check = time.monotonic() + self.check_interval
+            version = self._scan_templates()
+            if version != self._template_version:
+                # Jinja reloads changed templates itself; the rendered pages go
+                self._template_version = version
+                self._pages = {}
+
+    def _scan_templates(self):
+        version = []
+        with os.scandir(self.template_dir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    version.append((entry.name, entry.stat().st_mtime_ns))
+        return tuple(sorted(version))
@@ -0,0 +1,274 @@
+"""Opt-in sampling profiler for individual requests
+
+A request is profiled when it carries the PROFILER_SECRET in the
+X-Profile-Token header, or at random for a PROFILER_SAMPLE_RATE share of
+requests. While at least one profiled request is in flight, a SIGALRM timer
+fires every PROFILER_INTERVAL seconds and records one stack per profiled
+request:
+
+* if the request's code is running at that moment, the stack of the event
+  loop thread, so CPU work such as JSON serialization shows up;
+* otherwise the chain of coroutines it is suspended in, ending in
+  "[await]", so time spent waiting on the LLM or the database shows up too.
+
+Samples are wall clock. Background threads (the lead queue, the history
+flusher) are not sampled.
+
+Finished profiles are kept in memory (the newest PROFILER_MAX_PROFILES) and
+exported as collapsed stacks for flamegraph.pl or as speedscope JSON through
+the /admin/profiles endpoints, which need the same token. When neither a
+sample rate nor a secret is configured the middleware is not installed and
+costs nothing; when it is, unprofiled requests cost one header scan.
+"""
+import asyncio
+import contextvars
+import hmac
+import itertools
+import json
+import logging
+import os
+import random
+import signal
+import threading
+import time
+from collections import Counter, deque
+
+from observability import Counter as MetricCounter
+
+logger = logging.getLogger(__name__)
+
+PROFILER_SAMPLE_RATE = float(os.getenv("PROFILER_SAMPLE_RATE", 0))
+PROFILER_SECRET = os.getenv("PROFILER_SECRET", "")
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL", 0.005))
+PROFILER_MAX_PROFILES = int(os.getenv("PROFILER_MAX_PROFILES", 200))
+PROFILER_HEADER = "x-profile-token"
+
+# Paths that are never profiled
+PROFILER_EXCLUDED_PREFIXES = ("/admin/profiles", "/metrics", "/health", "/static")
+
+# Every task step is run from asyncio's Handle._run; frames above it are the
+# server and event loop, the same for every sample, and left out
+TASK_STEP_FILE = os.path.join("asyncio", "events.py")
+
+PROFILES_CAPTURED = MetricCounter("profiles_captured_total", "Requests profiled, by what triggered it", ["trigger"])
+
+_current = contextvars.ContextVar("profile", default=None)
+
+
+def frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def running_stack(frame):
+    """Stack of a running frame, root first, starting at the task it runs in"""
+    codes = []
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name == "_run" and code.co_filename.endswith(TASK_STEP_FILE):
+            break
+        codes.append(code)
+        frame = frame.f_back
+    codes.reverse()
+    return tuple(frame_name(code) for code in codes)
+
+
+def awaiting_stack(coro):
+    """Stack of a suspended coroutine, following what each frame awaits"""
+    stack = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        stack.append(frame_name(frame.f_code))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    stack.append("[await]")
+    return tuple(stack)
+
+
+class Profile:
+    """Samples taken during one request"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, method, path, trigger):
+        self.id = f"{int(time.time())}-{next(self._ids)}"
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.started_at = time.time()
+        self.duration = None
+        self.samples = Counter()
+        self.tasks = []
+        self.tick = 0
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "trigger": self.trigger,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "samples": sum(self.samples.values())
+        }
+
+
+class Profiler:
+    """Decides which requests to profile and samples them"""
+
+    def __init__(self, sample_rate=PROFILER_SAMPLE_RATE, secret=PROFILER_SECRET,
+                 interval=PROFILER_INTERVAL, max_profiles=PROFILER_MAX_PROFILES):
+        self.sample_rate = sample_rate
+        self.secret = secret
+        self.interval = interval
+        self.profiles = deque(maxlen=max_profiles)
+        # Replaced rather than changed in place, as the signal handler may run at any time
+        self._active = ()
+        self._tick = 0
+        self._installed = False
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 or bool(self.secret)
+
+    def authorized(self, token):
+        """Check a token against the secret; always False when no secret is set"""
+        return bool(self.secret) and bool(token) and hmac.compare_digest(token, self.secret)
+
+    def trigger(self, scope):
+        """Return why a request should be profiled, or None"""
+        if scope["path"].startswith(PROFILER_EXCLUDED_PREFIXES):
+            return None
+        if self.secret:
+            for name, value in scope["headers"]:
+                if name == PROFILER_HEADER.encode() and self.authorized(value.decode("latin-1")):
+                    return "header"
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sample"
+        return None
+
+    def begin(self, scope, trigger):
+        if not self._install():
+            return None
+        profile = Profile(scope["method"], scope["path"], trigger)
+        profile.tasks.append(asyncio.current_task())
+        if not self._active:
+            signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+        self._active = self._active + (profile,)
+        return profile
+
+    def end(self, profile, started):
+        self._active = tuple(p for p in self._active if p is not profile)
+        if not self._active:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        profile.duration = time.perf_counter() - started
+        profile.tasks = []
+        self.profiles.append(profile)
+        PROFILES_CAPTURED.inc(trigger=profile.trigger)
+
+    def find(self, profile_id):
+        for profile in self.profiles:
+            if profile.id == profile_id:
+                return profile
+        return None
+
+    def aggregate(self, path=None):
+        """Samples of all kept profiles, optionally only for one path"""
+        samples = Counter()
+        for profile in self.profiles:
+            if path is None or profile.path == path:
+                samples.update(profile.samples)
+        return samples
+
+    def _install(self):
+        # Signal handlers can only be set from the main thread, where uvicorn runs the loop
+        if not self._installed:
+            if threading.current_thread() is not threading.main_thread():
+                logger.warning("Profiler disabled: the event loop is not in the main thread")
+                self.sample_rate, self.secret = 0, ""
+                return False
+            signal.signal(signal.SIGALRM, self._on_tick)
+            self._installed = True
+        return True
+
+    def _on_tick(self, signum, frame):
+        self._tick += 1
+        running = _current.get()
+        if running is not None:
+            # Child tasks (such as a streamed body) inherit the profile
+            task = asyncio.current_task()
+            if task is not None and task not in running.tasks:
+                running.tasks.append(task)
+            running.samples[running_stack(frame)] += 1
+            running.tick = self._tick
+
+        for profile in self._active:
+            if profile.tick == self._tick:
+                continue
+            # Not running: blame the deepest await of its unfinished tasks
+            stacks = [awaiting_stack(task.get_coro()) for task in profile.tasks if not task.done()]
+            if stacks:
+                profile.samples[max(stacks, key=len)] += 1
+
+
+class ProfilerMiddleware:
+    """ASGI middleware that profiles the requests the profiler picks
+
+    Installed innermost, so the route and everything it starts run in the
+    task (and context) the profile is started in.
+    """
+
+    def __init__(self, app, profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        trigger = self.profiler.trigger(scope) if scope["type"] == "http" else None
+        profile = self.profiler.begin(scope, trigger) if trigger else None
+        if profile is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile.id.encode())]
+            await send(message)
+
+        started = time.perf_counter()
+        token = _current.set(profile)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _current.reset(token)
+            self.profiler.end(profile, started)
+
+
+def to_collapsed(samples):
+    """Collapsed stack lines ("frame;frame;frame count"), as read by flamegraph.pl and speedscope"""
+    lines = [";".join(stack) + f" {count}" for stack, count in samples.most_common()]
+    return "\n".join(lines) + "\n"
+
+
+def to_speedscope(samples, name, interval=PROFILER_INTERVAL):
+    """A speedscope file with one sampled profile, weighted in milliseconds"""
+    frames = {}
+    stacks = []
+    weights = []
+    for stack, count in samples.most_common():
+        stacks.append([frames.setdefault(frame, len(frames)) for frame in stack])
+        weights.append(round(count * interval * 1000, 3))
+    return json.dumps({
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "alligator-profiler",
+        "shared": {"frames": [{"name": frame} for frame in frames]},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": round(sum(weights), 3),
+            "samples": stacks,
+            "weights": weights
+        }]
+    })
@@ -0,0 +1,65 @@
+"""System prompts loaded once from versioned template files
+
+Prompts live in prompts/system/<version>/<lang>.txt. They are read at
+startup, with indentation, trailing spaces and runs of blank lines stripped,
+and their token counts are computed once per language and exported as
+metrics. Set PROMPT_VERSION to switch to another directory of prompts.
+
+The system prompt is byte-for-byte the same on every turn of a language and
+always comes first in the message list, so providers that cache prompt
+prefixes can reuse it.
+"""
+import logging
+import os
+import re
+
+from context_window import count_tokens
+from observability import Gauge
+
+logger = logging.getLogger(__name__)
+
+PROMPT_DIR = os.getenv("PROMPT_DIR", "prompts/system")
+PROMPT_VERSION = os.getenv("PROMPT_VERSION", "v1")
+
+PROMPT_TOKENS = Gauge("system_prompt_tokens", "Tokens in the system prompt for each language", ["lang", "version"])
+
+BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def normalize_prompt(text):
+    """Strip indentation and trailing spaces and collapse runs of blank lines"""
+    lines = (line.strip() for line in text.strip().splitlines())
+    return BLANK_LINES.sub("\n\n", "\n".join(lines))
+
+
+class PromptRegistry:
+    """System prompt and its token count per language"""
+
+    def __init__(self, directory=PROMPT_DIR, version=PROMPT_VERSION, default_lang="en"):
+        self.version = version
+        self.default_lang = default_lang
+        self.prompts = {}
+        self.token_counts = {}
+
+        path = os.path.join(directory, version)
+        for name in sorted(os.listdir(path)):
+            lang, ext = os.path.splitext(name)
+            if ext != ".txt":
+                continue
+            with open(os.path.join(path, name), 'r', encoding='utf-8') as f:
+                prompt = normalize_prompt(f.read())
+            self.prompts[lang] = prompt
+            self.token_counts[lang] = count_tokens(prompt)
+            PROMPT_TOKENS.set(self.token_counts[lang], lang=lang, version=version)
+
+        if default_lang not in self.prompts:
+            raise FileNotFoundError(f"No {default_lang} system prompt in {path}")
+        logger.info("Loaded %s system prompts: %s", version, self.token_counts)
+
+    def get(self, lang):
+        """Return the system prompt for a language, falling back to the default language"""
+        prompt = self.prompts.get(lang)
+        if prompt is None:
+            logger.warning("No %s system prompt for %s, using %s", self.version, lang, self.default_lang)
+            return self.prompts[self.default_lang]
+        return prompt
@@ -0,0 +1,152 @@
+"""Cache of assistant replies for repeated questions
+
+Many sessions open with nearly the same message ("Bali", "what to pack for
+Tokyo?"). Replies are cached under (language, normalized message, hash of
+the last few history messages) with a TTL and LRU eviction. The cache lives
+in process memory and can optionally be backed by an SQLite file so that it
+survives restarts and is shared between workers on one host, or by the
+shared state backend so that it is shared between hosts as well.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from state_backend import StateError
+
+logger = logging.getLogger(__name__)
+
+# 0 turns the cache off
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 1000))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 24 * 3600))
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB", "")
+# Number of trailing history messages that are part of the cache key
+RESPONSE_CACHE_HISTORY_MESSAGES = int(os.getenv("RESPONSE_CACHE_HISTORY_MESSAGES", 2))
+
+
+def normalize_message(message):
+    """Normalize a message so trivial variations map to the same cache key"""
+    text = unicodedata.normalize("NFKC", message).casefold()
+    # Drop punctuation and symbols (including emoji), keep letters and digits
+    text = "".join(
+        " " if unicodedata.category(c)[0] in ("P", "S") else c
+        for c in text
+    )
+    return " ".join(text.split())
+
+
+def make_cache_key(lang, message, history, profile=None):
+    """Build the cache key for a message in the context of its history"""
+    context = {
+        "history": [
+            [msg["role"], msg["content"]]
+            for msg in history[-RESPONSE_CACHE_HISTORY_MESSAGES:]
+        ] if RESPONSE_CACHE_HISTORY_MESSAGES else [],
+        "profile": profile or {}
+    }
+    context_hash = hashlib.sha256(
+        json.dumps(context, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    ).hexdigest()[:16]
+    return f"{lang}:{context_hash}:{normalize_message(message)}"
+
+
+class ResponseCache:
+    """In-process LRU cache with TTL and an optional SQLite or shared state second tier"""
+
+    def __init__(self, max_size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, db_path=RESPONSE_CACHE_DB, state=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.state = state
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def get(self, key):
+        """Return the cached response for a key, or None"""
+        if not self.max_size:
+            self.misses += 1
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                response, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return response
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT response, expires_at FROM responses WHERE key = ? AND expires_at > ?",
+                    (key, now)
+                ).fetchone()
+                if row is not None:
+                    self._remember(key, row[0], row[1])
+                    self.hits += 1
+                    return row[0]
+
+            if self.state is None:
+                self.misses += 1
+                return None
+
+        # Not under the lock, so a slow state backend does not hold up other threads
+        try:
+            response, ttl = self.state.get_with_ttl(f"reply:{key}")
+        except StateError as e:
+            logger.warning("Error reading the shared response cache: %s", e)
+            response = None
+        with self._lock:
+            if response is None:
+                self.misses += 1
+                return None
+            # Kept locally no longer than the shared copy lives
+            self._remember(key, response, now + (ttl if ttl is not None else self.ttl))
+            self.hits += 1
+            return response
+
+    def set(self, key, response):
+        """Cache a response"""
+        if not self.max_size:
+            return
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, response, expires_at)
+            if self._db is not None:
+                self._writes += 1
+                with self._db:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO responses (key, response, expires_at) VALUES (?, ?, ?)",
+                        (key, response, expires_at)
+                    )
+                    # Drop expired rows now and then so the file stays small
+                    if self._writes % 500 == 0:
+                        self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+        if self.state is not None:
+            try:
+                self.state.set(f"reply:{key}", response, ttl=self.ttl)
+            except StateError as e:
+                logger.warning("Error writing the shared response cache: %s", e)
+
+    def _remember(self, key, response, expires_at):
+        self._entries[key] = (response, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
@@ -0,0 +1,379 @@
+"""Retention of conversation history
+
+Sessions with no new messages for CONVERSATION_TTL_DAYS are moved out of the
+conversation store into compressed JSONL archives, one line per session:
+
+    archives/<yyyy>/<mm>/<dd>/part-<run>-<n>.jsonl.gz
+
+partitioned by the day the session was last active. Sessions still kept as
+one JSON file each in the legacy conversations/ directory are archived the
+same way once the file is older than the TTL, and the file is removed.
+
+An index (archives/index.db) maps every archived session_id to its part file
+and line, so `load_archived` finds a conversation without scanning.
+
+Sessions are read in batches of RETENTION_BATCH_SIZE, so memory use does not
+depend on how many have expired. Part files are compressed and written by a
+pool of RETENTION_WORKERS threads with at most one batch per worker in
+flight, and a session is deleted only once its part file is on disk and
+indexed, and only if it is still idle at that point. Set ARCHIVE_COMPRESSION=zstd to use zstd when the zstandard package
+is installed.
+
+Run it once from the command line:
+
+    python retention.py [--ttl-days 90] [--legacy-dir conversations]
+
+or let the app run it every RETENTION_INTERVAL seconds. When several
+workers share the database, each round is run by whichever first takes a
+lease on it in the shared state.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from conversation_store import SQLiteConversationStore
+from migrate_conversations import iter_conversation_files, load_conversation_file
+from observability import Counter
+from state_backend import StateError
+
+logger = logging.getLogger(__name__)
+
+# 0 keeps conversations forever
+CONVERSATION_TTL_DAYS = float(os.getenv("CONVERSATION_TTL_DAYS", 90))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archives")
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "gzip")
+LEGACY_CONVERSATION_DIR = os.getenv("LEGACY_CONVERSATION_DIR", "conversations")
+# Seconds between runs in the app; 0 leaves retention to the command line
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", 3600))
+RETENTION_WORKERS = int(os.getenv("RETENTION_WORKERS", 4))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", 500))
+
+# Timestamps are stored as local time, like in the conversation store
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+EXTENSIONS = {"gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+
+SESSIONS_ARCHIVED = Counter("conversations_archived_total", "Sessions moved to the archive", ["source"])
+
+
+def open_part(path, mode="rt"):
+    """Open a part file, compressed with gzip or zstd depending on its extension"""
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("The zstandard package is needed for .zst archives")
+        return zstandard.open(path, mode, encoding="utf-8")
+    return gzip.open(path, mode, encoding="utf-8")
+
+
+def write_part(path, records):
+    """Write session records to a compressed JSONL part file
+
+    The file is written under a temporary name and renamed once complete, so
+    a part file is never seen half written. Returns (session_id, line,
+    last_active) for every record.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Keep the extension so open_part picks the same compression
+    tmp_path = os.path.join(os.path.dirname(path), "." + os.path.basename(path))
+    lines = []
+    with open_part(tmp_path, "wt") as f:
+        for line, record in enumerate(records):
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            lines.append((record["session_id"], line, record["last_active"]))
+    with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return lines
+
+
+class ArchiveIndex:
+    """Part file and line of every archived session"""
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS archived_sessions (
+                session_id TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                line INTEGER NOT NULL,
+                last_active TEXT NOT NULL,
+                archived_at TEXT NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def add(self, path, lines):
+        """Record the sessions written to a part file; `path` is relative to the archive"""
+        now = datetime.now().strftime(TIME_FORMAT)
+        with self._conn:
+            # A session archived twice after an interrupted run points at the newest copy
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO archived_sessions (session_id, path, line, last_active, archived_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(session_id, path, line, last_active, now) for session_id, line, last_active in lines]
+            )
+
+    def find(self, session_id):
+        """Return (path, line) for an archived session, or None"""
+        return self._conn.execute(
+            "SELECT path, line FROM archived_sessions WHERE session_id = ?",
+            (session_id,)
+        ).fetchone()
+
+    def close(self):
+        self._conn.close()
+
+
+def load_archived(session_id, archive_dir=ARCHIVE_DIR):
+    """Return the archived record of a session (messages, profile, last_active), or None"""
+    index_path = os.path.join(archive_dir, "index.db")
+    if not os.path.exists(index_path):
+        return None
+    index = ArchiveIndex(index_path)
+    try:
+        found = index.find(session_id)
+    finally:
+        index.close()
+    if found is None:
+        return None
+
+    path, line = found
+    with open_part(os.path.join(archive_dir, path)) as f:
+        for number, text in enumerate(f):
+            if number == line:
+                return json.loads(text)
+    return None
+
+
+class RetentionJob:
+    """Moves expired sessions from the conversation store to the archive"""
+
+    def __init__(self, store, ttl_days=CONVERSATION_TTL_DAYS, archive_dir=ARCHIVE_DIR,
+                 legacy_dir=LEGACY_CONVERSATION_DIR, compression=ARCHIVE_COMPRESSION,
+                 workers=RETENTION_WORKERS, batch_size=RETENTION_BATCH_SIZE, interval=RETENTION_INTERVAL,
+                 state=None):
+        # A cached store is bypassed for reads and told which sessions are gone
+        self.store = store
+        self.backend = getattr(store, "backend", store)
+        self.ttl_days = ttl_days
+        self.archive_dir = archive_dir
+        self.legacy_dir = legacy_dir
+        if compression == "zstd" and zstandard is None:
+            logger.warning("zstandard is not installed, archiving with gzip")
+            compression = "gzip"
+        self.extension = EXTENSIONS.get(compression, EXTENSIONS["gzip"])
+        self.workers = workers
+        self.batch_size = batch_size
+        self.interval = interval
+        self.state = state
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Run the job in a background thread every `interval` seconds"""
+        if self.ttl_days <= 0 or self.interval <= 0:
+            return
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="conversation-retention", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=30.0):
+        """Stop the background thread; a run in progress finishes its current batch"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run_once(self):
+        """Archive every expired session, returning counts per source"""
+        counts = {"store": 0, "legacy": 0}
+        if self.ttl_days <= 0:
+            return counts
+        cutoff = datetime.now() - timedelta(days=self.ttl_days)
+        cutoff_text = cutoff.strftime(TIME_FORMAT)
+        run_id = datetime.now().strftime("%Y%m%d%H%M%S")
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        index = ArchiveIndex(os.path.join(self.archive_dir, "index.db"))
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="archive") as pool:
+                counts["store"] = self._archive(
+                    pool, index, f"{run_id}-s", self._store_batches(cutoff),
+                    lambda keys: self._delete_from_store(keys, cutoff_text)
+                )
+                if self.legacy_dir and os.path.isdir(self.legacy_dir):
+                    counts["legacy"] = self._archive(
+                        pool, index, f"{run_id}-f", self._legacy_batches(cutoff), self._delete_files
+                    )
+            self.backend.prune_profiles(cutoff_text)
+        finally:
+            index.close()
+
+        SESSIONS_ARCHIVED.inc(counts["store"], source="store")
+        SESSIONS_ARCHIVED.inc(counts["legacy"], source="legacy")
+        logger.info("Archived expired conversations", extra=counts)
+        return counts
+
+    def _archive(self, pool, index, prefix, batches, delete):
+        """Write batches to part files in the pool, then index and delete them"""
+        archived = 0
+        in_flight = {}
+        part = 0
+
+        def settle(futures):
+            nonlocal archived
+            for future in futures:
+                path, keys = in_flight.pop(future)
+                try:
+                    lines = future.result()
+                except Exception as e:
+                    # The sessions stay where they are and are retried next run
+                    logger.error("Error writing archive %s: %s", path, e)
+                    continue
+                index.add(path, lines)
+                delete(keys)
+                archived += len(lines)
+
+        for records, keys in batches:
+            if self._stop.is_set():
+                break
+            # Sessions of a batch are split by the day they were last active
+            for day, day_records in self._by_day(records).items():
+                path = os.path.join(*day.split("-"), f"part-{prefix}-{part}{self.extension}")
+                part += 1
+                future = pool.submit(write_part, os.path.join(self.archive_dir, path), day_records)
+                in_flight[future] = (path, [keys[r["session_id"]] for r in day_records])
+            # Bounded memory: wait while every worker has a batch
+            while len(in_flight) >= self.workers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                settle(done)
+        settle(list(in_flight))
+        return archived
+
+    @staticmethod
+    def _by_day(records):
+        days = {}
+        for record in records:
+            days.setdefault(record["last_active"][:10], []).append(record)
+        return days
+
+    def _store_batches(self, cutoff):
+        """Yield batches of expired sessions from the store, with the session_id and last row of each"""
+        after = ""
+        while True:
+            expired = self.backend.expired_sessions(cutoff.strftime(TIME_FORMAT), after, self.batch_size)
+            if not expired:
+                return
+            records = [
+                {
+                    "session_id": session_id,
+                    "last_active": last_active,
+                    "messages": self.backend.load(session_id, last_id),
+                    "profile": self.backend.load_profile(session_id)
+                }
+                for session_id, last_active, last_id in expired
+            ]
+            after = expired[-1][0]
+            yield records, {session_id: (session_id, last_id) for session_id, _, last_id in expired}
+
+    def _legacy_batches(self, cutoff):
+        """Yield batches of expired legacy conversation files, with the path of each"""
+        cutoff_ts = cutoff.timestamp()
+        records, keys = [], {}
+        for session_id, path in iter_conversation_files(self.legacy_dir):
+            mtime = os.stat(path).st_mtime
+            if mtime >= cutoff_ts:
+                continue
+            history = load_conversation_file(path)
+            if history is None:
+                continue
+            records.append({
+                "session_id": session_id,
+                "last_active": datetime.fromtimestamp(mtime).strftime(TIME_FORMAT),
+                "messages": history,
+                "profile": {}
+            })
+            keys[session_id] = path
+            if len(records) >= self.batch_size:
+                yield records, keys
+                records, keys = [], {}
+        if records:
+            yield records, keys
+
+    def _delete_from_store(self, sessions, cutoff):
+        # Messages added since the session was read are not in the archive
+        deleted = self.backend.delete_sessions(sessions, cutoff)
+        self.store.forget(deleted)
+
+    @staticmethod
+    def _delete_files(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _take_round(self):
+        """Whether this worker runs the current round; with shared state, only one worker per database does"""
+        if self.state is None:
+            return True
+        database = os.path.abspath(getattr(self.backend, "path", ""))
+        # Held for most of an interval and not released, so the other workers skip this round
+        try:
+            return self.state.acquire(f"lease:retention:{socket.gethostname()}:{database}",
+                                      uuid.uuid4().hex, self.interval * 0.9)
+        except StateError as e:
+            logger.warning("Skipping conversation archiving, the state backend is down: %s", e)
+            return False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self._take_round():
+                continue
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error("Error archiving conversations: %s", e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive expired conversations")
+    parser.add_argument("--db", default=os.getenv("CONVERSATION_DB", "conversations.db"), help="SQLite database path")
+    parser.add_argument("--ttl-days", type=float, default=CONVERSATION_TTL_DAYS, help="Archive sessions idle for longer")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR, help="Directory for archives and their index")
+    parser.add_argument("--legacy-dir", default=LEGACY_CONVERSATION_DIR, help="Directory with <session_id>.json files")
+    parser.add_argument("--compression", choices=sorted(EXTENSIONS), default=ARCHIVE_COMPRESSION)
+    parser.add_argument("--workers", type=int, default=RETENTION_WORKERS, help="Threads compressing part files")
+    parser.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE, help="Sessions read per batch")
+    args = parser.parse_args()
+
+    store = SQLiteConversationStore(args.db)
+    try:
+        job = RetentionJob(
+            store, args.ttl_days, args.archive_dir, args.legacy_dir, args.compression,
+            args.workers, args.batch_size
+        )
+        start = time.perf_counter()
+        counts = job.run_once()
+    finally:
+        store.close()
+    print(f"Done in {time.perf_counter() - start:.1f}s: {counts['store']} sessions from the store, "
+          f"{counts['legacy']} legacy files archived")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""Incremental traveller profile per chat session
+
+Each message is scanned for what it adds to the picture (destination,
+travel dates, party size, budget, interests, contact) and only that delta
+is merged into the session's profile, which the conversation store keeps
+next to the history. The model is given the merged profile as one compact
+context block instead of the client's user_info being pasted into every
+message.
+"""
+import re
+
+from destination_matcher import fold, tokenize
+
+# Fields shown to the client and the model; anything else is bookkeeping
+PROFILE_FIELDS = ("name", "destination", "dates", "adults", "children", "budget", "interests", "contact")
+# Fields the client may send in user_info
+CLIENT_FIELDS = ("name", "destination", "budget", "interests")
+# Limits on what the client may send, since it ends up in every prompt
+CLIENT_MAX_LENGTH = 100
+CLIENT_MAX_INTERESTS = 10
+
+# Folded word prefixes for each month; "=" marks words that must match
+# exactly. May is handled by MAY_PATTERN because "may" and the Romanian
+# "mai" (more) are common words.
+MONTHS = (
+    ("January", ("janu", "januar", "січн", "січен", "январ", "ianuar")),
+    ("February", ("febr", "лют", "феврал")),
+    ("March", ("march", "=marz", "березн", "березен", "=март", "марта", "martie")),
+    ("April", ("april", "квітн", "квітен", "апрел", "aprilie")),
+    ("May", ("травн", "травен", "=май", "=мая", "=мае")),
+    ("June", ("june", "juni", "червн", "червен", "июн", "iunie")),
+    ("July", ("july", "juli", "липн", "липен", "июл", "iulie")),
+    ("August", ("august", "серпн", "серпен")),
+    ("September", ("septem", "вересн", "вересен", "сентябр")),
+    ("October", ("octob", "oktob", "жовтн", "жовтен", "октябр")),
+    ("November", ("novem", "листопад", "ноябр", "noiem")),
+    ("December", ("decem", "dezem", "грудн", "грудень", "декабр")),
+)
+
+INTERESTS = (
+    ("beach", ("beach", "strand", "пляж", "plaj", "=sea", "seaside", "meer", "море", "морем", "морю")),
+    ("culture", ("cultur", "kultur", "культур", "museum", "muze", "музе", "history", "istori", "істор", "истор")),
+    ("adventure", ("adventur", "abenteuer", "пригод", "приключ", "aventur", "hiking", "wander", "drumet")),
+    ("food", ("food", "cuisine", "kuche", "кухн", "їж", "=еда", "mancar", "bucatari", "wine", "wein")),
+    ("relaxation", ("relax", "=spa", "wellness", "entspann", "відпоч", "отдых", "odihn")),
+    ("nightlife", ("nightlife", "party", "club", "нічн", "ночн")),
+    ("nature", ("nature", "natur", "природ", "mountain", "berg", "=гори", "=горы", "munt")),
+    ("shopping", ("shopping", "шопінг", "шопинг", "cumparatur")),
+    ("skiing", ("=ski", "skiing", "лиж", "лыж", "=schi")),
+)
+
+
+def _fold_table(table):
+    # Prefixes are compared with folded words, so fold them the same way, and
+    # split into exact words and a tuple for a single str.startswith call
+    folded = []
+    for label, prefixes in table:
+        prefixes = [fold(prefix) for prefix in prefixes]
+        exact = frozenset(prefix[1:] for prefix in prefixes if prefix.startswith("="))
+        starts = tuple(prefix for prefix in prefixes if not prefix.startswith("="))
+        folded.append((label, exact, starts))
+    return tuple(folded)
+
+
+MONTHS = _fold_table(MONTHS)
+INTERESTS = _fold_table(INTERESTS)
+
+MAY_PATTERN = re.compile(
+    r"\b(?:in|im|în|early|late|mid|anfang|ende|mitte|începutul|sfârșitul)\s+(?:may|mai)\b"
+    r"|\b(?:may|mai)\s+\d{1,2}\b|\b\d{1,2}\.?\s+(?:may|mai)\b",
+    re.IGNORECASE
+)
+DATE_PATTERN = re.compile(r"\b(\d{1,2}[./]\d{1,2}(?:[./]\d{2,4})?|\d{4}-\d{2}-\d{2})\b")
+ADULTS_PATTERN = re.compile(
+    r"(\d+)\s*(?:adults?|people|persons?|pax|travell?ers|erwachsene\w*|personen|доросл\w*|людей|осіб|"
+    r"взросл\w*|человек|adult\w*|persoane)",
+    re.IGNORECASE
+)
+CHILDREN_PATTERN = re.compile(
+    r"(\d+)\s*(?:kids?|child(?:ren)?|kinder\w*|kind|діт\w*|дитин\w*|дет\w*|ребен\w*|ребён\w*|copii|copil)",
+    re.IGNORECASE
+)
+# Thousands separated in groups of three ("1 500", "1.500,50") or none at all,
+# so that "June 15, 2000 EUR" does not run the day into the amount
+AMOUNT = r"\d{1,3}(?:[ .,]\d{3})+(?:[.,]\d{1,2})?|\d+(?:[.,]\d{1,2})?"
+BUDGET_PATTERN = re.compile(
+    rf"(?:(?P<before>€|\$|£)\s*(?P<amount1>{AMOUNT})(?P<k1>\s*k\b)?)"
+    rf"|(?:(?P<amount2>{AMOUNT})(?P<k2>\s*k\b)?\s*(?P<after>€|\$|£|eur\w*|usd|dollars?|дол\w*|грн|uah|гривень|lei|ron)(?!\w))",
+    re.IGNORECASE
+)
+CURRENCIES = {"€": "EUR", "$": "USD", "£": "GBP", "eur": "EUR", "usd": "USD", "dol": "USD", "дол": "USD",
+              "грн": "UAH", "uah": "UAH", "гри": "UAH", "lei": "RON", "ron": "RON"}
+
+
+def _match_prefixes(words, table):
+    unique = set(words)
+    found = []
+    for label, exact, starts in table:
+        if not exact.isdisjoint(unique) or any(word.startswith(starts) for word in unique):
+            found.append(label)
+    return found
+
+
+def _currency(symbol):
+    symbol = symbol.lower()
+    return CURRENCIES.get(symbol) or CURRENCIES.get(symbol[:3], symbol.upper())
+
+
+def extract_budget(message):
+    """Return the budget mentioned in a message as e.g. '2000 EUR', or None"""
+    match = BUDGET_PATTERN.search(message)
+    if not match:
+        return None
+    amount = re.sub(r"\s", "", match.group("amount1") or match.group("amount2"))
+    # One or two digits after the last separator are cents ("1,500.50", "2,5k"),
+    # three are thousands ("1.500")
+    whole, cents = re.fullmatch(r"(.+?)(?:[.,](\d{1,2}))?", amount).groups()
+    value = float(re.sub(r"[.,]", "", whole) + "." + (cents or "0"))
+    if match.group("k1") or match.group("k2"):
+        value *= 1000
+    return f"{int(value)} {_currency(match.group('before') or match.group('after'))}"
+
+
+def extract_profile_delta(message, destination=None, contact=None):
+    """Return the profile fields a message adds or changes
+
+    `contact` is the ContactMatch found in the message, if any.
+    """
+    words = tokenize(message)
+    delta = {}
+    if destination:
+        delta["destination"] = destination
+    if contact:
+        delta["contact"] = contact.value
+
+    # The phone number must not be read as a date, party size or budget
+    text = message.replace(contact.raw, " ") if contact else message
+
+    dates = _match_prefixes(words, MONTHS) + DATE_PATTERN.findall(text)
+    if MAY_PATTERN.search(text) and "May" not in dates:
+        dates.insert(0, "May")
+    if dates:
+        delta["dates"] = dates
+
+    adults = ADULTS_PATTERN.search(text)
+    if adults:
+        delta["adults"] = int(adults.group(1))
+    children = CHILDREN_PATTERN.search(text)
+    if children:
+        delta["children"] = int(children.group(1))
+
+    budget = extract_budget(text)
+    if budget:
+        delta["budget"] = budget
+
+    interests = _match_prefixes(words, INTERESTS)
+    if interests:
+        delta["interests"] = interests
+    return delta
+
+
+def _client_value(value):
+    # Only plain strings and numbers are accepted, and strings are capped
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        return None
+    if isinstance(value, str):
+        return value.strip()[:CLIENT_MAX_LENGTH] or None
+    return value
+
+
+def client_delta(user_info):
+    """Profile fields sent by the client in user_info"""
+    if not isinstance(user_info, dict):
+        return {}
+    delta = {}
+    for key in CLIENT_FIELDS:
+        value = user_info.get(key)
+        if key == "interests":
+            if isinstance(value, list):
+                interests = [_client_value(item) for item in value[:CLIENT_MAX_INTERESTS]]
+                value = [str(item) for item in interests if item is not None]
+            else:
+                value = None
+        else:
+            value = _client_value(value)
+        if value:
+            delta[key] = value
+    if delta.get("name") == "Not provided":
+        delta.pop("name")
+    return delta
+
+
+def merge_profile(profile, delta):
+    """Return the profile with a delta applied; interests accumulate, other fields are replaced"""
+    merged = dict(profile)
+    for key, value in delta.items():
+        if key == "interests":
+            merged[key] = list(dict.fromkeys(list(merged.get(key, [])) + list(value)))
+        else:
+            merged[key] = value
+    return merged
+
+
+def public_profile(profile):
+    """The profile fields that are shown to the client"""
+    return {key: profile[key] for key in PROFILE_FIELDS if key in profile}
+
+
+def render_profile(profile):
+    """Render the profile as one compact line for the prompt, or None if it is empty"""
+    parts = []
+    for key in ("name", "destination", "budget"):
+        if profile.get(key):
+            parts.append(f"{key}: {profile[key]}")
+    if profile.get("dates"):
+        parts.append(f"dates: {', '.join(profile['dates'])}")
+    for key in ("adults", "children"):
+        if profile.get(key):
+            parts.append(f"{key}: {profile[key]}")
+    if profile.get("interests"):
+        parts.append(f"interests: {', '.join(profile['interests'])}")
+    if profile.get("contact"):
+        # The model only needs to know not to ask again
+        parts.append("contact details: already provided")
+    if not parts:
+        return None
+    return "Known about the traveller: " + "; ".join(parts)
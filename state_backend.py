@@ -0,0 +1,507 @@
+"""Shared state for running several workers
+
+Session history, profiles, locks, rate limits, cached replies and metrics
+live in process memory by default, which is right for a single worker. To
+run more workers on one host, point STATE_BACKEND_URL at a Redis server (or
+anything speaking its protocol, such as the stand-in in
+benchmarks/fake_redis.py):
+
+    STATE_BACKEND_URL=redis://:password@127.0.0.1:6379/0
+
+and the app keeps that state there instead, so any worker can serve any
+turn of any session. It is not the source of truth for history and leads,
+which are still written to SQLite and CSV files on the host, so all the
+workers sharing a backend must run on one host (see gunicorn.conf.py).
+
+`MemoryStateBackend` and `RedisStateBackend` offer the same small set of
+operations: strings with an optional TTL, lists, hashes, a token bucket and
+a lease that only its holder can release. Values are str. The Redis client is
+a minimal RESP implementation on plain sockets with a connection pool, so no
+extra package is needed; every call blocks for at most STATE_TIMEOUT seconds
+and raises `StateError` when the server cannot be reached. Async code makes
+its calls through `run`, which for Redis moves them to a thread pool the size
+of the connection pool, so that they never block the event loop.
+"""
+import asyncio
+import functools
+import hashlib
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlparse
+
+STATE_BACKEND_URL = os.getenv("STATE_BACKEND_URL", "")
+STATE_KEY_PREFIX = os.getenv("STATE_KEY_PREFIX", "alligator:")
+STATE_TIMEOUT = float(os.getenv("STATE_TIMEOUT", 1.0))
+STATE_MAX_CONNECTIONS = int(os.getenv("STATE_MAX_CONNECTIONS", 16))
+# How long an idle session's history and profile stay in the shared state
+STATE_SESSION_TTL = float(os.getenv("STATE_SESSION_TTL", 24 * 3600))
+# Longer than any chat turn, so that a lock only expires if its worker died
+STATE_LOCK_TTL = float(os.getenv("STATE_LOCK_TTL", 120))
+
+# Atomic token bucket: returns "0" when a token was taken, else the seconds to wait
+TOKEN_BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return tostring(wait)
+"""
+
+# Create a list with the given items and TTL, unless the key already exists
+SEED_LIST_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+for i = 2, #ARGV, 1000 do
+  redis.call('RPUSH', KEYS[1], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+end
+if tonumber(ARGV[1]) > 0 then redis.call('PEXPIRE', KEYS[1], ARGV[1]) end
+return #ARGV - 1
+"""
+
+# Delete a lease only if it still holds the caller's token
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+class StateError(Exception):
+    """The shared state backend could not be reached or refused a command"""
+
+
+class StateBackend:
+    """Interface for shared state backends"""
+
+    # True when other processes see the same state
+    shared = False
+
+    async def run(self, func, *args):
+        """Call `func(*args)`, which makes state calls, without blocking the event loop"""
+        return func(*args)
+
+    def get(self, key):
+        """Return the string stored under a key, or None"""
+        raise NotImplementedError
+
+    def get_with_ttl(self, key):
+        """Return (value, seconds it has left) for a key; seconds is None if it does not expire"""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None, only_new=False):
+        """Store a string; with only_new, only if the key does not exist. Returns whether it was stored"""
+        raise NotImplementedError
+
+    def delete(self, *keys):
+        raise NotImplementedError
+
+    def push(self, key, values, ttl=None, only_existing=False, only_new=False):
+        """Append strings to a list, creating it unless only_existing; with only_new, only create it
+
+        Returns the new length, 0 if nothing was stored.
+        """
+        raise NotImplementedError
+
+    def items(self, key):
+        """Return the strings in a list, empty if there is none"""
+        raise NotImplementedError
+
+    def hset(self, key, field, value):
+        raise NotImplementedError
+
+    def hgetall(self, key):
+        raise NotImplementedError
+
+    def hdel(self, key, *fields):
+        raise NotImplementedError
+
+    def take_token(self, key, rate, burst):
+        """Take a token from a bucket refilled at `rate` per second; returns 0 or the seconds until one is free"""
+        raise NotImplementedError
+
+    def acquire(self, key, token, ttl):
+        """Take a lease on a key for `ttl` seconds; returns whether it was free"""
+        return self.set(key, token, ttl=ttl, only_new=True)
+
+    def release(self, key, token):
+        """Give up a lease, if it is still held with `token`"""
+        raise NotImplementedError
+
+    def ping(self):
+        """Check that the backend can be reached"""
+
+    def close(self):
+        """Release connections"""
+
+
+class MemoryStateBackend(StateBackend):
+    """State kept in this process, for a single worker and for tests"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> (value, expires_at or None); value is a str, list or dict
+        self._data = {}
+        self._writes = 0
+
+    def _live(self, key, now):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            del self._data[key]
+            return None
+        return entry[0]
+
+    def _store(self, key, value, ttl, now):
+        self._data[key] = (value, now + ttl if ttl else None)
+        # Expired keys are dropped on access; sweep the rest now and then
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            for stale in [k for k, (_, expires_at) in self._data.items() if expires_at is not None and expires_at <= now]:
+                del self._data[stale]
+
+    def get(self, key):
+        with self._lock:
+            value = self._live(key, time.time())
+        return value if isinstance(value, str) else None
+
+    def get_with_ttl(self, key):
+        now = time.time()
+        with self._lock:
+            value = self._live(key, now)
+            expires_at = self._data[key][1] if value is not None else None
+        if not isinstance(value, str):
+            return None, None
+        return value, expires_at - now if expires_at is not None else None
+
+    def set(self, key, value, ttl=None, only_new=False):
+        now = time.time()
+        with self._lock:
+            if only_new and self._live(key, now) is not None:
+                return False
+            self._store(key, value, ttl, now)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def push(self, key, values, ttl=None, only_existing=False, only_new=False):
+        now = time.time()
+        with self._lock:
+            items = self._live(key, now)
+            if items is None:
+                if only_existing:
+                    return 0
+                items = []
+            elif only_new:
+                return 0
+            items = items + list(values)
+            if ttl:
+                self._store(key, items, ttl, now)
+            else:
+                self._data[key] = (items, self._data.get(key, (None, None))[1])
+            return len(items)
+
+    def items(self, key):
+        with self._lock:
+            items = self._live(key, time.time())
+        return list(items) if isinstance(items, list) else []
+
+    def hset(self, key, field, value):
+        with self._lock:
+            fields = self._live(key, time.time())
+            if not isinstance(fields, dict):
+                fields = {}
+                self._data[key] = (fields, None)
+            fields[field] = value
+
+    def hgetall(self, key):
+        with self._lock:
+            fields = self._live(key, time.time())
+        return dict(fields) if isinstance(fields, dict) else {}
+
+    def hdel(self, key, *fields):
+        with self._lock:
+            current = self._live(key, time.time())
+            if isinstance(current, dict):
+                for field in fields:
+                    current.pop(field, None)
+
+    def take_token(self, key, rate, burst):
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._live(key, now) or (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._store(key, (tokens, now), burst / rate, now)
+        return wait
+
+    def release(self, key, token):
+        with self._lock:
+            if self._live(key, time.time()) == token:
+                del self._data[key]
+
+
+def encode_command(args):
+    """Encode a command as a RESP array of bulk strings"""
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def read_reply(reader):
+    """Read one RESP reply; errors are returned as StateError, not raised"""
+    line = reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("connection closed by the state backend")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b"+":
+        return payload.decode("utf-8")
+    if kind == b"-":
+        return StateError(payload.decode("utf-8", "replace"))
+    if kind == b":":
+        return int(payload)
+    if kind == b"$":
+        length = int(payload)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        if len(data) != length + 2:
+            raise ConnectionError("connection closed by the state backend")
+        return data[:-2].decode("utf-8")
+    if kind == b"*":
+        length = int(payload)
+        if length < 0:
+            return None
+        return [read_reply(reader) for _ in range(length)]
+    raise StateError(f"unexpected reply from the state backend: {line[:40]!r}")
+
+
+class RedisConnection:
+    """One socket to the server with a buffered reader"""
+
+    def __init__(self, host, port, timeout):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+
+    def send(self, commands):
+        """Send commands in one write"""
+        self.sock.sendall(b"".join(encode_command(args) for args in commands))
+
+    def read(self, count):
+        """Read the replies to `count` commands, in order"""
+        return [read_reply(self.reader) for _ in range(count)]
+
+    def execute(self, commands):
+        self.send(commands)
+        return self.read(len(commands))
+
+    def alive(self):
+        """Whether an idle connection is still open and has nothing unread"""
+        timeout = self.sock.gettimeout()
+        try:
+            self.sock.settimeout(0)
+            # Anything to read, even the end of the stream, means it cannot be reused
+            self.sock.recv(1, socket.MSG_PEEK)
+            return False
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        finally:
+            try:
+                self.sock.settimeout(timeout)
+            except OSError:
+                pass
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisStateBackend(StateBackend):
+    """State kept in a Redis server, shared by every worker that uses it"""
+
+    shared = True
+
+    def __init__(self, url, prefix=STATE_KEY_PREFIX, timeout=STATE_TIMEOUT, max_connections=STATE_MAX_CONNECTIONS):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.prefix = prefix
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._lock = threading.Lock()
+        self._idle = []
+        self._scripts = {}
+        # Calls from async code, at most one per connection
+        self._executor = None
+
+    async def run(self, func, *args):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.max_connections, thread_name_prefix="state")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(func, *args))
+
+    def _connect(self):
+        conn = RedisConnection(self.host, self.port, self.timeout)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        for reply in conn.execute(setup) if setup else ():
+            if isinstance(reply, StateError):
+                conn.close()
+                raise reply
+        return conn
+
+    def _execute(self, *commands):
+        """Run commands in one round trip and return their replies; a command error raises StateError"""
+        conn = None
+        with self._lock:
+            while self._idle and conn is None:
+                conn = self._idle.pop()
+                # Closed by the server while idle
+                if not conn.alive():
+                    conn.close()
+                    conn = None
+        for attempt in range(2):
+            sent = False
+            try:
+                if conn is None:
+                    conn = self._connect()
+                conn.send(commands)
+                sent = True
+                replies = conn.read(len(commands))
+                break
+            except (OSError, ConnectionError) as e:
+                if conn is not None:
+                    conn.close()
+                    conn = None
+                # Retry once only if the commands cannot have reached the
+                # server: after a timeout, or once they were sent, an RPUSH or
+                # a token bucket might run twice
+                if attempt or sent or isinstance(e, socket.timeout):
+                    raise StateError(f"state backend unavailable: {e}") from e
+        with self._lock:
+            if len(self._idle) < self.max_connections:
+                self._idle.append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
+
+        for reply in replies:
+            if isinstance(reply, StateError):
+                raise reply
+        return replies
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def _script(self, source, keys, args):
+        sha = self._scripts.get(source)
+        if sha is None:
+            sha = self._scripts[source] = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        try:
+            return self._execute(("EVALSHA", sha, len(keys), *keys, *args))[0]
+        except StateError as e:
+            if not str(e).startswith("NOSCRIPT"):
+                raise
+            # First use on this server: EVAL also loads it for next time
+            return self._execute(("EVAL", source, len(keys), *keys, *args))[0]
+
+    def get(self, key):
+        return self._execute(("GET", self._key(key)))[0]
+
+    def get_with_ttl(self, key):
+        value, milliseconds = self._execute(("GET", self._key(key)), ("PTTL", self._key(key)))
+        if value is None:
+            return None, None
+        return value, milliseconds / 1000 if milliseconds >= 0 else None
+
+    def set(self, key, value, ttl=None, only_new=False):
+        command = ["SET", self._key(key), value]
+        if ttl:
+            command += ["PX", int(ttl * 1000)]
+        if only_new:
+            command.append("NX")
+        return self._execute(tuple(command))[0] is not None
+
+    def delete(self, *keys):
+        if keys:
+            self._execute(("DEL", *(self._key(key) for key in keys)))
+
+    def push(self, key, values, ttl=None, only_existing=False, only_new=False):
+        key = self._key(key)
+        if only_new:
+            return self._script(SEED_LIST_SCRIPT, [key], [int(ttl * 1000) if ttl else 0, *values])
+        commands = [("RPUSHX" if only_existing else "RPUSH", key, *values)]
+        if ttl:
+            commands.append(("PEXPIRE", key, int(ttl * 1000)))
+        return self._execute(*commands)[0]
+
+    def items(self, key):
+        return self._execute(("LRANGE", self._key(key), 0, -1))[0]
+
+    def hset(self, key, field, value):
+        self._execute(("HSET", self._key(key), field, value))
+
+    def hgetall(self, key):
+        flat = self._execute(("HGETALL", self._key(key)))[0]
+        return dict(zip(flat[::2], flat[1::2]))
+
+    def hdel(self, key, *fields):
+        if fields:
+            self._execute(("HDEL", self._key(key), *fields))
+
+    def take_token(self, key, rate, burst):
+        return float(self._script(TOKEN_BUCKET_SCRIPT, [self._key(key)], [rate, burst]))
+
+    def release(self, key, token):
+        self._script(RELEASE_SCRIPT, [self._key(key)], [token])
+
+    def ping(self):
+        self._execute(("PING",))
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+        for conn in idle:
+            conn.close()
+
+
+def create_state_backend(url=STATE_BACKEND_URL):
+    """Create the state backend configured by STATE_BACKEND_URL; empty means this process only"""
+    if not url or url.startswith("memory:"):
+        return MemoryStateBackend()
+    if url.startswith("redis://"):
+        return RedisStateBackend(url)
+    raise ValueError(f"Unsupported STATE_BACKEND_URL: {url}")
@@ -0,0 +1,547 @@
+// Store session info
+let sessionId = localStorage.getItem('alligator_session_id') || generateSessionId();
+
+// Check if this is the first visit or if the language preference was already set
+const hasVisitedBefore = localStorage.getItem('alligator_has_visited_before');
+
+// If it's the first visit, set the language to Ukrainian
+if (!hasVisitedBefore) {
+    localStorage.setItem('alligator_preferred_lang', "uk");
+    localStorage.setItem('alligator_has_visited_before', 'true');
+}
+
+let currentLang = localStorage.getItem('alligator_preferred_lang') || "uk";
+let translations = {};
+
+// Save session ID in local storage
+localStorage.setItem('alligator_session_id', sessionId);
+// The server keeps what it learns about the trip; drop the copy older versions kept here
+localStorage.removeItem('alligator_user_info');
+// Save preferred language
+localStorage.setItem('alligator_preferred_lang', currentLang);
+
+// Fetch the translations for one language (cached by the browser via ETag)
+function loadTranslations(lang) {
+    if (translations[lang]) {
+        return Promise.resolve(translations[lang]);
+    }
+    return fetch(`/api/translations/${lang}`)
+        .then(response => response.json())
+        .then(data => {
+            translations[lang] = data;
+            return data;
+        });
+}
+
+// Generate a random session ID
+function generateSessionId() {
+    return 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, function(c) {
+        var r = Math.random() * 16 | 0, v = c == 'x' ? r : (r & 0x3 | 0x8);
+        return v.toString(16);
+    });
+}
+
+// Language selector - completely rewritten
+document.addEventListener('DOMContentLoaded', function() {
+    // Get language selector elements
+    const languageButton = document.querySelector('.language-button');
+    const languageMenu = document.querySelector('.language-menu');
+    const languageOptions = document.querySelectorAll('.language-option');
+
+    // Check if we need to redirect to the saved language if different from current
+    if (currentLang !== document.documentElement.lang) {
+        // Redirect to the page with the saved language
+        window.location.href = `/?lang=${currentLang}`;
+        return;
+    }
+
+    // Load translations for the current language
+    loadTranslations(currentLang)
+        .then(() => {
+            // Initial translation for destinations and CTA (in case server-side templates didn't catch everything)
+            updateDestinationsAndCTA(currentLang);
+        })
+        .catch(error => {
+            console.error('Error loading translations:', error);
+        });
+
+    // Toggle menu when button is clicked
+    languageButton.addEventListener('click', function(e) {
+        e.stopPropagation();
+        languageMenu.classList.toggle('active');
+
+        // Change arrow direction
+        const arrow = languageButton.querySelector('i');
+        if (languageMenu.classList.contains('active')) {
+            arrow.style.transform = 'rotate(180deg)';
+        } else {
+            arrow.style.transform = 'rotate(0)';
+        }
+    });
+
+    // Handle language selection
+    languageOptions.forEach(option => {
+        option.addEventListener('click', function(e) {
+            e.stopPropagation();
+
+            const newLang = this.getAttribute('data-lang');
+            if (newLang === currentLang) {
+                // Just close the menu if selecting the current language
+                languageMenu.classList.remove('active');
+                languageButton.querySelector('i').style.transform = 'rotate(0)';
+                return;
+            }
+
+            // Change language via API
+            fetch('/api/language', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({ lang: newLang }),
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (data.success) {
+                    // Update current language
+                    currentLang = newLang;
+
+                    // Save language preference in local storage
+                    localStorage.setItem('alligator_preferred_lang', currentLang);
+
+                    // Update selected states
+                    languageOptions.forEach(opt => {
+                        opt.classList.remove('selected');
+                    });
+                    this.classList.add('selected');
+
+                    // Update button text
+                    languageButton.querySelector('span').textContent = this.textContent;
+
+                    // Update UI language once its translations are loaded
+                    loadTranslations(newLang)
+                        .catch(error => console.error('Error loading translations:', error))
+                        .then(() => updateUILanguage(newLang, data.welcome_message));
+
+                    // Close the menu
+                    languageMenu.classList.remove('active');
+                    languageButton.querySelector('i').style.transform = 'rotate(0)';
+                }
+            })
+            .catch(error => {
+                console.error('Error changing language:', error);
+            });
+        });
+    });
+
+    // Close menu when clicking outside
+    document.addEventListener('click', function() {
+        languageMenu.classList.remove('active');
+        languageButton.querySelector('i').style.transform = 'rotate(0)';
+    });
+});
+
+// Chat functionality
+const sendBtn = document.querySelector('.send-btn');
+const chatInput = document.querySelector('.chat-input input');
+const chatMessages = document.querySelector('.chat-messages');
+
+// Send message when button is clicked
+sendBtn.addEventListener('click', () => {
+    sendMessage();
+});
+
+// Send message when Enter key is pressed
+chatInput.addEventListener('keypress', (e) => {
+    if (e.key === 'Enter') {
+        sendMessage();
+    }
+});
+
+function sendMessage() {
+    const message = chatInput.value.trim();
+    if (message) {
+        // Add user message to chat
+        addMessageToChat('user', message);
+
+        // Clear input
+        chatInput.value = '';
+
+        // Show typing indicator
+        const typingIndicator = document.createElement('div');
+        typingIndicator.classList.add('message', 'assistant', 'typing-indicator');
+        typingIndicator.innerHTML = '<span></span><span></span><span></span>';
+        chatMessages.appendChild(typingIndicator);
+
+        // Scroll to bottom
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+
+        // Call API and render the assistant response as it streams in
+        fetch('/api/chat/stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                message: message,
+                lang: currentLang,
+                session_id: sessionId
+            }),
+        })
+        .then(response => {
+            if (!response.ok || !response.body) {
+                throw new Error(`Chat request failed: ${response.status}`);
+            }
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let replyText = '';
+            let replyDiv = null;
+
+            function handleEvent(frame) {
+                let eventName = 'message';
+                let data = '';
+                frame.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) {
+                        eventName = line.slice(6).trim();
+                    } else if (line.startsWith('data:')) {
+                        data += line.slice(5).trim();
+                    }
+                });
+                if (!data) return;
+                const payload = JSON.parse(data);
+
+                if (eventName === 'meta') {
+                    // Update session ID
+                    if (payload.session_id) {
+                        sessionId = payload.session_id;
+                        localStorage.setItem('alligator_session_id', sessionId);
+                    }
+                } else if (eventName === 'token') {
+                    // Replace the typing indicator with the reply on the first token
+                    if (!replyDiv) {
+                        removeTypingIndicator();
+                        replyDiv = addMessageToChat('assistant', '');
+                    }
+                    replyText += payload.text;
+                    replyDiv.innerHTML = replyText.replace(/\n/g, '<br>');
+                    chatMessages.scrollTop = chatMessages.scrollHeight;
+                }
+            }
+
+            function read() {
+                return reader.read().then(({ done, value }) => {
+                    if (done) {
+                        removeTypingIndicator();
+                        return;
+                    }
+                    buffer += decoder.decode(value, { stream: true });
+
+                    // Events are separated by a blank line
+                    let boundary = buffer.indexOf('\n\n');
+                    while (boundary !== -1) {
+                        handleEvent(buffer.slice(0, boundary));
+                        buffer = buffer.slice(boundary + 2);
+                        boundary = buffer.indexOf('\n\n');
+                    }
+                    return read();
+                });
+            }
+
+            return read();
+        })
+        .catch(error => {
+            // Remove typing indicator
+            removeTypingIndicator();
+
+            // Add error message
+            addMessageToChat('assistant', 'Sorry, I encountered an error. Please try again later.');
+            console.error('Error:', error);
+        });
+    }
+}
+
+function removeTypingIndicator() {
+    const indicator = chatMessages.querySelector('.typing-indicator');
+    if (indicator) {
+        chatMessages.removeChild(indicator);
+    }
+}
+
+function addMessageToChat(role, content) {
+    const messageDiv = document.createElement('div');
+    messageDiv.classList.add('message', role);
+    messageDiv.innerHTML = content.replace(/\n/g, '<br>');
+    chatMessages.appendChild(messageDiv);
+
+    // Scroll to bottom
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+
+    return messageDiv;
+}
+
+// Function to update UI text based on selected language
+function updateUILanguage(lang, welcomeMessage) {
+    // Get translations for the selected language
+    const trans = translations[lang];
+    if (!trans) return;
+
+    // Update page title
+    document.querySelector('.tagline').textContent = trans.title;
+    document.querySelector('.subtitle').textContent = trans.subtitle;
+
+    // Update chat placeholder
+    document.querySelector('.chat-input input').placeholder = trans.input_placeholder;
+
+    // Update chat welcome message
+    const welcomeEl = document.querySelector('.chat-messages .message.assistant');
+    if (welcomeEl) {
+        welcomeEl.innerHTML = welcomeMessage.replace(/\n/g, '<br>');
+    }
+
+    // Update chat header
+    if (trans.chat_header) {
+        const headerTitle = document.querySelector('.chat-header-title');
+        const headerStatus = document.querySelector('.chat-header-status');
+
+        if (headerTitle) headerTitle.textContent = trans.chat_header.title;
+        if (headerStatus) headerStatus.textContent = trans.chat_header.status;
+    }
+
+    // Update chat intro
+    if (trans.chat_intro) {
+        const introTitle = document.querySelector('.chat-intro-title');
+        const introDesc = document.querySelector('.chat-intro-description');
+
+        if (introTitle) introTitle.textContent = trans.chat_intro.title;
+        if (introDesc) introDesc.textContent = trans.chat_intro.description;
+    }
+
+    // Update features
+    if (trans.features) {
+        const featureDestinations = document.querySelector('.feature-destinations');
+        const featureLanguages = document.querySelector('.feature-languages');
+        const featureItineraries = document.querySelector('.feature-itineraries');
+        const featureAvailability = document.querySelector('.feature-availability');
+
+        if (featureDestinations) featureDestinations.textContent = trans.features.destinations;
+        if (featureLanguages) featureLanguages.textContent = trans.features.languages;
+        if (featureItineraries) featureItineraries.textContent = trans.features.itineraries;
+        if (featureAvailability) featureAvailability.textContent = trans.features.availability;
+    }
+
+    // Update navigation
+    if (trans.main_nav) {
+        const navItems = document.querySelectorAll('.main-nav a');
+        if (navItems.length >= 3) {
+            navItems[0].textContent = trans.main_nav.chat;
+            navItems[1].textContent = trans.main_nav.destinations;
+            navItems[2].textContent = trans.main_nav.about;
+        }
+    }
+
+    // Update popular destinations heading if it exists
+    const destinationsHeading = document.querySelector('.destinations-heading');
+    if (destinationsHeading && trans.popular_destinations) {
+        destinationsHeading.textContent = trans.popular_destinations;
+    }
+
+    // Update destinations description if it exists
+    const destinationsDesc = document.querySelector('.destinations-description');
+    if (destinationsDesc && trans.destinations_description) {
+        destinationsDesc.textContent = trans.destinations_description;
+    }
+
+    // Update sidebar title if it exists
+    const sidebarTitle = document.querySelector('.sidebar-title');
+    if (sidebarTitle && trans.sidebar_title) {
+        sidebarTitle.textContent = trans.sidebar_title;
+    }
+
+    // Update call to action button if it exists
+    const ctaButton = document.querySelector('.cta-button');
+    if (ctaButton && trans.call_to_action) {
+        ctaButton.textContent = trans.call_to_action;
+    }
+
+    // Update destinations and CTA content
+    updateDestinationsAndCTA(lang);
+}
+
+// Function to update destinations and CTA content
+function updateDestinationsAndCTA(lang) {
+    const trans = translations[lang];
+    if (!trans || !trans.destinations || !trans.cta) return;
+
+    // Update Bali card
+    const baliTitle = document.querySelector('.destination-card:nth-child(1) .destination-title');
+    const baliDesc = document.querySelector('.destination-card:nth-child(1) .destination-desc');
+    const baliBestTime = document.querySelector('.destination-card:nth-child(1) .best-time span');
+    const baliExplore = document.querySelector('.destination-card:nth-child(1) .explore-btn span');
+
+    if (baliTitle) baliTitle.textContent = trans.destinations.bali.name;
+    if (baliDesc) baliDesc.textContent = trans.destinations.bali.description;
+    if (baliBestTime) baliBestTime.textContent = trans.destinations.bali.best_time;
+    if (baliExplore) baliExplore.textContent = trans.destinations.bali.explore;
+
+    // Update Barcelona card
+    const barcelonaTitle = document.querySelector('.destination-card:nth-child(2) .destination-title');
+    const barcelonaDesc = document.querySelector('.destination-card:nth-child(2) .destination-desc');
+    const barcelonaBestTime = document.querySelector('.destination-card:nth-child(2) .best-time span');
+    const barcelonaExplore = document.querySelector('.destination-card:nth-child(2) .explore-btn span');
+
+    if (barcelonaTitle) barcelonaTitle.textContent = trans.destinations.barcelona.name;
+    if (barcelonaDesc) barcelonaDesc.textContent = trans.destinations.barcelona.description;
+    if (barcelonaBestTime) barcelonaBestTime.textContent = trans.destinations.barcelona.best_time;
+    if (barcelonaExplore) barcelonaExplore.textContent = trans.destinations.barcelona.explore;
+
+    // Update Tokyo card
+    const tokyoTitle = document.querySelector('.destination-card:nth-child(3) .destination-title');
+    const tokyoDesc = document.querySelector('.destination-card:nth-child(3) .destination-desc');
+    const tokyoBestTime = document.querySelector('.destination-card:nth-child(3) .best-time span');
+    const tokyoExplore = document.querySelector('.destination-card:nth-child(3) .explore-btn span');
+
+    if (tokyoTitle) tokyoTitle.textContent = trans.destinations.tokyo.name;
+    if (tokyoDesc) tokyoDesc.textContent = trans.destinations.tokyo.description;
+    if (tokyoBestTime) tokyoBestTime.textContent = trans.destinations.tokyo.best_time;
+    if (tokyoExplore) tokyoExplore.textContent = trans.destinations.tokyo.explore;
+
+    // Update CTA section
+    const ctaTitle = document.querySelector('.cta-section h2');
+    const ctaDesc = document.querySelector('.cta-section p');
+    const ctaContact = document.querySelector('.cta-section .btn:first-child');
+    const ctaPackages = document.querySelector('.cta-section .btn:last-child');
+
+    if (ctaTitle) ctaTitle.textContent = trans.cta.title;
+    if (ctaDesc) ctaDesc.textContent = trans.cta.description;
+    if (ctaContact) ctaContact.textContent = trans.cta.contact;
+    if (ctaPackages) ctaPackages.textContent = trans.cta.view_packages;
+}
+
+// Handle destination click events
+document.querySelectorAll('.destination-card').forEach(card => {
+    card.addEventListener('click', function() {
+        const destinationName = this.querySelector('.destination-title').textContent;
+        // Use translated queries based on current language
+        if (currentLang === 'uk') {
+            chatInput.value = `Розкажіть мені більше про ${destinationName}`;
+        } else if (currentLang === 'ru') {
+            chatInput.value = `Расскажите мне больше о ${destinationName}`;
+        } else if (currentLang === 'de') {
+            chatInput.value = `Erzähle mir mehr über ${destinationName}`;
+        } else if (currentLang === 'ro') {
+            chatInput.value = `Spune-mi mai multe despre ${destinationName}`;
+        } else {
+            chatInput.value = `Tell me more about ${destinationName}`;
+        }
+        sendMessage();
+
+        // Scroll to chat
+        document.querySelector('.chat-container').scrollIntoView({ 
+            behavior: 'smooth' 
+        });
+    });
+});
+
+// Make destination cards keyboard accessible
+document.querySelectorAll('.explore-btn').forEach(btn => {
+    btn.addEventListener('click', function(e) {
+        e.preventDefault();
+        e.stopPropagation(); // Stop event from bubbling to card
+        const card = this.closest('.destination-card');
+        const destinationName = card.querySelector('.destination-title').textContent;
+
+        // Use translated queries based on current language
+        if (currentLang === 'uk') {
+            chatInput.value = `Розкажіть мені більше про ${destinationName}`;
+        } else if (currentLang === 'ru') {
+            chatInput.value = `Расскажите мне больше о ${destinationName}`;
+        } else if (currentLang === 'de') {
+            chatInput.value = `Erzähle mir mehr über ${destinationName}`;
+        } else if (currentLang === 'ro') {
+            chatInput.value = `Spune-mi mai multe despre ${destinationName}`;
+        } else {
+            chatInput.value = `Tell me more about ${destinationName}`;
+        }
+        sendMessage();
+
+        // Scroll to chat
+        document.querySelector('.chat-container').scrollIntoView({ 
+            behavior: 'smooth' 
+        });
+    });
+
+    btn.addEventListener('keypress', function(e) {
+        if (e.key === 'Enter') {
+            e.preventDefault();
+            // Trigger the click event on the button itself
+            this.click();
+        }
+    });
+});
+
+// Initialize chatbot with example queries
+const exampleQueriesEn = [
+    "What's the best time to visit Bali?",
+    "Recommend me a budget-friendly destination in Europe",
+    "What documents do I need for traveling to Japan?",
+    "Tell me about family-friendly activities in Barcelona"
+];
+
+const exampleQueriesUk = [
+    "Який найкращий час для відвідування Балі?",
+    "Порекомендуйте бюджетний напрямок у Європі",
+    "Які документи потрібні для подорожі до Японії?",
+    "Розкажіть про сімейні розваги в Барселоні"
+];
+
+const exampleQueriesRu = [
+    "Какое лучшее время для посещения Бали?",
+    "Порекомендуйте бюджетное направление в Европе",
+    "Какие документы нужны для путешествия в Японию?",
+    "Расскажите о семейных развлечениях в Барселоне"
+];
+
+const exampleQueriesDe = [
+    "Was ist die beste Reisezeit für Bali?",
+    "Empfehlen Sie mir ein günstiges Reiseziel in Europa",
+    "Welche Dokumente benötige ich für eine Reise nach Japan?",
+    "Erzählen Sie mir über familienfreundliche Aktivitäten in Barcelona"
+];
+
+const exampleQueriesRo = [
+    "Care este cel mai bun moment pentru a vizita Bali?",
+    "Recomandă-mi o destinație accesibilă în Europa",
+    "Ce documente am nevoie pentru a călători în Japonia?",
+    "Spune-mi despre activități pentru familii în Barcelona"
+];
+
+// Add example queries to chat input placeholder
+let currentPlaceholderIndex = 0;
+function rotatePlaceholders() {
+    let exampleQueries;
+
+    // Select the appropriate language queries
+    if (currentLang === 'uk') {
+        exampleQueries = exampleQueriesUk;
+    } else if (currentLang === 'ru') {
+        exampleQueries = exampleQueriesRu;
+    } else if (currentLang === 'de') {
+        exampleQueries = exampleQueriesDe;
+    } else if (currentLang === 'ro') {
+        exampleQueries = exampleQueriesRo;
+    } else {
+        exampleQueries = exampleQueriesEn;
+    }
+
+    chatInput.setAttribute('placeholder', exampleQueries[currentPlaceholderIndex]);
+    currentPlaceholderIndex = (currentPlaceholderIndex + 1) % exampleQueries.length;
+}
+
+// Change placeholder every 5 seconds
+setInterval(rotatePlaceholders, 5000);
+
+// Ensure the initial placeholder is in the current language
+currentPlaceholderIndex = 0;
+rotatePlaceholders();
@@ -0,0 +1,103 @@
+"""Serving of built static assets
+
+`build_assets.py` writes fingerprinted, precompressed copies of the CSS, JS
+and JSON files and resized WebP/AVIF variants of the images to
+`static/dist/`, together with a manifest. `AssetManifest` maps logical paths
+such as "css/main.css" to those files for the templates, and falls back to
+the original files when the build has not been run.
+`PrecompressedStaticFiles` serves the `.br`/`.gz` copies when the browser
+accepts them and marks fingerprinted files as immutable.
+"""
+import json
+import logging
+import os
+
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.staticfiles import StaticFiles
+
+logger = logging.getLogger(__name__)
+
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", 3600))
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Encodings we may have precompressed copies for, in order of preference
+PRECOMPRESSED_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+class AssetManifest:
+    """Lookup of built asset URLs for the templates"""
+
+    def __init__(self, path="static/dist/manifest.json", static_url="/static/"):
+        self.static_url = static_url
+        self.files = {}
+        self.images = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            self.files = manifest.get("files", {})
+            self.images = manifest.get("images", {})
+        except FileNotFoundError:
+            logger.info("No asset manifest at %s, serving unbuilt assets", path)
+        except Exception as e:
+            logger.error("Error loading asset manifest: %s", e)
+
+    def url(self, path):
+        """URL of a static file, fingerprinted if it has been built"""
+        return self.static_url + self.files.get(path, path)
+
+    def image_src(self, path):
+        """URL of the fallback image for browsers without srcset support"""
+        image = self.images.get(path)
+        return self.static_url + (image["src"] if image else path)
+
+    def image_srcset(self, path, image_format):
+        """srcset attribute value for one image format, or an empty string"""
+        image = self.images.get(path)
+        if not image:
+            return ""
+        variants = image.get("variants", {}).get(image_format, [])
+        return ", ".join(f"{self.static_url}{url} {width}w" for url, width in variants)
+
+
+def accepted_encodings(header):
+    """Parse an Accept-Encoding header into the set of acceptable encodings"""
+    encodings = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        if name and params not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            encodings.add(name.lower())
+    return encodings
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves precompressed copies and sets cache headers"""
+
+    async def get_response(self, path, scope):
+        accepted = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+
+        response = None
+        for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+            if encoding not in accepted:
+                continue
+            try:
+                response = await super().get_response(path + suffix, scope)
+            except HTTPException:
+                continue
+            if response.status_code in (200, 304):
+                # The content type is guessed from the original extension
+                response.headers["Content-Encoding"] = encoding
+                break
+            response = None
+
+        if response is None:
+            response = await super().get_response(path, scope)
+
+        response.headers["Vary"] = "Accept-Encoding"
+        if path.startswith("dist/") and not path.endswith("manifest.json"):
+            # Built files have a content hash in their name and never change
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response.headers["Cache-Control"] = f"public, max-age={STATIC_MAX_AGE}"
+        return response
@@ -0,0 +1,75 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import admission
+from admission import AdmissionController, RateLimiter, Rejected, client_ip
+from state_backend import MemoryStateBackend
+
+
+def allowed(limiter, key, attempts):
+    count = 0
+    for _ in range(attempts):
+        try:
+            limiter.check(key)
+            count += 1
+        except Rejected:
+            pass
+    return count
+
+
+def test_burst_then_rejected_with_retry_after():
+    limiter = RateLimiter("ip", 60, 3)
+    assert allowed(limiter, "10.0.0.1", 5) == 3
+    with pytest.raises(Rejected) as rejected:
+        limiter.check("10.0.0.1")
+    assert rejected.value.reason == "ip"
+    assert rejected.value.retry_after == 1
+
+
+def test_keys_have_separate_buckets():
+    limiter = RateLimiter("ip", 60, 2)
+    assert allowed(limiter, "10.0.0.1", 3) == 2
+    assert allowed(limiter, "10.0.0.2", 3) == 2
+
+
+def test_exempt_keys_and_zero_rate_are_not_limited():
+    assert allowed(RateLimiter("ip", 60, 1, exempt={"127.0.0.1"}), "127.0.0.1", 10) == 10
+    assert allowed(RateLimiter("ip", 0, 1), "10.0.0.1", 10) == 10
+
+
+def test_shared_buckets_hold_across_limiters():
+    state = MemoryStateBackend()
+    first, second = RateLimiter("ip", 60, 3, state=state), RateLimiter("ip", 60, 3, state=state)
+    assert allowed(first, "10.0.0.1", 2) + allowed(second, "10.0.0.1", 2) == 3
+
+
+def test_admission_queue_full_and_timeout():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=0.05)
+        slot = await controller.acquire()
+        waiter = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected) as full:
+            await controller.acquire()
+        assert full.value.reason == "queue_full"
+        with pytest.raises(Rejected) as timed_out:
+            await waiter
+        assert timed_out.value.reason == "queue_timeout"
+        slot.release()
+        slot.release()
+        assert controller.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_client_ip_ignores_addresses_sent_by_the_client(monkeypatch):
+    monkeypatch.setattr(admission, "TRUST_PROXY_HEADERS", True)
+    request = SimpleNamespace(headers={"x-forwarded-for": "1.2.3.4, 203.0.113.7, 10.0.0.2"},
+                              client=SimpleNamespace(host="10.0.0.1"))
+    assert client_ip(request) == "10.0.0.2"
+    monkeypatch.setattr(admission, "TRUSTED_PROXY_HOPS", 2)
+    assert client_ip(request) == "203.0.113.7"
+    monkeypatch.setattr(admission, "TRUST_PROXY_HEADERS", False)
+    assert client_ip(request) == "10.0.0.1"
@@ -0,0 +1,42 @@
+import json
+import os
+
+import pytest
+
+from contact_extractor import extract_contact
+
+CORPUS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "contact_corpus.jsonl")
+
+
+def load_corpus():
+    with open(CORPUS, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+@pytest.mark.parametrize("case", load_corpus(), ids=lambda case: case["message"][:40])
+def test_labelled_corpus(case):
+    contact = extract_contact(case["message"], case["lang"])
+    assert (contact.value if contact else None) == case["expected"]
+
+
+def test_email_is_normalized_and_located():
+    message = "You can reach me at John.Smith@Outlook.com."
+    contact = extract_contact(message, "en")
+    assert contact.kind == "email"
+    assert contact.value == "john.smith@outlook.com"
+    assert message[contact.start:contact.end] == contact.raw
+
+
+def test_phone_is_normalized_to_e164():
+    contact = extract_contact("call me (555) 123-4567 after 6pm", "en")
+    assert contact.kind == "phone"
+    assert contact.value == "+15551234567"
+
+
+@pytest.mark.parametrize("message", [
+    "3 people, 2 kids, budget 2000 EUR, June 15",
+    "Dates: 15.06.2024 - 25.06.2024",
+    "Flight number LH 1234, seat 23A",
+])
+def test_numbers_that_are_not_contacts(message):
+    assert extract_contact(message, "en") is None
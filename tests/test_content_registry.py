@@ -0,0 +1,22 @@
+import json
+
+from content_registry import ContentRegistry
+
+
+def write_content(tmp_path, translations):
+    translations_path = tmp_path / "translations.json"
+    destinations_path = tmp_path / "destinations.json"
+    translations_path.write_text(json.dumps(translations), encoding="utf-8")
+    destinations_path.write_text(json.dumps({lang: [] for lang in translations}), encoding="utf-8")
+    return ContentRegistry(str(translations_path), str(destinations_path))
+
+
+def test_unknown_language_falls_back_to_default(tmp_path):
+    registry = write_content(tmp_path, {"en": {"send": "Send"}, "uk": {"send": "Надіслати"}})
+    assert registry.get("xx") is registry.get("en")
+
+
+def test_no_fallback_when_asked_for_an_exact_language(tmp_path):
+    registry = write_content(tmp_path, {"en": {"send": "Send"}, "uk": {"send": "Надіслати"}})
+    assert registry.get("xx", fallback=False) is None
+    assert registry.get("uk", fallback=False).etag != registry.get("en").etag
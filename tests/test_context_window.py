@@ -0,0 +1,17 @@
+import sys
+import types
+
+import context_window
+
+
+def test_unknown_model_falls_back_to_cl100k(monkeypatch):
+    def encoding_for_model(model):
+        raise KeyError(model)
+
+    tiktoken = types.SimpleNamespace(encoding_for_model=encoding_for_model,
+                                     get_encoding=lambda name: types.SimpleNamespace(encode=lambda text: [name] * 3))
+    monkeypatch.setitem(sys.modules, "tiktoken", tiktoken)
+    monkeypatch.setattr(context_window, "_encoding", None)
+
+    assert context_window.count_tokens("hello") == 3
+    assert context_window.count_tokens("again") == 3
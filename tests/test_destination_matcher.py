@@ -0,0 +1,45 @@
+import pytest
+
+from destination_matcher import DestinationIndex, fold, slugify
+
+
+@pytest.fixture(scope="module")
+def index():
+    return DestinationIndex.from_files()
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("Hi! I want to go to Bali in June", ["bali"]),
+    ("Tell me about Tokyo nightlife and food markets", ["tokyo"]),
+    ("Хочу в Барселону", ["barcelona"]),
+    ("Ми вже були у Барселоні", ["barcelona"]),
+    ("Цікавлюся Іспанією", ["spain"]),
+    ("Поездка в Испании", ["spain"]),
+    ("Хочу до Туреччини", ["turkey"]),
+    ("в Таиланде", ["thailand"]),
+    ("vacanță în Spaniei", ["spain"]),
+    ("capitala Franței", ["france"]),
+])
+def test_names_and_inflected_forms(index, message, expected):
+    assert index.match(message) == expected
+
+
+@pytest.mark.parametrize("message", [
+    "we have 500 francs",
+    "Franco era architecture",
+    "italic font",
+    "spanish food",
+    "Germans are friendly",
+    "Japanese food",
+])
+def test_words_that_only_start_like_a_name(index, message):
+    assert not {"france", "italy", "spain", "germany", "japan"} & set(index.match(message))
+
+
+def test_destinations_in_order_of_appearance(index):
+    assert index.match("Tokyo first, then Bali, then Tokyo again") == ["tokyo", "bali"]
+
+
+def test_fold_and_slugify():
+    assert fold("Franța") == "franta"
+    assert slugify("New York") == "new-york"
@@ -0,0 +1,56 @@
+import pytest
+
+from destination_matcher import DestinationIndex
+from intent_router import INTENT_BUDGETS, IntentClassifier, IntentRouter
+
+
+@pytest.fixture(scope="module")
+def router():
+    return IntentRouter(DestinationIndex.from_files())
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("hi", "greeting"),
+    ("Привіт!", "greeting"),
+    ("hello, I want to go to Bali", "destination"),
+    ("Tell me about Tokyo nightlife and food markets", "destination"),
+    ("3 people, 2 kids, budget 2000 EUR, June 15", "other"),
+    ("qwerty zxcv asdf", "other"),
+    ("do i need a visa", "faq"),
+    ("plan a 10 day trip", "itinerary"),
+    ("Send me the program for the trip", "itinerary"),
+])
+def test_classify(router, message, intent):
+    assert router.classify(message) == intent
+
+
+@pytest.mark.parametrize("message", ["I work in programming", "a TV program about Bali"])
+def test_program_alone_is_not_an_itinerary(router, message):
+    assert router.classify(message) != "itinerary"
+
+
+def test_greeting_only_comes_from_the_rule(router):
+    for message in ["Tell me about nightlife and food markets", "3 people, 2 kids", "xyzzy plugh"]:
+        assert router.classify(message) != "greeting"
+        assert router.classifier.classify(message)[0] != "greeting"
+
+
+def test_unknown_words_do_not_make_the_classifier_confident():
+    classifier = IntentClassifier()
+    _, probability = classifier.classify("nightlife markets kids eur")
+    assert probability < 0.5
+
+
+def test_contact_with_itinerary_gets_the_itinerary_budget(router):
+    route = router.route("plan a 10 day trip, email me at anna@example.com", "en", contact="anna@example.com")
+    assert route.intent == "itinerary"
+    assert route.max_tokens == INTENT_BUDGETS["itinerary"][1]
+    assert route.reply is None
+
+
+def test_templated_replies(router):
+    assert router.route("hi", "en").reply is not None
+    assert router.route("hi", "en", history=[{"role": "user", "content": "hi"}]).reply is None
+    route = router.route("my email is anna@example.com", "en", contact="anna@example.com")
+    assert route.intent == "contact"
+    assert "anna@example.com" in route.reply
@@ -0,0 +1,36 @@
+import pytest
+
+from destination_matcher import DestinationIndex
+from knowledge_index import KnowledgeIndex
+
+
+@pytest.fixture(scope="module")
+def knowledge():
+    return KnowledgeIndex.from_file(DestinationIndex.from_files())
+
+
+@pytest.mark.parametrize("lang, message", [
+    ("en", "When is the best time to visit Bali?"),
+    ("en", "What are the top sights in Santorini?"),
+    ("de", "Wann ist die beste Reisezeit für Bali?"),
+    ("uk", "Коли найкращий час для подорожі на Балі?"),
+    ("ro", "Când este cea mai bună perioadă pentru Bali?"),
+])
+def test_covered_questions_are_answered_directly(knowledge, lang, message):
+    assert knowledge.lookup(message, lang).answer is not None
+
+
+@pytest.mark.parametrize("message", [
+    "What is the weather like in Bali in December?",
+    "Which month is cheapest for Bali flights?",
+    "When is the best time to visit Bali or Santorini?",
+    "Tell me about Bali",
+])
+def test_other_questions_go_to_the_model_with_snippets(knowledge, message):
+    result = knowledge.lookup(message, "en")
+    assert result.answer is None
+    assert any(snippet.startswith("Bali") for snippet in result.snippets)
+
+
+def test_unknown_language_has_no_results(knowledge):
+    assert knowledge.lookup("When is the best time to visit Bali?", "xx") == (None, [])
@@ -0,0 +1,115 @@
+import csv
+import threading
+import time
+
+import pytest
+
+from lead_queue import InMemorySheet, LeadQueue
+
+
+def lead(contact, **extra):
+    return dict({"name": "Anna", "contact": contact, "destination": "Bali", "language": "en"}, **extra)
+
+
+@pytest.fixture
+def make_queue(tmp_path):
+    queues = []
+
+    def make(sheet=None, **options):
+        sheet = sheet if sheet is not None else InMemorySheet()
+        options.setdefault("fallback_csv", str(tmp_path / "leads.csv"))
+        queue = LeadQueue(str(tmp_path / "queue.db"), sheet_factory=lambda: sheet, **options)
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.stop(timeout=1)
+
+
+def test_enqueued_leads_are_sent_in_batches(make_queue):
+    sheet = InMemorySheet()
+    queue = make_queue(sheet, batch_size=2)
+    for i in range(5):
+        assert queue.put(lead(f"guest{i}@example.com"))
+
+    assert queue.drain() == 5
+    assert [row[1] for row in sheet.rows] == [f"guest{i}@example.com" for i in range(5)]
+    assert sheet.calls == 3
+    assert queue.pending_count() == 0
+
+
+def test_put_without_contact_is_ignored(make_queue):
+    queue = make_queue()
+    assert not queue.put({"name": "Anna"})
+    assert queue.pending_count() == 0
+
+
+def test_contact_already_queued_is_not_queued_again(make_queue):
+    sheet = InMemorySheet()
+    queue = make_queue(sheet)
+    assert queue.put(lead("anna@example.com"))
+    assert not queue.put(lead("anna@example.com", destination="Tokyo"))
+    assert queue.pending_count() == 1
+
+    queue.drain()
+    assert len(sheet.rows) == 1
+    # Once sent, a later share of the same contact is a new lead
+    assert queue.put(lead("anna@example.com"))
+
+
+def test_concurrent_senders_claim_each_lead_once(make_queue):
+    sheet = InMemorySheet()
+    queues = [make_queue(sheet, batch_size=7) for _ in range(4)]
+    for i in range(200):
+        queues[i % 4].put(lead(f"guest{i}@example.com"))
+
+    threads = [threading.Thread(target=queue.drain) for queue in queues]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    contacts = [row[1] for row in sheet.rows]
+    assert len(contacts) == 200
+    assert len(set(contacts)) == 200
+
+
+def test_claimed_leads_are_not_handed_out_again(make_queue):
+    queue = make_queue(batch_size=10)
+    queue.put(lead("anna@example.com"))
+    assert len(queue._due_batch()) == 1
+    assert queue._due_batch() == []
+
+
+def test_failed_send_is_retried_with_backoff(make_queue):
+    sheet = InMemorySheet(fail_times=1)
+    queue = make_queue(sheet, retry_base_delay=60)
+    queue.put(lead("anna@example.com"))
+
+    queue.drain()
+    assert sheet.rows == []
+    (attempts, next_attempt_at), = queue._conn.execute("SELECT attempts, next_attempt_at FROM leads").fetchall()
+    assert attempts == 1
+    assert next_attempt_at > time.time() + 20
+
+    # Make it due now instead of waiting out the backoff
+    with queue._conn:
+        queue._conn.execute("UPDATE leads SET next_attempt_at = 0")
+    queue.drain()
+    assert [row[1] for row in sheet.rows] == ["anna@example.com"]
+    assert queue.pending_count() == 0
+
+
+def test_lead_falls_back_to_csv_after_max_attempts(make_queue, tmp_path):
+    sheet = InMemorySheet(fail_times=10)
+    queue = make_queue(sheet, max_attempts=2, retry_base_delay=0)
+    queue.put(lead("anna@example.com"))
+
+    queue.drain()
+    assert sheet.calls == 2
+    assert queue.pending_count() == 0
+    with open(tmp_path / "leads.csv", newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0][:2] == ["Name", "Contact"]
+    assert rows[1][1] == "anna@example.com"
@@ -0,0 +1,68 @@
+import csv
+import json
+
+import pytest
+
+import lead_recovery
+from conversation_store import SQLiteConversationStore
+from lead_queue import write_rows_to_csv
+from retention import RetentionJob
+
+
+def chat(text):
+    return [{"role": "user", "content": text}, {"role": "assistant", "content": "Sure!"}]
+
+
+@pytest.fixture
+def sources(tmp_path, monkeypatch):
+    monkeypatch.setattr(lead_recovery, "LEAD_FALLBACK_CSV", str(tmp_path / "contact_leads.csv"))
+    monkeypatch.setattr(lead_recovery, "LEAD_QUEUE_DB", str(tmp_path / "lead_queue.db"))
+    legacy_dir = tmp_path / "conversations"
+    legacy_dir.mkdir()
+    db_path = str(tmp_path / "conversations.db")
+    store = SQLiteConversationStore(db_path)
+    store.append("migrated", chat("Bali in June, write to anna@example.com"))
+    store.close()
+    # Migrated without --remove, so the file is still there
+    (legacy_dir / "migrated.json").write_text(json.dumps(chat("Bali in June, write to anna@example.com")))
+    (legacy_dir / "legacy.json").write_text(json.dumps(chat("Spain please, +380501234567")))
+    return db_path, str(tmp_path / "archives"), str(legacy_dir), str(tmp_path / "recovery")
+
+
+def test_plan_lists_legacy_files_once_without_sessions_in_the_db(sources):
+    db_path, archive_dir, legacy_dir, _ = sources
+    units = lead_recovery.plan_units(db_path, archive_dir, legacy_dir, 500, 64)
+    assert [unit["kind"] for unit in units] == ["db", "legacy"]
+    assert units[1]["files"] == ["legacy.json"]
+
+
+def test_sessions_are_counted_once_across_sources(sources):
+    db_path, archive_dir, legacy_dir, out_dir = sources
+    totals = lead_recovery.recover(db_path, archive_dir, legacy_dir, out_dir, workers=1)
+    assert totals["sessions"] == 2
+    assert totals["recovered_leads"] == 2
+    assert totals["duplicate_leads"] == 0
+
+
+def test_archived_sessions_still_in_the_db_are_counted_once(sources, tmp_path):
+    db_path, archive_dir, _, out_dir = sources
+    store = SQLiteConversationStore(db_path)
+    with store._conn:
+        store._conn.execute("UPDATE messages SET created_at = '2000-01-01 00:00:00'")
+    RetentionJob(store, ttl_days=30, archive_dir=archive_dir, legacy_dir=None).run_once()
+    store.append("migrated", chat("Bali again"))
+    store.close()
+
+    totals = lead_recovery.recover(db_path, archive_dir, None, out_dir, workers=1)
+    assert totals["sessions"] == 1
+
+
+def test_known_contacts_skip_the_header(tmp_path):
+    fallback = str(tmp_path / "contact_leads.csv")
+    write_rows_to_csv([["Anna", "anna@example.com", "Bali", "", "", "en", ""]], fallback)
+    export = tmp_path / "export.csv"
+    with open(export, "w", newline="") as f:
+        csv.writer(f).writerows([["Who", "Phone"], ["Ivan", "+380 50 123 45 67"]])
+
+    known = lead_recovery.load_known_contacts([fallback, str(export)], None)
+    assert known == {"anna@example.com", "+380501234567"}
@@ -0,0 +1,31 @@
+import json
+
+from conversation_store import SQLiteConversationStore
+from migrate_conversations import load_conversation_file, migrate
+
+
+def test_rerun_with_remove_deletes_files_already_migrated(tmp_path):
+    source = tmp_path / "conversations"
+    source.mkdir()
+    for session_id in ("a", "b"):
+        (source / f"{session_id}.json").write_text(json.dumps([{"role": "user", "content": session_id}]))
+    db_path = str(tmp_path / "conversations.db")
+
+    # Interrupted after writing, before the files were removed
+    assert migrate(str(source), db_path)["migrated"] == 2
+    counts = migrate(str(source), db_path, remove=True)
+
+    assert counts == {"migrated": 0, "skipped": 2, "failed": 0}
+    assert list(source.iterdir()) == []
+    store = SQLiteConversationStore(db_path)
+    assert store.load("a") == [{"role": "user", "content": "a"}]
+    store.close()
+
+
+def test_unreadable_files_are_logged(tmp_path, caplog, capsys):
+    path = tmp_path / "broken.json"
+    path.write_text("{not json")
+
+    assert load_conversation_file(str(path)) is None
+    assert "Skipping unreadable file" in caplog.text
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,18 @@
+import json
+import time
+
+from observability import SharedMetrics
+from state_backend import MemoryStateBackend
+
+
+def test_other_hosts_are_those_with_live_workers():
+    state = MemoryStateBackend()
+    metrics = SharedMetrics(state, interval=1)
+    metrics.start()
+    try:
+        metrics.publish()
+        state.hset("metrics", "web-2:10", json.dumps({"at": time.time(), "metrics": {}}))
+        state.hset("metrics", "web-3:11", json.dumps({"at": time.time() - 60, "metrics": {}}))
+        assert metrics.other_hosts() == ["web-2"]
+    finally:
+        metrics.stop()
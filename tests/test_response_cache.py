@@ -0,0 +1,10 @@
+from response_cache import ResponseCache
+from state_backend import MemoryStateBackend
+
+
+def test_size_zero_turns_the_cache_off():
+    state = MemoryStateBackend()
+    cache = ResponseCache(max_size=0, state=state)
+    cache.set("key", "reply")
+    assert cache.get("key") is None
+    assert state.get("reply:key") is None
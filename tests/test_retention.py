@@ -0,0 +1,71 @@
+import json
+import os
+import time
+
+import pytest
+
+from conversation_store import SQLiteConversationStore
+from retention import RetentionJob, load_archived
+
+
+def backdate(store, session_id, when="2000-01-01 00:00:00"):
+    with store._conn:
+        store._conn.execute("UPDATE messages SET created_at = ? WHERE session_id = ?", (when, session_id))
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteConversationStore(str(tmp_path / "conversations.db"))
+    yield store
+    store.close()
+
+
+def make_job(store, tmp_path, **options):
+    return RetentionJob(store, ttl_days=30, archive_dir=str(tmp_path / "archives"),
+                        legacy_dir=str(tmp_path / "conversations"), workers=2, batch_size=2, **options)
+
+
+def test_expired_sessions_are_archived_and_deleted(store, tmp_path):
+    for session_id in ("a", "b", "c"):
+        store.append(session_id, [{"role": "user", "content": f"hi from {session_id}"}])
+    store.save_profile("a", {"destination": "Bali"})
+    backdate(store, "a")
+    backdate(store, "b")
+
+    counts = make_job(store, tmp_path).run_once()
+
+    assert counts == {"store": 2, "legacy": 0}
+    assert store.load("a") == [] and store.load("b") == []
+    assert store.load_profile("a") == {}
+    assert store.load("c") == [{"role": "user", "content": "hi from c"}]
+    record = load_archived("a", str(tmp_path / "archives"))
+    assert record["messages"] == [{"role": "user", "content": "hi from a"}]
+    assert record["profile"] == {"destination": "Bali"}
+
+
+def test_messages_added_after_reading_are_kept(store):
+    store.append("a", [{"role": "user", "content": "old"}])
+    backdate(store, "a")
+    [(session_id, _, last_id)] = store.expired_sessions("2020-01-01 00:00:00")
+    store.append("a", [{"role": "user", "content": "new"}])
+
+    assert store.delete_sessions([(session_id, last_id)], "2020-01-01 00:00:00") == []
+    assert store.load("a") == [{"role": "user", "content": "old"}, {"role": "user", "content": "new"}]
+    assert store.load("a", last_id) == [{"role": "user", "content": "old"}]
+
+
+def test_legacy_files_are_archived(store, tmp_path):
+    legacy_dir = tmp_path / "conversations"
+    legacy_dir.mkdir()
+    path = legacy_dir / "old.json"
+    path.write_text(json.dumps([{"role": "user", "content": "hello"}]), encoding="utf-8")
+    past = time.time() - 60 * 86400
+    os.utime(path, (past, past))
+    (legacy_dir / "recent.json").write_text("[]", encoding="utf-8")
+
+    counts = make_job(store, tmp_path).run_once()
+
+    assert counts["legacy"] == 1
+    assert not path.exists()
+    assert (legacy_dir / "recent.json").exists()
+    assert load_archived("old", str(tmp_path / "archives"))["messages"] == [{"role": "user", "content": "hello"}]
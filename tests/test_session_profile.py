@@ -0,0 +1,60 @@
+import pytest
+
+from session_profile import (
+    CLIENT_MAX_LENGTH, client_delta, extract_budget, extract_profile_delta, merge_profile, render_profile
+)
+
+
+@pytest.mark.parametrize("message, budget", [
+    ("budget 2000 EUR", "2000 EUR"),
+    ("2000€", "2000 EUR"),
+    ("budget 2000 € please", "2000 EUR"),
+    ("€1,500.50", "1500 EUR"),
+    ("€1.500", "1500 EUR"),
+    ("$3k", "3000 USD"),
+    ("2,5k EUR", "2500 EUR"),
+    ("1 500 грн", "1500 UAH"),
+    ("5000 lei", "5000 RON"),
+    ("June 15, 2000 EUR", "2000 EUR"),
+    ("from 3.07, budget 1.200,50 €", "1200 EUR"),
+    ("we are 2 adults", None),
+])
+def test_extract_budget(message, budget):
+    assert extract_budget(message) == budget
+
+
+def test_extract_profile_delta():
+    delta = extract_profile_delta("3 people, 2 kids, budget 2000 EUR, June 15, beach and food", "Bali")
+    assert delta == {
+        "destination": "Bali",
+        "dates": ["June"],
+        "adults": 3,
+        "children": 2,
+        "budget": "2000 EUR",
+        "interests": ["beach", "food"],
+    }
+
+
+def test_client_delta_accepts_only_short_plain_values():
+    delta = client_delta({
+        "name": "x" * 1000,
+        "destination": {"$ne": None},
+        "budget": 2000,
+        "interests": ["beach", {"a": 1}, True, "y" * 500],
+    })
+    assert delta == {"name": "x" * CLIENT_MAX_LENGTH, "budget": 2000, "interests": ["beach", "y" * CLIENT_MAX_LENGTH]}
+    assert client_delta({"name": "Not provided", "interests": "beach"}) == {}
+    assert client_delta(None) == {}
+
+
+def test_message_wins_over_client_values():
+    profile = merge_profile({}, client_delta({"destination": "Spain", "interests": ["culture"]}))
+    profile = merge_profile(profile, extract_profile_delta("actually Bali, for the beach", "Bali"))
+    assert profile["destination"] == "Bali"
+    assert profile["interests"] == ["culture", "beach"]
+
+
+def test_render_profile():
+    assert render_profile({}) is None
+    line = render_profile({"destination": "Bali", "adults": 2, "contact": "+380501234567"})
+    assert line == "Known about the traveller: destination: Bali; adults: 2; contact details: already provided"
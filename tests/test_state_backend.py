@@ -0,0 +1,128 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from benchmarks.fake_redis import FakeRedis, start_fake_redis
+from conversation_store import SharedConversationStore, SQLiteConversationStore
+from response_cache import ResponseCache
+from state_backend import MemoryStateBackend, RedisStateBackend, StateError
+
+
+@pytest.fixture(scope="module")
+def server_loop():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield loop
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+
+
+def serve(loop, handler):
+    async def start():
+        server = await asyncio.start_server(handler, "127.0.0.1", 0)
+        return server, server.sockets[0].getsockname()[1]
+    return asyncio.run_coroutine_threadsafe(start(), loop).result(5)
+
+
+@pytest.fixture
+def fake(server_loop):
+    fake, server, port = asyncio.run_coroutine_threadsafe(start_fake_redis(), server_loop).result(5)
+    backend = RedisStateBackend(f"redis://127.0.0.1:{port}/0", timeout=0.5)
+    yield fake, backend
+    backend.close()
+    server_loop.call_soon_threadsafe(server.close)
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backend(request, fake):
+    return MemoryStateBackend() if request.param == "memory" else fake[1]
+
+
+def test_get_with_ttl(backend):
+    backend.set("a", "1", ttl=10)
+    backend.set("b", "2")
+    value, ttl = backend.get_with_ttl("a")
+    assert value == "1" and 9 < ttl <= 10
+    assert backend.get_with_ttl("b") == ("2", None)
+    assert backend.get_with_ttl("missing") == (None, None)
+
+
+def test_push_only_new_seeds_once(backend):
+    assert backend.push("list", ["#", "a"], ttl=10, only_new=True) == 2
+    assert backend.push("list", ["#", "b"], ttl=10, only_new=True) == 0
+    assert backend.items("list") == ["#", "a"]
+
+
+def test_run_off_the_event_loop(backend):
+    async def main():
+        await backend.run(backend.set, "k", "v")
+        return await backend.run(backend.get, "k")
+    assert asyncio.run(main()) == "v"
+
+
+def test_stale_idle_connection_is_replaced(server_loop):
+    fake, writers = FakeRedis(), []
+
+    async def handle(reader, writer):
+        writers.append(writer)
+        await fake.handle(reader, writer)
+
+    server, port = serve(server_loop, handle)
+    backend = RedisStateBackend(f"redis://127.0.0.1:{port}/0", timeout=0.5)
+    try:
+        backend.push("queue", ["a"])
+        for writer in writers:
+            server_loop.call_soon_threadsafe(writer.close)
+        time.sleep(0.1)
+        assert backend.push("queue", ["b"]) == 2
+        assert fake.data[b"alligator:queue"] == [b"a", b"b"]
+    finally:
+        backend.close()
+        server_loop.call_soon_threadsafe(server.close)
+
+
+def test_no_retry_after_a_timeout(server_loop):
+    connections = []
+
+    async def silent(reader, writer):
+        connections.append(writer)
+        while await reader.read(1024):
+            pass
+
+    server, port = serve(server_loop, silent)
+    backend = RedisStateBackend(f"redis://127.0.0.1:{port}/0", timeout=0.2)
+    try:
+        with pytest.raises(StateError):
+            backend.push("queue", ["a"])
+        # Sent once, on one connection
+        assert len(connections) == 1
+    finally:
+        backend.close()
+        server_loop.call_soon_threadsafe(server.close)
+
+
+def test_concurrent_history_loads_seed_once(fake, tmp_path):
+    _, backend = fake
+    store = SQLiteConversationStore(str(tmp_path / "c.db"))
+    store.append("s", [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}])
+    shared = SharedConversationStore(store, backend, flush_interval=0.05)
+    threads = [threading.Thread(target=shared.load, args=("s",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.items("history:s").count(SharedConversationStore.HISTORY_MARKER) == 1
+    assert len(shared.load("s")) == 2
+    shared.close()
+
+
+def test_shared_cache_hit_keeps_the_remaining_ttl():
+    state = MemoryStateBackend()
+    ResponseCache(state=state, ttl=100).set("key", "reply")
+    state.set("reply:key", "reply", ttl=5)
+    cache = ResponseCache(state=state, ttl=100)
+    assert cache.get("key") == "reply"
+    assert cache._entries["key"][1] - time.time() <= 5